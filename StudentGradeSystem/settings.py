@@ -43,6 +43,8 @@ INSTALLED_APPS = [
     'accounts',
     'lesson',
     'grade',
+    'search',
+    'profiling',
     'corsheaders',
     'oauth2_provider',
     'rest_framework',
@@ -57,12 +59,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'middleware.metrics.MetricsMiddleware',
+    'custom.query_budget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'profiling.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -99,6 +104,64 @@ DATABASES = {
     }
 }
 
+# use a shared backend (file based, database, memcached...) when running several workers,
+# cached transcripts are invalidated from signals of the worker that writes the grade
+CACHES = {
+    'default': {
+        'BACKEND': env('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': env('CACHE_LOCATION', default='sgs'),
+    }
+}
+
+# seconds a student transcript is cached; with the local memory cache (not shared,
+# invalidated by the writing process only) at most a minute
+TRANSCRIPT_CACHE_TIMEOUT = env.int('TRANSCRIPT_CACHE_TIMEOUT', default=60 * 60 * 24)
+
+# cached lesson/grade read responses: CACHES alias holding responses and model
+# generations (must be shared by all workers and management commands, e.g. file
+# based or Redis; local memory is refused) and seconds an entry is kept. Off
+# without an alias, 0 disables the cache
+RESPONSE_CACHE_ALIAS = env('RESPONSE_CACHE_ALIAS', default=None)
+RESPONSE_CACHE_TIMEOUT = env.int('RESPONSE_CACHE_TIMEOUT', default=300 if RESPONSE_CACHE_ALIAS else 0)
+
+# user summaries ({id, full_name, email, dateofbirth}) shown by expanded relations:
+# entries kept in the in-process LRU, seconds an entry is trusted (bounds staleness
+# across workers) and an optional CACHES alias used as a shared second tier
+USER_SUMMARY_CACHE_SIZE = env.int('USER_SUMMARY_CACHE_SIZE', default=10000)
+USER_SUMMARY_CACHE_TIMEOUT = env.int('USER_SUMMARY_CACHE_TIMEOUT', default=300)
+USER_SUMMARY_CACHE_ALIAS = env('USER_SUMMARY_CACHE_ALIAS', default=None)
+
+# request metrics (/metrics): directory shared by the gunicorn workers for
+# their samples (unset: this process only), seconds between writes of a
+# worker's samples and an optional bearer token required by /metrics
+METRICS_DIR = env('METRICS_DIR', default=None)
+METRICS_DUMP_INTERVAL = env.int('METRICS_DUMP_INTERVAL', default=5)
+METRICS_TOKEN = env('METRICS_TOKEN', default=None)
+
+# query budgets of the viewset actions (query_budgets): 'raise' fails the
+# request (tests), 'log' logs it with the repeated SQL, 'off' skips the check
+QUERY_BUDGET_MODE = env('QUERY_BUDGET_MODE', default='log' if DEBUG else 'off')
+
+# request profiling: off removes the middleware; share of requests profiled,
+# request header staff users send to profile a request ("X-Profile: 1"),
+# SQL statements kept per profile and profiles kept
+PROFILING_ENABLED = env.bool('PROFILING_ENABLED', default=False)
+PROFILING_SAMPLE_RATE = env.float('PROFILING_SAMPLE_RATE', default=0.0)
+PROFILING_HEADER = env('PROFILING_HEADER', default='X-Profile')
+PROFILING_MAX_QUERIES = 1000
+PROFILING_KEEP = env.int('PROFILING_KEEP', default=500)
+
+# seconds between checks whether another process changed profiles (typeahead index);
+# the changes are announced in the default cache, with a local memory cache (not
+# shared) the index is rebuilt instead once older than TYPEAHEAD_LOCAL_MAX_AGE
+TYPEAHEAD_SYNC_INTERVAL = 10
+TYPEAHEAD_LOCAL_MAX_AGE = env.int('TYPEAHEAD_LOCAL_MAX_AGE', default=300)
+
+# processes hashing passwords during bulk user provisioning through the API;
+# they are forked from the web worker, so by default passwords are hashed in
+# the worker itself (the provision_users command uses the cpu count)
+PROVISIONING_WORKERS = env.int('PROVISIONING_WORKERS', default=1)
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'oauth2_provider.contrib.rest_framework.OAuth2Authentication',
@@ -125,8 +188,21 @@ OAUTH2_PROVIDER = {
     'SCOPES': {'read': 'Read scope', 'write': 'Write scope', 'groups': 'Access to your groups'},
     'AUTHORIZATION_URL': env('DOMAIN') + '/o/authorize/',
     'TOKEN_URL': env('DOMAIN') + '/o/token/',
+    # cache validated access tokens (see accounts.tokens)
+    'OAUTH2_VALIDATOR_CLASS': 'accounts.tokens.CachedOAuth2Validator',
+    # manage.py cleartokens deletes expired tokens in batches, run it periodically (cron);
+    # expired access tokens bound to a refresh token are only removed once it expires,
+    # refresh tokens never expire unless REFRESH_TOKEN_EXPIRE_SECONDS is set (e.g. 2592000)
+    'REFRESH_TOKEN_EXPIRE_SECONDS': env.int('REFRESH_TOKEN_EXPIRE_SECONDS', default=None),
+    'CLEAR_EXPIRED_TOKENS_BATCH_SIZE': 5000,
+    'CLEAR_EXPIRED_TOKENS_BATCH_INTERVAL': 0.1,
 }
 
+# upper bound in seconds for a cached access token (never past its expiry);
+# with a per-process cache this is also how long a revoked token may still work
+# in the other workers
+ACCESS_TOKEN_CACHE_TIMEOUT = env.int('ACCESS_TOKEN_CACHE_TIMEOUT', default=60)
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -188,9 +264,13 @@ LOGGING = {
         },
     },
     'handlers': {
+        # rows are written in batches by a background thread, off the request path
         'db_log': {
             'level': 'INFO',
-            'class': 'django_db_logger.db_log_handler.DatabaseLogHandler'
+            'class': 'custom.log_handlers.BatchedDatabaseLogHandler',
+            'queue_size': env.int('DB_LOG_QUEUE_SIZE', default=10000),
+            'batch_size': 500,
+            'flush_interval': 1.0,
         },
     },
     'loggers': {
@@ -3,6 +3,7 @@ URL configuration for StudentGradeSystem project.
 """
 from django.contrib import admin
 from django.urls import path, include
+from middleware.metrics import metrics
 
 urlpatterns = [
     path('', include ('home.urls')),
@@ -10,10 +11,12 @@ urlpatterns = [
     path('api/students/', include ('accounts.student_urls')),
     path('api/lessons/', include ('lesson.urls')),
     path('api/grades/', include ('grade.urls')),
+    path('api/search/', include ('search.urls')),
     path('admin/', admin.site.urls),
     path('accounts/', include('accounts.urls')),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     path('o/', include('oauth2_provider.urls', namespace='oauth2_provider')),
+    path('metrics', metrics),
 ]
 
 handler403 = 'home.views.error403'
@@ -11,44 +11,38 @@ from rest_framework import permissions
 import logging
 from .models import Profile
 from lesson.models import Lesson
-from lesson.api import LessonSerializer
+from lesson.api import LessonSerializer, id_list
+from grade.transcripts import get_transcript
+from custom.relations import with_relations
+from custom.serializers import ExpandableFieldsMixin, ExpandableListSerializer
+from custom.pagination import KeysetPaginationMixin
+from custom.conditional import ConditionalGetMixin
+from functools import partial
 
 class IsAdminUser(permissions.BasePermission):
     def has_permission(self, request, view):
         return request.user and request.user.is_staff
 
 
-class StudentSerializer(serializers.ModelSerializer):
+class StudentSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     created_by = serializers.SerializerMethodField()
     updated_by = serializers.SerializerMethodField()
+    expandable_users = ['created_by', 'updated_by']
     class Meta:
         model = Profile
         fields = '__all__'
+        list_serializer_class = ExpandableListSerializer
 
     def get_created_by(self, obj):
-        if not obj.created_by:
-            return None
-        return {
-            'id': obj.created_by.id,
-            'full_name':self.user_full_name(obj.created_by),
-            'email': obj.created_by.email,
-            'dateofbirth': obj.created_by.profile.dateofbirth,
-        }
+        if not self.is_expanded('created_by'):
+            return obj.created_by_id
+        return self.user_summary(obj.created_by_id)
     
     def get_updated_by(self, obj):
-        if not obj.updated_by:
-            return None
-        return {
-            'id': obj.updated_by.id,
-            'full_name': self.user_full_name(obj.updated_by),
-            'email': obj.updated_by.email,
-            'dateofbirth': obj.updated_by.profile.dateofbirth,
-        }
+        if not self.is_expanded('updated_by'):
+            return obj.updated_by_id
+        return self.user_summary(obj.updated_by_id)
 
-    def user_full_name(self, obj):
-        name = obj.profile.name if obj.profile.name else ''
-        surname = obj.profile.surname if obj.profile.surname else ''
-        return name + ' ' + surname
 
 class StudentFilter(filters.FilterSet):
     class Meta:
@@ -60,19 +54,32 @@ class StudentFilter(filters.FilterSet):
             'identity_number': SearchConstants.STRING,
         }
 
-class StudentViewSet(viewsets.ModelViewSet):
+class StudentViewSet(ConditionalGetMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     queryset = Profile.objects.all()
     serializer_class = StudentSerializer
     filterset_class = StudentFilter
     authentication_classes = [OAuth2Authentication]
+    # most queries per action whatever the number of rows (custom.query_budget)
+    query_budgets = {
+        'list': 5,
+        'retrieve': 3,
+        'list_lessons': 6,
+    }
 
     def get_permissions(self):
-        if self.action == 'list_lessons' or self.action == 'retrieve' or self.action == 'get_own_profile':
+        if self.action == 'list_lessons' or self.action == 'retrieve' or self.action == 'get_own_profile' or self.action == 'transcript':
             permission_classes = [permissions.IsAuthenticated]
         else:
             permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
         return [permission() for permission in permission_classes]
 
+    def get_queryset(self):
+        '''
+        Profiles with the relations the requested fields read loaded up front.
+        '''
+        select, prefetch = StudentSerializer.request_plan(self.request)
+        return with_relations(Profile.objects.all(), select, prefetch).order_by('id')
+
     # return success with message
     def success(self, message):
         return Response({'success': True, 'message': message}, status=status.HTTP_200_OK)
@@ -84,7 +91,7 @@ class StudentViewSet(viewsets.ModelViewSet):
     # Get all Students (Profiles)
     def list(self, request, *args, **kwargs):
         try:
-            return super().list(request, *args, **kwargs)
+            return self.conditional_response(self.filter_queryset(self.get_queryset()), partial(super().list, request, *args, **kwargs))
         except Exception as e:
             logging.getLogger('db').exception(e)
             return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -93,10 +100,8 @@ class StudentViewSet(viewsets.ModelViewSet):
     # Get a Student (Profile) by User ID
     def retrieve_by_user_id(self, request, pk=None, *args, **kwargs):
         try:
-            queryset = Profile.objects.all()
-            student = get_object_or_404(queryset, user=pk)
-            serializer = StudentSerializer(student)
-            return Response(serializer.data)
+            queryset = self.get_queryset().filter(user=pk)
+            return self.conditional_response(queryset, lambda: Response(self.get_serializer(get_object_or_404(queryset)).data))
         except Exception as e:
             logging.getLogger('db').exception(e)
             return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -107,10 +112,8 @@ class StudentViewSet(viewsets.ModelViewSet):
         try:
             if not request.user.is_staff and request.user.id != pk:
                 return Response(status=status.HTTP_401_UNAUTHORIZED)
-            queryset = Profile.objects.all()
-            student = get_object_or_404(queryset, pk=pk)
-            serializer = StudentSerializer(student)
-            return Response(serializer.data)
+            queryset = self.get_queryset().filter(pk=pk)
+            return self.conditional_response(queryset, lambda: Response(self.get_serializer(get_object_or_404(queryset)).data))
         except Exception as e:
             logging.getLogger('db').exception(e)
             return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -119,10 +122,8 @@ class StudentViewSet(viewsets.ModelViewSet):
     # get own profile
     def get_own_profile(self, request, *args, **kwargs):
         try:
-            queryset = Profile.objects.all()
-            student = get_object_or_404(queryset, user=request.user)
-            serializer = StudentSerializer(student)
-            return Response(serializer.data)
+            queryset = self.get_queryset().filter(user=request.user)
+            return self.conditional_response(queryset, lambda: Response(self.get_serializer(get_object_or_404(queryset)).data))
         except Exception as e:
             logging.getLogger('db').exception(e)
             return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -231,10 +232,9 @@ class StudentViewSet(viewsets.ModelViewSet):
             lesson = Lesson.objects.filter(pk=lpk).first()
             if not lesson:
                 return self.fail('Lesson not found.')
-            if student.user in lesson.students.all():
+            if lesson.students.filter(pk=student.user_id).exists():
                 return self.fail('Student already added to lesson.')
-            lesson.students.add(student.user)
-            lesson.save()
+            lesson.students.add(student.user_id)
             return self.success('Lesson added to student.')
         except Exception as e:
             logging.getLogger('db').exception(e)
@@ -254,15 +254,69 @@ class StudentViewSet(viewsets.ModelViewSet):
             lesson = Lesson.objects.filter(pk=lpk).first()
             if not lesson:
                 return self.fail('Lesson not found.')
-            if not student.user in lesson.students.all():
+            if not lesson.students.filter(pk=student.user_id).exists():
                 return self.fail('Student is not added to lesson.')
-            lesson.students.remove(student.user)
-            lesson.save()
+            lesson.students.remove(student.user_id)
             return self.success('Lesson removed from student.')
         except Exception as e:
             logging.getLogger('db').exception(e)
             return Response(status=status.HTTP_400_BAD_REQUEST)
         
+    # add many lessons to student
+    def add_lessons(self, request, spk=None, *args, **kwargs):
+        '''
+        Add lessons to student.
+        @spk: student id
+        Body: {"lessons": [lesson id, ...]}
+        '''
+        try:
+            ids = id_list(request.data.get('lessons'))
+            if ids is None:
+                return self.fail('Lessons must be a list of ids.')
+            student = Profile.objects.filter(pk=spk).select_related('user').first()
+            if not student:
+                return self.fail('Student not found.')
+            found = set(Lesson.objects.filter(pk__in=ids).values_list('pk', flat=True))
+            enrolled = set(student.user.lesson_students.filter(pk__in=found).values_list('pk', flat=True))
+            added = found - enrolled
+            student.user.lesson_students.add(*added)
+            return Response({
+                'success': True,
+                'message': '%d lessons added to student.' % len(added),
+                'added': sorted(added),
+                'already_added': sorted(enrolled),
+                'not_found': sorted(set(ids) - found),
+            })
+        except Exception as e:
+            logging.getLogger('db').exception(e)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+    # remove many lessons from student
+    def remove_lessons(self, request, spk=None, *args, **kwargs):
+        '''
+        Remove lessons from student.
+        @spk: student id
+        Body: {"lessons": [lesson id, ...]}
+        '''
+        try:
+            ids = id_list(request.data.get('lessons'))
+            if ids is None:
+                return self.fail('Lessons must be a list of ids.')
+            student = Profile.objects.filter(pk=spk).select_related('user').first()
+            if not student:
+                return self.fail('Student not found.')
+            removed = set(student.user.lesson_students.filter(pk__in=ids).values_list('pk', flat=True))
+            student.user.lesson_students.remove(*removed)
+            return Response({
+                'success': True,
+                'message': '%d lessons removed from student.' % len(removed),
+                'removed': sorted(removed),
+                'not_in_lesson': sorted(set(ids) - removed),
+            })
+        except Exception as e:
+            logging.getLogger('db').exception(e)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
     # Get all lessons of student
     def list_lessons(self, request, spk=None, *args, **kwargs):
         '''
@@ -273,9 +327,28 @@ class StudentViewSet(viewsets.ModelViewSet):
             student = Profile.objects.filter(pk=spk).first()
             if not student:
                 return self.fail('Student not found.')
-            lessons = Lesson.objects.filter(students__in=[student.user])
-            serializer = LessonSerializer(lessons, many=True)
-            return Response(serializer.data)
+            select, prefetch = LessonSerializer.request_plan(request)
+            lessons = with_relations(Lesson.objects.filter(students=student.user_id), select, prefetch).order_by('id')
+            respond = lambda: self.keyset_response(lessons, lambda rows: LessonSerializer(rows, many=True, context=self.get_serializer_context()).data)
+            return self.conditional_response(lessons, respond, LessonSerializer)
+        except Exception as e:
+            logging.getLogger('db').exception(e)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+
+    # Get transcript of student
+    def transcript(self, request, spk=None, *args, **kwargs):
+        '''
+        Get final grade of each lesson, period averages and GPA of student.
+        @spk: student id
+        '''
+        try:
+            student = Profile.objects.filter(pk=spk).values('user_id').first()
+            if not student:
+                return self.fail('Student not found.')
+            if not request.user.is_staff and request.user.id != student['user_id']:
+                return Response(status=status.HTTP_401_UNAUTHORIZED)
+            return Response(get_transcript(student['user_id']))
         except Exception as e:
             logging.getLogger('db').exception(e)
             return Response(status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
@@ -0,0 +1,29 @@
+import json
+import os
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from accounts.provisioning import UserProvisioner
+from custom.rows import rows_from_csv
+
+class Command(BaseCommand):
+    help = 'Bulk create users and their profiles from a CSV file with a header row'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file: username, email, password (or password_hash), profile fields...')
+        parser.add_argument('--created-by', help='Username recorded as created_by of the profiles')
+        parser.add_argument('--chunk-size', type=int, help='Rows written per bulk insert (default: %d)' % UserProvisioner.CHUNK_SIZE)
+        parser.add_argument('--workers', type=int, help='Password hashing processes (default: cpu count)')
+
+    def handle(self, *args, **options):
+        created_by = None
+        if options.get('created_by'):
+            created_by = User.objects.filter(username=options['created_by']).first()
+            if not created_by:
+                raise CommandError('User %s not found' % options['created_by'])
+        provisioner = UserProvisioner(created_by, chunk_size=options.get('chunk_size'), workers=options.get('workers') or os.cpu_count())
+        with open(options['path'], encoding='utf-8-sig', newline='') as lines:
+            report = provisioner.run(rows_from_csv(lines))
+        for error in report['errors']:
+            self.stdout.write(self.style.WARNING('Row %d: %s' % (error['row'], json.dumps(error['errors']))))
+        self.stdout.write(self.style.SUCCESS('Created %d users, %d rows failed in %.1fs (%d rows/s)\n' % (
+            report['created'], report['failed'], report['seconds'], report['rows_per_second'])))
@@ -1,8 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
+from custom.summaries import user_summaries
 
 
 
@@ -25,6 +26,13 @@ class Profile(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     updated_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="profile_updated_by", null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['identity_number'], name='profile_identity_number_idx'),
+            models.Index(fields=['surname', 'name'], name='profile_surname_name_idx'),
+            models.Index(fields=['name'], name='profile_name_idx'),
+        ]
+
     def __str__(self):
         return "%s %s" % (self.name, self.surname)
 
@@ -34,12 +42,22 @@ def update_user_profile(sender, instance, created, admin_user=None, **kwargs):
     '''
     Updates profile of the user when user is created or updated.
     '''
+    user_summaries.invalidate(instance.pk)
     if created:
         Profile.objects.create(user=instance)
     else:
         instance.profile.save()
 
 
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_user_summary(sender, instance, **kwargs):
+    '''
+    Name and date of birth are part of the cached user summary.
+    '''
+    user_summaries.invalidate(instance.user_id)
 
 
-
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user_summary(sender, instance, **kwargs):
+    user_summaries.invalidate(instance.pk)
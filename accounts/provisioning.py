@@ -0,0 +1,184 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from custom.response_cache import bump_on_commit
+from search.index import index_users
+from search.typeahead import prefix_index
+from .models import Profile
+
+
+def setup_worker():
+    # spawned workers (non fork platforms) start without loaded apps
+    if not apps.ready:
+        django.setup()
+
+
+def hash_passwords(passwords):
+    return [make_password(password) for password in passwords]
+
+
+class UserProvisioner:
+    '''
+    Creates users with their profiles from rows, in chunks.
+
+    Each chunk checks its usernames with one query and is written with one
+    bulk_create for users and one for profiles, so no per-row signals run
+    (update_user_profile would insert every profile separately). Passwords
+    are hashed in a process pool, PBKDF2 is CPU bound; rows may carry an
+    already hashed `password_hash` instead, and rows without a password get
+    an unusable one. The whole run is one transaction.
+    '''
+    CHUNK_SIZE = 1000
+    MAX_ERRORS = 1000
+    # below this many passwords a chunk is hashed in process
+    POOL_THRESHOLD = 16
+    USER_FIELDS = ['username', 'email', 'first_name', 'last_name', 'is_staff', 'is_active']
+    PROFILE_FIELDS = ['name', 'surname', 'dateofbirth', 'phone', 'mobile', 'country', 'state', 'city', 'address', 'zip_code', 'identity_number']
+
+    def __init__(self, user=None, chunk_size=None, workers=None):
+        self.user = user
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        # never more processes than cpus, the API runs this inside a web worker
+        self.workers = max(1, min(workers or settings.PROVISIONING_WORKERS, os.cpu_count() or 1))
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+        self.usernames = set()
+        self.pool = None
+
+    def add_error(self, number, errors):
+        self.failed += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append({'row': number, 'errors': errors})
+
+    @staticmethod
+    def clean_values(model, row, names):
+        '''
+        Validate the given fields of a row with the model fields.
+        Returns (values, errors).
+        '''
+        values = {}
+        errors = {}
+        for name in names:
+            value = row.get(name)
+            if value is None or value == '':
+                continue
+            field = model._meta.get_field(name)
+            if isinstance(field, models.BooleanField) and isinstance(value, str):
+                value = value.strip().lower()
+                value = {'true': True, 'yes': True, '1': True, 'false': False, 'no': False, '0': False}.get(value, value)
+            try:
+                values[name] = field.clean(value, None)
+            except ValidationError as e:
+                errors[name] = e.messages
+        return values, errors
+
+    def clean(self, row, existing):
+        '''
+        Unsaved (user, profile, password) of a row, or a dict of field errors.
+        @existing: usernames of the chunk already in the database
+        '''
+        if '__invalid__' in row:
+            return {'row': ['Row is not a JSON object.']}
+        user_values, errors = self.clean_values(User, row, self.USER_FIELDS)
+        profile_values, profile_errors = self.clean_values(Profile, row, self.PROFILE_FIELDS)
+        errors.update(profile_errors)
+        username = user_values.get('username')
+        if not username and 'username' not in errors:
+            errors['username'] = ['This field is required.']
+        elif username in existing or username in self.usernames:
+            errors['username'] = ['A user with that username already exists.']
+        password = row.get('password') or None
+        password_hash = row.get('password_hash') or None
+        if password_hash:
+            try:
+                identify_hasher(password_hash)
+            except ValueError:
+                errors['password_hash'] = ['Unknown password hash format.']
+        if errors:
+            return errors
+        self.usernames.add(username)
+        user = User(**user_values)
+        user.password = password_hash or make_password(None)
+        profile = Profile(created_by=self.user, updated_by=self.user, **profile_values)
+        return user, profile, None if password_hash else password
+
+    def hash(self, passwords):
+        '''
+        Hashes of the given passwords, in the process pool for larger chunks.
+        '''
+        if len(passwords) < self.POOL_THRESHOLD or self.workers < 2:
+            return hash_passwords(passwords)
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=setup_worker)
+        size = -(-len(passwords) // self.workers)
+        parts = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+        return [hashed for part in self.pool.map(hash_passwords, parts) for hashed in part]
+
+    def provision_chunk(self, chunk):
+        usernames = [row.get('username') for _, row in chunk if '__invalid__' not in row and row.get('username')]
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        accounts = []
+        for number, row in chunk:
+            account = self.clean(row, existing)
+            if isinstance(account, tuple):
+                accounts.append(account)
+            else:
+                self.add_error(number, account)
+        plain = [(user, password) for user, _, password in accounts if password]
+        for (user, _), hashed in zip(plain, self.hash([password for _, password in plain])):
+            user.password = hashed
+        users = User.objects.bulk_create([user for user, _, _ in accounts], batch_size=self.chunk_size)
+        if any(user.pk is None for user in users):
+            # backends that do not return primary keys from bulk inserts
+            ids = dict(User.objects.filter(username__in=[user.username for user in users]).values_list('username', 'pk'))
+            for user in users:
+                user.pk = ids[user.username]
+        profiles = []
+        for user, profile, _ in accounts:
+            profile.user_id = user.pk
+            profiles.append(profile)
+        Profile.objects.bulk_create(profiles, batch_size=self.chunk_size)
+        # bulk_create sends no signals
+        index_users([user.pk for user in users])
+        self.created += len(accounts)
+
+    def run(self, rows):
+        '''
+        Provision all rows and return the report.
+        '''
+        started = time.monotonic()
+        rows = iter(rows)
+        try:
+            with transaction.atomic():
+                while True:
+                    chunk = list(islice(rows, self.chunk_size))
+                    if not chunk:
+                        break
+                    self.provision_chunk(chunk)
+            if self.created:
+                # profiles were created without signals
+                prefix_index.invalidate()
+                bump_on_commit('auth.User', 'accounts.Profile')
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+        seconds = time.monotonic() - started
+        total = self.created + self.failed
+        return {
+            'success': self.failed == 0,
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(total / seconds) if seconds else total,
+        }
@@ -1,3 +1,60 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from oauth2_provider.models import AccessToken
+from custom.testing import api_client
+from .tokens import CACHE_PREFIX
 
-# Create your tests here.
+
+class AccessTokenCacheTests(TestCase):
+    URL = '/api/lessons/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user')
+
+    def setUp(self):
+        cache.clear()
+        self.client = api_client(self.user, 'secret-token')
+        self.token = AccessToken.objects.get(token='secret-token')
+
+    def token_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.URL)
+        return response.status_code, len([query for query in queries if 'oauth2_provider_accesstoken' in query['sql']])
+
+    def cached(self):
+        return cache.get(CACHE_PREFIX + self.token.token_checksum) is not None
+
+    def test_cached(self):
+        self.assertEqual(self.token_queries(), (200, 1))
+        self.assertTrue(self.cached())
+        self.assertEqual(self.token_queries(), (200, 0))
+
+    def test_revoke(self):
+        self.client.get(self.URL)
+        self.token.revoke()
+        self.assertFalse(self.cached())
+        self.assertEqual(self.client.get(self.URL).status_code, 401)
+
+    def test_delete(self):
+        self.client.get(self.URL)
+        AccessToken.objects.get(pk=self.token.pk).delete()
+        self.assertFalse(self.cached())
+        self.assertEqual(self.client.get(self.URL).status_code, 401)
+
+    def test_token_saved(self):
+        self.client.get(self.URL)
+        self.token.scope = 'read'
+        self.token.save()
+        self.assertFalse(self.cached())
+
+    def test_user_deactivated(self):
+        self.client.get(self.URL)
+        self.user.is_active = False
+        self.user.save()
+        # the next request reads the changed user with the token
+        self.assertFalse(self.cached())
+        self.assertEqual(self.token_queries()[1], 1)
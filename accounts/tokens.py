@@ -0,0 +1,70 @@
+import hashlib
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from oauth2_provider.models import get_access_token_model, get_application_model
+from oauth2_provider.oauth2_validators import OAuth2Validator
+
+
+AccessToken = get_access_token_model()
+Application = get_application_model()
+CACHE_PREFIX = 'access-token:'
+
+
+def cache_key(token_checksum):
+    return '%s%s' % (CACHE_PREFIX, token_checksum)
+
+
+def invalidate_tokens(tokens):
+    cache.delete_many([cache_key(checksum) for checksum in tokens.values_list('token_checksum', flat=True)])
+
+
+class CachedOAuth2Validator(OAuth2Validator):
+    '''
+    Bearer token validation with the access token (and its user and
+    application) cached, so repeated requests skip the database.
+
+    An entry lives at most ACCESS_TOKEN_CACHE_TIMEOUT seconds and never past
+    the token's expiry; expiry and scopes are still checked on every
+    request. Entries are dropped when the token, its user or its
+    application is saved or deleted (revoking deletes the token). Other
+    workers only see the invalidation with a shared CACHES backend,
+    otherwise revocation takes effect there within the timeout.
+    '''
+
+    def _load_access_token(self, token):
+        key = cache_key(hashlib.sha256(token.encode('utf-8')).hexdigest())
+        access_token = cache.get(key)
+        if access_token is None:
+            access_token = super()._load_access_token(token)
+            if access_token is not None and access_token.expires:
+                timeout = min(settings.ACCESS_TOKEN_CACHE_TIMEOUT, int((access_token.expires - timezone.now()).total_seconds()))
+                if timeout > 0:
+                    cache.set(key, access_token, timeout)
+        return access_token
+
+
+@receiver(post_save, sender=AccessToken)
+@receiver(post_delete, sender=AccessToken)
+def invalidate_access_token(sender, instance, **kwargs):
+    cache.delete(cache_key(instance.token_checksum))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_tokens(sender, instance, created=False, **kwargs):
+    '''
+    Cached tokens carry the user (is_active, is_staff...).
+    '''
+    if not created:
+        invalidate_tokens(AccessToken.objects.filter(user_id=instance.pk))
+
+
+@receiver(post_save, sender=Application)
+@receiver(post_delete, sender=Application)
+def invalidate_application_tokens(sender, instance, created=False, **kwargs):
+    if not created:
+        invalidate_tokens(AccessToken.objects.filter(application_id=instance.pk))
@@ -0,0 +1,10 @@
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def is_shared(alias='default'):
+    '''
+    Whether a CACHES alias is seen by all processes: not local memory, which
+    each worker and management command has its own of.
+    '''
+    return not isinstance(caches[alias], LocMemCache)
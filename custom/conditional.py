@@ -0,0 +1,57 @@
+import hashlib
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.http import http_date, parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from .pagination import KeysetPagination
+from .summaries import user_summaries
+
+
+class ConditionalGetMixin:
+    '''
+    ETag / Last-Modified validators for read actions.
+
+    The validator of a response is computed with one aggregate query over
+    the queryset it shows (row count, latest updated_at of the rows and of
+    the expanded relations, see ExpandableFieldsMixin.validator_aggregates),
+    together with the request path, format and user. When If-None-Match
+    matches, 304 Not Modified is returned before anything is serialized.
+
+    The body is built without the per-process user summary LRU, which other
+    workers do not invalidate, so it always matches its validators. Keyset
+    (cursor) pages are served without validators: the aggregate would scan
+    the whole filtered queryset on every page.
+    '''
+
+    def validators(self, queryset, serializer_class=None):
+        '''
+        (etag, last modified) of a queryset as the request would show it.
+        '''
+        serializer_class = serializer_class or self.get_serializer_class()
+        fields, expand = serializer_class.requested(self.request)
+        values = queryset.order_by().aggregate(**serializer_class.validator_aggregates(fields, expand))
+        timestamps = [value for name, value in values.items() if name.startswith('modified') and value]
+        renderer = getattr(self.request, 'accepted_renderer', None)
+        key = [self.request.get_full_path(), getattr(renderer, 'format', None), self.request.user.pk, sorted(values.items())]
+        etag = hashlib.md5(json.dumps(key, cls=DjangoJSONEncoder).encode('utf-8')).hexdigest()
+        return quote_etag(etag), max(timestamps) if timestamps else None
+
+    def conditional_response(self, queryset, respond, serializer_class=None):
+        '''
+        respond() with validators, or 304 when the client's copy is current.
+        '''
+        if KeysetPagination.requested(self.request):
+            return respond()
+        etag, last_modified = self.validators(queryset, serializer_class)
+        if etag in parse_etags(self.request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            with user_summaries.shared_only():
+                response = respond()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
@@ -16,3 +16,10 @@ class SearchConstants:
     UUID=['exact','iexact','contains','icontains','in','gt','gte','lt','lte','startswith','istartswith','endswith','iendswith','isnull']
     DATE=['exact','iexact','gt','gte','lt','lte','year','month','day','week','week_day','quarter','range','in','isnull']
 
+
+class GradeConstants:
+    MIN_GRADE=0
+    MAX_GRADE=100
+    PASS_GRADE=50
+    HISTOGRAM_BUCKET_SIZE=10
+    GPA_SCALE=4.0
@@ -0,0 +1,138 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from django.db import close_old_connections
+from django_db_logger.config import DJANGO_DB_LOGGER_ENABLE_FORMATTER
+from django_db_logger.db_log_handler import DatabaseLogHandler, db_default_formatter
+
+
+class BatchedDatabaseLogHandler(DatabaseLogHandler):
+    '''
+    DatabaseLogHandler that writes StatusLog rows from a background thread.
+
+    emit() only formats the record and puts it in a bounded in-memory batch;
+    a worker thread bulk inserts the batch every `flush_interval` seconds, or
+    sooner once `batch_size` entries are waiting. Records equal to a waiting
+    one (logger, level, message, trace) are counted instead of queued and
+    written once with "(repeated N times)". When `queue_size` distinct
+    entries are waiting new ones are dropped, and the number dropped is
+    written as a warning with the next batch. close() (called by logging at
+    interpreter exit) flushes what is left.
+    '''
+
+    def __init__(self, level=0, queue_size=10000, batch_size=500, flush_interval=1.0):
+        super().__init__(level)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # (logger_name, level, msg, trace) -> count
+        self.pending = OrderedDict()
+        self.dropped = 0
+        self.condition = threading.Condition()
+        self.worker = None
+        self.pid = None
+        self.closed = False
+
+    def entry(self, record):
+        trace = None
+        if record.exc_info:
+            trace = db_default_formatter.formatException(record.exc_info)
+        if DJANGO_DB_LOGGER_ENABLE_FORMATTER:
+            msg = self.format(record)
+        else:
+            msg = record.getMessage()
+        return (record.name, record.levelno, msg, trace)
+
+    def start(self):
+        # threads do not survive a fork (gunicorn --preload), start one per process
+        self.pid = os.getpid()
+        self.pending.clear()
+        self.worker = threading.Thread(target=self.run, name='db-log-writer', daemon=True)
+        self.worker.start()
+
+    def emit(self, record):
+        try:
+            entry = self.entry(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self.condition:
+            if self.closed:
+                return
+            if self.pid != os.getpid():
+                self.start()
+            if entry in self.pending:
+                self.pending[entry] += 1
+            elif len(self.pending) < self.queue_size:
+                self.pending[entry] = 1
+                if len(self.pending) >= self.batch_size:
+                    self.condition.notify()
+            else:
+                self.dropped += 1
+
+    def take(self):
+        '''
+        Waiting entries and the dropped count, leaving the batch empty.
+        '''
+        batch, dropped = self.pending, self.dropped
+        self.pending = OrderedDict()
+        self.dropped = 0
+        return batch, dropped
+
+    def run(self):
+        while True:
+            with self.condition:
+                deadline = time.monotonic() + self.flush_interval
+                while not self.closed and len(self.pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                if self.closed:
+                    return
+                batch, dropped = self.take()
+            self.write(batch, dropped)
+
+    def write(self, batch, dropped):
+        if not batch and not dropped:
+            return
+        # the handler is created with the settings, before the apps are loaded
+        from django_db_logger.models import StatusLog
+        rows = []
+        for (logger_name, level, msg, trace), count in batch.items():
+            if count > 1:
+                msg = '%s (repeated %d times)' % (msg, count)
+            rows.append(StatusLog(logger_name=logger_name, level=level, msg=msg, trace=trace))
+        if dropped:
+            rows.append(StatusLog(
+                logger_name=__name__,
+                level=logging.WARNING,
+                msg='Dropped %d log records, the database log queue was full' % dropped,
+            ))
+        try:
+            close_old_connections()
+            StatusLog.objects.bulk_create(rows, batch_size=self.batch_size)
+        except Exception as e:
+            # the database may be what is failing; never log back into it
+            sys.stderr.write('Could not write %d log records to the database: %r\n' % (len(rows), e))
+
+    def flush(self):
+        '''
+        Write the waiting entries now, in the calling thread.
+        '''
+        with self.condition:
+            batch, dropped = self.take()
+        self.write(batch, dropped)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.worker is not None and self.worker.is_alive() and self.worker is not threading.current_thread():
+            self.worker.join(self.flush_interval + 5)
+        if self.pid == os.getpid():
+            self.flush()
+        super().close()
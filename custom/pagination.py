@@ -0,0 +1,179 @@
+import base64
+import json
+from collections import OrderedDict
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    '''
+    Keyset (seek) pagination over a fixed ordering.
+
+    Pages are selected with `WHERE (a, b) > (x, y)` style conditions instead of
+    OFFSET, so deep pages cost the same as the first one and no COUNT query is
+    run. Ordering fields are ascending with NULLs where the database sorts
+    them by default (last on PostgreSQL, first on SQLite and MySQL), so plain
+    btree indexes on the fields serve the ordering both ways; the last field
+    must be unique (usually id).
+    '''
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    mode_query_param = 'pagination'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering=('id',)):
+        self.ordering = tuple(ordering)
+
+    @classmethod
+    def requested(cls, request):
+        '''
+        Keyset pagination is opt-in with ?pagination=cursor (or any ?cursor=).
+        '''
+        return request.query_params.get(cls.mode_query_param) == 'cursor' or cls.cursor_query_param in request.query_params
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, values, reverse):
+        data = json.dumps({'v': values, 'r': reverse}, cls=DjangoJSONEncoder)
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            values, reverse = data['v'], bool(data['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def seek(self, values, reverse, nulls_largest=False):
+        '''
+        Condition for the rows after (or before, when reverse) a position.
+        @nulls_largest: whether the database sorts NULLs after all values
+        '''
+        condition = Q(pk__in=[])
+        equal = Q()
+        # NULLs come after the values in the scan direction
+        nulls_after = nulls_largest != reverse
+        lookup = '__lt' if reverse else '__gt'
+        for field, value in zip(self.ordering, values):
+            if value is None:
+                beyond = None if nulls_after else Q(**{field + '__isnull': False})
+            elif nulls_after:
+                beyond = Q(**{field + lookup: value}) | Q(**{field + '__isnull': True})
+            else:
+                beyond = Q(**{field + lookup: value})
+            if beyond is not None:
+                condition |= equal & beyond
+            equal &= Q(**{field + '__isnull': True}) if value is None else Q(**{field: value})
+        return condition
+
+    def position(self, item):
+        if isinstance(item, dict):
+            return [item[field] for field in self.ordering]
+        return [getattr(item, field) for field in self.ordering]
+
+    def page_queryset(self, queryset, values, reverse, size):
+        '''
+        Query of a page: the rows after (before) a position, one extra row
+        telling whether there are more.
+        '''
+        if reverse:
+            queryset = queryset.order_by(*[F(field).desc() for field in self.ordering])
+        else:
+            queryset = queryset.order_by(*[F(field).asc() for field in self.ordering])
+        if values is not None:
+            queryset = queryset.filter(self.seek(values, reverse, connections[queryset.db].features.nulls_order_largest))
+        return queryset[:size + 1]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        size = self.get_page_size(request)
+        values, reverse = self.decode_cursor(request)
+        rows = list(self.page_queryset(queryset, values, reverse, size))
+        more = len(rows) > size
+        rows = rows[:size]
+        if reverse:
+            rows.reverse()
+        self.has_next = more if not reverse else values is not None
+        self.has_previous = more if reverse else values is not None
+        self.first = self.position(rows[0]) if rows else values
+        self.last = self.position(rows[-1]) if rows else values
+        return rows
+
+    def get_link(self, values, reverse):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.mode_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(values, reverse))
+
+    def get_next_link(self):
+        if not self.has_next or self.last is None:
+            return None
+        return self.get_link(self.last, False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first is None:
+            return None
+        return self.get_link(self.first, True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class KeysetPaginationMixin:
+    '''
+    Viewset mixin that switches list actions to KeysetPagination on request.
+
+    Custom list actions call keyset_response() so they are paginated the
+    same way, and keep returning every row when keyset mode is not requested.
+    '''
+    keyset_ordering = ('id',)
+
+    @property
+    def paginator(self):
+        if KeysetPagination.requested(self.request):
+            if not isinstance(getattr(self, '_paginator', None), KeysetPagination):
+                self._paginator = KeysetPagination(self.keyset_ordering)
+            return self._paginator
+        return super().paginator
+
+    def keyset_response(self, queryset, serialize):
+        '''
+        Response of a custom list action.
+        @serialize: function turning the rows into response data
+        '''
+        if KeysetPagination.requested(self.request):
+            rows = self.paginator.paginate_queryset(queryset, self.request, view=self)
+            return self.paginator.get_paginated_response(serialize(rows))
+        return Response(serialize(queryset))
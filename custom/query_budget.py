@@ -0,0 +1,156 @@
+import logging
+import os
+import traceback
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from .summaries import user_summaries
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(request):
+    '''
+    (view name, action, budget) of a request; budget is None without one.
+
+    Budgets are declared on the viewsets as `query_budgets = {action:
+    queries}`, the most queries an action may run (authentication included)
+    whatever the number of rows it shows.
+    '''
+    match = getattr(request, 'resolver_match', None)
+    view = getattr(match.func, 'cls', None) if match else None
+    if view is None:
+        return None, None, None
+    action = (getattr(match.func, 'actions', None) or {}).get(request.method.lower())
+    return view.__name__, action, getattr(view, 'query_budgets', {}).get(action)
+
+
+class QueryTracer:
+    '''
+    Database execute wrapper keeping the SQL of a request with the project
+    stack frames that ran it.
+    '''
+
+    def __init__(self):
+        self.queries = []
+        self.root = str(settings.BASE_DIR) + os.sep
+
+    def __call__(self, execute, sql, params, many, context):
+        # project code only, without other execute wrappers (metrics, profiling)
+        frames = [frame for frame in traceback.extract_stack()[:-1]
+                  if frame.filename.startswith(self.root) and 'site-packages' not in frame.filename
+                  and not frame.line.startswith('return execute(')]
+        self.queries.append((sql, frames))
+        return execute(sql, params, many, context)
+
+    def duplicates(self):
+        '''
+        [(sql, times run, [distinct stacks])] of statements run more than once, most repeated first.
+        '''
+        stacks = defaultdict(list)
+        for sql, frames in self.queries:
+            stacks[sql].append(frames)
+        repeated = []
+        for sql, runs in stacks.items():
+            if len(runs) > 1:
+                distinct = []
+                for frames in runs:
+                    if frames not in distinct:
+                        distinct.append(frames)
+                repeated.append((sql, len(runs), distinct))
+        return sorted(repeated, key=lambda item: -item[1])
+
+    @staticmethod
+    def format_stack(frames):
+        return ''.join('    ' + line for line in traceback.format_list(frames[-8:])).rstrip()
+
+    def report(self, limit=5):
+        '''
+        Repeated statements with the code that ran them, or every statement when none repeats.
+        '''
+        duplicates = self.duplicates()
+        if not duplicates:
+            lines = ['Statements:']
+            for sql, frames in self.queries:
+                lines.append(sql)
+                lines.append(self.format_stack(frames[-1:]))
+            return '\n'.join(lines)
+        lines = ['Repeated statements:']
+        for sql, count, stacks in duplicates[:limit]:
+            lines.append('%dx %s' % (count, sql))
+            for frames in stacks[:3]:
+                lines.append(self.format_stack(frames))
+        return '\n'.join(lines)
+
+
+class QueryBudgetMiddleware:
+    '''
+    Checks the queries of each request against the query budget of its
+    viewset action. QUERY_BUDGET_MODE 'raise' (tests) fails the request
+    with QueryBudgetExceeded, 'log' (development) logs a warning; both show
+    the statements run more than once with the code that ran them (all
+    statements when none repeats). 'off' removes the middleware from the
+    chain.
+    '''
+
+    def __init__(self, get_response):
+        if settings.QUERY_BUDGET_MODE not in ('raise', 'log'):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        tracer = QueryTracer()
+        with connection.execute_wrapper(tracer):
+            response = self.get_response(request)
+        view, action, budget = query_budget(request)
+        if budget is not None and len(tracer.queries) > budget:
+            message = '%s.%s ran %d queries, its budget is %d (%s %s)\n%s' % (
+                view, action, len(tracer.queries), budget, request.method, request.get_full_path(), tracer.report())
+            if settings.QUERY_BUDGET_MODE == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+class QueryBudgetTestMixin:
+    '''
+    TestCase helpers checking that the queries of a request do not grow
+    with the number of rows it shows.
+    '''
+
+    def reset_caches(self):
+        # count the queries of a cold start, every cache layer missed
+        if settings.RESPONSE_CACHE_ALIAS:
+            caches[settings.RESPONSE_CACHE_ALIAS].clear()
+        caches['default'].clear()
+        user_summaries.clear()
+
+    def count_queries(self, request):
+        self.reset_caches()
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        self.assertEqual(response.status_code, 200, getattr(response, 'data', response))
+        return queries
+
+    def assertConstantQueries(self, request, seed, rows=5):
+        '''
+        Seed `rows` rows, run request(), seed up to 10 * `rows` and run it
+        again: the second run may not take more queries than the first.
+        @seed: function adding the given number of rows the request shows
+        '''
+        seed(rows)
+        few = self.count_queries(request)
+        seed(rows * 9)
+        many = self.count_queries(request)
+        if len(many) > len(few):
+            self.fail('%d queries with %d rows, %d with %d rows:\n%s' % (
+                len(few), rows, len(many), rows * 10, '\n'.join(query['sql'] for query in many.captured_queries)))
+        return len(many)
@@ -0,0 +1,26 @@
+from django.contrib.auth.models import User
+from django.db.models import Prefetch
+
+
+def users_with_profile():
+    '''
+    Users queryset with the profile joined in the same query.
+    '''
+    return User.objects.select_related('profile')
+
+
+def with_relations(queryset, select, prefetch):
+    '''
+    Apply a relation plan to a queryset.
+    @select: foreign key paths loaded with joins
+    @prefetch: many to many user paths, loaded with one extra query each;
+               a path ending in __profile loads the users with their profile
+    '''
+    if select:
+        queryset = queryset.select_related(*select)
+    for path in prefetch:
+        if path.endswith('__profile'):
+            queryset = queryset.prefetch_related(Prefetch(path[:-len('__profile')], queryset=users_with_profile()))
+        else:
+            queryset = queryset.prefetch_related(path)
+    return queryset
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import time
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+from .caches import is_shared
+
+
+GENERATION_PREFIX = 'response-generation:'
+RESPONSE_PREFIX = 'response:'
+# models whose writes change cached responses; the enrollment table changes
+# lesson students and counters
+TRACKED_MODELS = ['auth.User', 'accounts.Profile', 'lesson.Lesson', 'grade.Grade']
+TRACKED_RELATIONS = {'lesson.Lesson_students': 'lesson.Lesson'}
+
+
+def response_cache():
+    '''
+    Cache holding responses and generations, None when the cache is off.
+    '''
+    if not settings.RESPONSE_CACHE_ALIAS or not settings.RESPONSE_CACHE_TIMEOUT:
+        return None
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+@checks.register(checks.Tags.caches)
+def check_response_cache(app_configs, **kwargs):
+    '''
+    Generations bumped by one process must be seen by all of them, including
+    management commands: a local memory cache can not hold them.
+    '''
+    if response_cache() is not None and not is_shared(settings.RESPONSE_CACHE_ALIAS):
+        return [checks.Error(
+            'RESPONSE_CACHE_ALIAS %r is a local memory cache, it is not shared between processes.' % settings.RESPONSE_CACHE_ALIAS,
+            hint='Use a shared backend (file based, Redis, Memcached) or set RESPONSE_CACHE_TIMEOUT = 0.',
+            id='response_cache.E001',
+        )]
+    return []
+
+
+def generations(labels):
+    '''
+    Current generation of each model label, as a list in the given order.
+    A missing (new or evicted) generation starts at the current time, so it
+    never repeats a value older responses were stored with.
+    '''
+    cache = response_cache()
+    keys = [GENERATION_PREFIX + label for label in labels]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, time.time_ns(), None)
+            values[key] = cache.get(key)
+    return [values[key] for key in keys]
+
+
+def bump(*labels):
+    '''
+    Invalidate every cached response that depends on one of the models.
+    '''
+    cache = response_cache()
+    if cache is None:
+        return
+    for label in labels:
+        try:
+            cache.incr(GENERATION_PREFIX + label)
+        except ValueError:
+            cache.add(GENERATION_PREFIX + label, time.time_ns(), None)
+
+
+def bump_on_commit(*labels):
+    '''
+    Bump now, so reads later in this transaction miss, and again on commit:
+    a concurrent read between the two may have stored the old rows under the
+    first new generation.
+    '''
+    bump(*labels)
+    transaction.on_commit(lambda: bump(*labels))
+
+
+def model_changed(sender, **kwargs):
+    bump_on_commit(sender._meta.label)
+
+
+def relation_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_on_commit(TRACKED_RELATIONS[sender._meta.label])
+
+
+for label in TRACKED_MODELS:
+    post_save.connect(model_changed, sender=label, dispatch_uid='response-cache-save-' + label)
+    post_delete.connect(model_changed, sender=label, dispatch_uid='response-cache-delete-' + label)
+for label in TRACKED_RELATIONS:
+    m2m_changed.connect(relation_changed, sender=label, dispatch_uid='response-cache-m2m-' + label)
+
+
+class ResponseCacheMixin:
+    '''
+    Cache of conditional_response() results of a viewset.
+
+    The key of a response covers the action, the path with its sorted query
+    parameters, the format, the caller's scope (staff share one scope, other
+    users get their own) and the generations of `response_cache_models`.
+    Saves and deletes of those models bump their generation, so
+    invalidation is a single incr and a changed model is never served from an
+    older key; old entries simply expire. Generations must live in a cache
+    shared by all workers (file based, Redis, Memcached); local memory is
+    refused (see check_response_cache). A hit returns the stored data with
+    its validators without running any query, and answers If-None-Match
+    with 304 (keyset pages have no validators and are stored without). The
+    cache is off unless RESPONSE_CACHE_ALIAS names a shared cache.
+    '''
+    response_cache_models = TRACKED_MODELS
+
+    def response_scope(self):
+        user = self.request.user
+        if user.is_staff:
+            return 'staff'
+        return 'user:%s' % user.pk
+
+    def response_cache_key(self):
+        request = self.request
+        renderer = getattr(request, 'accepted_renderer', None)
+        key = [
+            request.path,
+            sorted(request.query_params.lists()),
+            getattr(renderer, 'format', None),
+            self.response_scope(),
+            generations(self.response_cache_models),
+        ]
+        digest = hashlib.md5(json.dumps(key, cls=DjangoJSONEncoder).encode('utf-8')).hexdigest()
+        return '%s%s.%s:%s' % (RESPONSE_PREFIX, type(self).__name__, self.action, digest)
+
+    def conditional_response(self, queryset, respond, serializer_class=None):
+        cache = response_cache()
+        if cache is None:
+            return super().conditional_response(queryset, respond, serializer_class)
+        # the generations are read before the queries, a write in between leaves the entry unreachable
+        key = self.response_cache_key()
+        cached = cache.get(key)
+        if cached is None:
+            response = super().conditional_response(queryset, respond, serializer_class)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(key, (response.get('ETag'), response.get('Last-Modified'), response.data), settings.RESPONSE_CACHE_TIMEOUT)
+            return response
+        etag, last_modified, data = cached
+        if etag and etag in parse_etags(self.request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        if etag:
+            response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = last_modified
+        return response
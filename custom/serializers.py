@@ -0,0 +1,186 @@
+from django.db import models
+from django.db.models import Count, Max, Sum
+from rest_framework import serializers
+from .summaries import user_summaries
+
+
+class ExpandableListSerializer(serializers.ListSerializer):
+    '''
+    Looks up the user summaries of all rows at once before serializing them.
+    '''
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.child.warm(items)
+        return super().to_representation(items)
+
+
+class ExpandableFieldsMixin:
+    '''
+    Sparse fieldsets and relation expansion for model serializers.
+
+    ?fields=a,b limits the top level fields and ?expand=x,y.z expands
+    relations (dotted paths for nested serializers); relations that are not
+    expanded are returned as ids. relation_plan() gives the select/prefetch
+    paths the requested output needs, so unrequested joins are skipped.
+    Expanded users are read from the user summary cache, not joined. Set
+    Meta.list_serializer_class = ExpandableListSerializer so lists look
+    them up in one batch.
+    '''
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+    # foreign keys to User, expanded to a user summary
+    expandable_users = []
+    # many to many fields to User, expanded to user summaries
+    expandable_user_lists = []
+    # foreign keys expanded with a nested serializer: field -> serializer class
+    expandable_nested = {}
+    # fields whose latest value / total change with every change of a row (conditional GET)
+    validator_timestamps = ['updated_at']
+    validator_totals = []
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None or expand is None:
+            requested_fields, requested_expand = self.requested(self.context.get('request'))
+            fields = requested_fields if fields is None else fields
+            expand = requested_expand if expand is None else expand
+        self.expand = set(expand)
+        self.nested = {}
+        # user id -> summary, shared with nested serializers
+        self.summaries = {}
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def split(cls, value):
+        return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+    @classmethod
+    def requested(cls, request):
+        '''
+        Fields and expansions asked for in the request query string.
+        '''
+        if request is None:
+            return [], []
+        params = getattr(request, 'query_params', getattr(request, 'GET', {}))
+        return cls.split(params.get(cls.fields_query_param)), cls.split(params.get(cls.expand_query_param))
+
+    @staticmethod
+    def child_expand(expand, name):
+        prefix = name + '.'
+        return [path[len(prefix):] for path in expand if path.startswith(prefix)]
+
+    @staticmethod
+    def is_expanded_in(expand, name):
+        return any(path == name or path.startswith(name + '.') for path in expand)
+
+    def is_expanded(self, name):
+        return self.is_expanded_in(self.expand, name)
+
+    def nested_serializer(self, name):
+        '''
+        One serializer per expanded nested field, reused for every row.
+        '''
+        if name not in self.nested:
+            serializer_class = self.expandable_nested[name]
+            self.nested[name] = serializer_class(fields=[], expand=self.child_expand(self.expand, name))
+            self.nested[name].summaries = self.summaries
+        return self.nested[name]
+
+    def nested_representation(self, name, instance):
+        '''
+        Representation of an expanded nested relation.
+        '''
+        return self.nested_serializer(name).to_representation(instance)
+
+    def user_ids(self, instance):
+        '''
+        Ids of the users an instance's expanded fields show.
+        '''
+        ids = set()
+        for name in self.expandable_users:
+            if name in self.fields and self.is_expanded(name):
+                ids.add(getattr(instance, name + '_id'))
+        for name in self.expandable_user_lists:
+            if name in self.fields and self.is_expanded(name):
+                ids.update(user.pk for user in getattr(instance, name).all())
+        for name in self.expandable_nested:
+            if name in self.fields and self.is_expanded(name) and getattr(instance, name) is not None:
+                ids.update(self.nested_serializer(name).user_ids(getattr(instance, name)))
+        ids.discard(None)
+        return ids
+
+    def warm(self, instances):
+        '''
+        Look up the user summaries of the instances in one batch.
+        '''
+        ids = set()
+        for instance in instances:
+            ids.update(self.user_ids(instance))
+        ids.difference_update(self.summaries)
+        if ids:
+            self.summaries.update(user_summaries.get_many(ids))
+
+    def user_summary(self, user_id):
+        '''
+        Summary of an expanded user, None when there is no user.
+        '''
+        if user_id is None:
+            return None
+        if user_id not in self.summaries:
+            self.summaries[user_id] = user_summaries.get(user_id)
+        return self.summaries[user_id]
+
+    def to_representation(self, instance):
+        if not isinstance(self.parent, serializers.ListSerializer):
+            self.warm([instance])
+        return super().to_representation(instance)
+
+    @classmethod
+    def relation_plan(cls, fields=(), expand=(), prefix=''):
+        '''
+        Select and prefetch paths needed to serialize the given fields/expansions.
+        Expanded users only need their ids, summaries come from the cache.
+        '''
+        select = []
+        prefetch = []
+        included = lambda name: not fields or name in fields
+        for name in cls.expandable_user_lists:
+            if included(name):
+                prefetch.append(prefix + name)
+        for name, serializer_class in cls.expandable_nested.items():
+            if included(name) and cls.is_expanded_in(expand, name):
+                select.append(prefix + name)
+                nested_select, nested_prefetch = serializer_class.relation_plan((), cls.child_expand(expand, name), prefix + name + '__')
+                select += nested_select
+                prefetch += nested_prefetch
+        return select, prefetch
+
+    @classmethod
+    def validator_aggregates(cls, fields=(), expand=(), prefix=''):
+        '''
+        Aggregates that change whenever the serialized output of a queryset
+        changes: row count, the latest timestamps (modified_*) and totals of
+        the rows and the latest profile update of every expanded user.
+        '''
+        aggregates = {} if prefix else {'count': Count('pk', distinct=True)}
+        included = lambda name: not fields or name in fields
+        for name in cls.validator_timestamps:
+            aggregates['modified_' + prefix + name] = Max(prefix + name)
+        for name in cls.validator_totals:
+            aggregates['total_' + prefix + name] = Sum(prefix + name)
+        for name in cls.expandable_users + cls.expandable_user_lists:
+            if included(name) and cls.is_expanded_in(expand, name):
+                aggregates['modified_' + prefix + name] = Max(prefix + name + '__profile__updated_at')
+        for name, serializer_class in cls.expandable_nested.items():
+            if included(name) and cls.is_expanded_in(expand, name):
+                aggregates.update(serializer_class.validator_aggregates((), cls.child_expand(expand, name), prefix + name + '__'))
+        return aggregates
+
+    @classmethod
+    def request_plan(cls, request):
+        '''
+        relation_plan() for the fields/expansions of a request.
+        '''
+        return cls.relation_plan(*cls.requested(request))
@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import caches
+from .relations import users_with_profile
+
+
+class UserSummaryCache:
+    '''
+    Process-wide cache of user summaries ({id, full_name, email, dateofbirth}).
+
+    Summaries live in a bounded in-process LRU and, when a Django cache alias
+    is configured, in that (shared) cache as a second tier. Misses are read
+    with one query per batch. Entries are dropped on User/Profile saves
+    (see accounts.models); a local entry is only trusted for `timeout`
+    seconds, which bounds how stale another worker's LRU can get.
+    '''
+    KEY_PREFIX = 'user-summary:'
+
+    def __init__(self, size=None, timeout=None, alias=None):
+        self.size = size
+        self.timeout = timeout
+        self.alias = alias
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def settings(self):
+        '''
+        Size, timeout and alias, read lazily so settings overrides apply.
+        '''
+        return (
+            self.size if self.size is not None else settings.USER_SUMMARY_CACHE_SIZE,
+            self.timeout if self.timeout is not None else settings.USER_SUMMARY_CACHE_TIMEOUT,
+            self.alias if self.alias is not None else settings.USER_SUMMARY_CACHE_ALIAS,
+        )
+
+    @classmethod
+    def key(cls, user_id):
+        return '%s%s' % (cls.KEY_PREFIX, user_id)
+
+    @staticmethod
+    def full_name(name, surname):
+        return (name or '') + ' ' + (surname or '')
+
+    @classmethod
+    def summary(cls, user):
+        '''
+        Summary of a user instance with its profile loaded.
+        '''
+        return {
+            'id': user.id,
+            'full_name': cls.full_name(user.profile.name, user.profile.surname),
+            'email': user.email,
+            'dateofbirth': user.profile.dateofbirth,
+        }
+
+    @contextmanager
+    def shared_only(self):
+        '''
+        Skip the in-process LRU for the lookups of this thread, for results
+        that must match the database (responses with validators, cached
+        responses); the shared tier, which every worker invalidates, and the
+        database are still used.
+        '''
+        previous = getattr(self.local, 'shared_only', False)
+        self.local.shared_only = True
+        try:
+            yield
+        finally:
+            self.local.shared_only = previous
+
+    def get(self, user_id):
+        if user_id is None:
+            return None
+        return self.get_many([user_id]).get(user_id)
+
+    def get_many(self, user_ids):
+        '''
+        Summaries of the given user ids: id -> summary, unknown ids are left out.
+        '''
+        size, timeout, alias = self.settings()
+        found = {}
+        missing = []
+        now = time.monotonic()
+        local = not getattr(self.local, 'shared_only', False)
+        with self.lock:
+            for user_id in set(user_ids):
+                entry = self.entries.get(user_id) if local else None
+                if entry is not None and entry[0] > now:
+                    self.entries.move_to_end(user_id)
+                    found[user_id] = entry[1]
+                else:
+                    missing.append(user_id)
+            self.hits += len(found)
+        fetched = {}
+        if missing and alias:
+            shared = caches[alias].get_many([self.key(user_id) for user_id in missing])
+            for user_id in missing:
+                if self.key(user_id) in shared:
+                    fetched[user_id] = shared[self.key(user_id)]
+            missing = [user_id for user_id in missing if user_id not in fetched]
+        shared_hits = len(fetched)
+        if missing:
+            loaded = {user.id: self.summary(user) for user in users_with_profile().filter(pk__in=missing)}
+            if alias and loaded:
+                caches[alias].set_many({self.key(user_id): summary for user_id, summary in loaded.items()}, timeout)
+            fetched.update(loaded)
+        with self.lock:
+            self.shared_hits += shared_hits
+            self.misses += len(missing)
+            for user_id, summary in fetched.items():
+                self.entries[user_id] = (now + timeout, summary)
+                self.entries.move_to_end(user_id)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+        found.update(fetched)
+        return found
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+        alias = self.settings()[2]
+        if alias:
+            caches[alias].delete(self.key(user_id))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.shared_hits = self.misses = 0
+
+    def stats(self):
+        '''
+        Counters of this process, for sizing the cache.
+        '''
+        size, timeout, alias = self.settings()
+        with self.lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'size': size,
+                'timeout': timeout,
+                'shared_cache': alias,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.shared_hits) / lookups if lookups else None,
+            }
+
+
+user_summaries = UserSummaryCache()
@@ -0,0 +1,16 @@
+import datetime
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, Application
+from rest_framework.test import APIClient
+
+
+def api_client(user, token=None):
+    '''
+    APIClient authenticated with a real OAuth2 access token of the user, so
+    requests go through OAuth2Authentication like API clients do.
+    '''
+    token = token or 'token-%s' % user.username
+    application = Application.objects.filter(name='tests').first() or Application.objects.create(
+        name='tests', client_type='confidential', authorization_grant_type='password', user=user)
+    AccessToken.objects.create(user=user, token=token, application=application, expires=timezone.now() + datetime.timedelta(hours=1), scope='read write')
+    return APIClient(HTTP_AUTHORIZATION='Bearer ' + token)
@@ -0,0 +1,87 @@
+import logging
+import threading
+from unittest import mock
+from django.test import TestCase
+from django_db_logger.models import StatusLog
+from .log_handlers import BatchedDatabaseLogHandler
+
+
+def record(msg, level=logging.ERROR, name='db'):
+    return logging.makeLogRecord({'name': name, 'levelno': level, 'levelname': logging.getLevelName(level), 'msg': msg})
+
+
+class BatchedDatabaseLogHandlerTests(TestCase):
+
+    def handler(self, **kwargs):
+        '''
+        Handler whose writes are captured instead of stored, closed after the test.
+        '''
+        handler = BatchedDatabaseLogHandler(**kwargs)
+        self.writes = []
+        self.written = threading.Event()
+
+        def write(batch, dropped):
+            if batch or dropped:
+                self.writes.append((dict(batch), dropped))
+                self.written.set()
+        handler.write = write
+        self.addCleanup(handler.close)
+        return handler
+
+    def test_batch_size_wakes_writer(self):
+        handler = self.handler(batch_size=3, flush_interval=60)
+        for i in range(3):
+            handler.emit(record('error %d' % i))
+        self.assertTrue(self.written.wait(5))
+        self.assertEqual([msg for (_, _, msg, _) in self.writes[0][0]], ['error 0', 'error 1', 'error 2'])
+        self.assertFalse(handler.pending)
+
+    def test_flush_interval(self):
+        handler = self.handler(batch_size=100, flush_interval=0.05)
+        handler.emit(record('error'))
+        self.assertTrue(self.written.wait(5))
+        self.assertEqual(self.writes, [({('db', logging.ERROR, 'error', None): 1}, 0)])
+
+    def test_duplicates_counted(self):
+        handler = self.handler(batch_size=100, flush_interval=60)
+        for msg in ('same', 'other', 'same', 'same'):
+            handler.emit(record(msg))
+        handler.emit(record('same', level=logging.WARNING))
+        self.assertEqual(list(handler.pending.items()), [
+            (('db', logging.ERROR, 'same', None), 3),
+            (('db', logging.ERROR, 'other', None), 1),
+            (('db', logging.WARNING, 'same', None), 1),
+        ])
+
+    def test_queue_overflow(self):
+        handler = self.handler(queue_size=2, batch_size=100, flush_interval=60)
+        for msg in ('first', 'second', 'third', 'fourth', 'first'):
+            handler.emit(record(msg))
+        # a repeat of a waiting entry is still counted when the queue is full
+        self.assertEqual(list(handler.pending.values()), [2, 1])
+        self.assertEqual(handler.dropped, 2)
+        handler.close()
+        self.assertEqual(self.writes, [({('db', logging.ERROR, 'first', None): 2, ('db', logging.ERROR, 'second', None): 1}, 2)])
+        self.assertEqual((handler.pending, handler.dropped), ({}, 0))
+
+    def test_close_flushes(self):
+        handler = self.handler(batch_size=100, flush_interval=60)
+        handler.emit(record('error'))
+        handler.close()
+        self.assertFalse(handler.worker.is_alive())
+        self.assertEqual(self.writes, [({('db', logging.ERROR, 'error', None): 1}, 0)])
+        # records after close are ignored
+        handler.emit(record('late'))
+        self.assertFalse(handler.pending)
+
+    def test_write(self):
+        handler = BatchedDatabaseLogHandler()
+        batch = {('db', logging.ERROR, 'same', 'Traceback'): 3, ('db', logging.INFO, 'other', None): 1}
+        # the test transaction must stay open
+        with mock.patch('custom.log_handlers.close_old_connections'):
+            handler.write(batch, 4)
+        self.assertEqual(list(StatusLog.objects.order_by('id').values_list('level', 'msg', 'trace')), [
+            (logging.ERROR, 'same (repeated 3 times)', 'Traceback'),
+            (logging.INFO, 'other', None),
+            (logging.WARNING, 'Dropped 4 log records, the database log queue was full', None),
+        ])
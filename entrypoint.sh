@@ -16,17 +16,29 @@ python manage.py makemigrations
 python manage.py makemigrations accounts
 python manage.py makemigrations lesson
 python manage.py makemigrations grade
+python manage.py makemigrations search
+python manage.py makemigrations profiling
 
 
 # Apply database migrations
 python manage.py migrate
 
+# Record the first revision of grades older than the grade history
+python manage.py backfill_grade_revisions
+
 # Collect static files
 python manage.py collectstatic --noinput
 
 # Change permissions of static files added by collectstatic
 chmod -R 755 /app/static
 
+# Start request metrics of the new workers from zero
+if [ -n "$METRICS_DIR" ]
+then
+    mkdir -p "$METRICS_DIR"
+    rm -f "$METRICS_DIR"/metrics-*.json "$METRICS_DIR"/.metrics-*.tmp
+fi
+
 # Create a superuser from environment variables
 python manage.py create_super_user_from_env
 
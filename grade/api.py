@@ -1,18 +1,32 @@
 from rest_framework import serializers, viewsets, permissions, generics, renderers
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from django_filters import rest_framework as filters
 from django.contrib.auth.models import User
-from custom.constants import SearchConstants
+from custom.constants import SearchConstants, GradeConstants
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 from oauth2_provider.contrib.rest_framework import OAuth2Authentication
 from django.contrib.admin.views.decorators import staff_member_required
 from rest_framework import permissions
 import logging
+import datetime
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.db.models import Avg, Count, Q, Window
+from django.db.models.functions import Rank, PercentRank
 from lesson.models import Lesson
-from .models import Grade
+from .models import Grade, GradeRevision, LessonGradeStats
+from .bulk import GradeImporter, GradeExporter, GradeBatch, CSVRenderer, NDJSONRenderer
 from accounts.models import Profile
 from lesson.api import LessonSerializer
+from custom.relations import with_relations
+from custom.serializers import ExpandableFieldsMixin, ExpandableListSerializer
+from custom.pagination import KeysetPaginationMixin
+from custom.conditional import ConditionalGetMixin
+from custom.rows import CSV_TYPES, NDJSON_TYPES, ROWS_PARSERS
+from custom.response_cache import ResponseCacheMixin
+from functools import partial
 
 
 class IsAdminUser(permissions.BasePermission):
@@ -20,97 +34,195 @@ class IsAdminUser(permissions.BasePermission):
         return request.user and request.user.is_staff
 
 
-class GradeSerializer(serializers.ModelSerializer):
+class GradeSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     student = serializers.SerializerMethodField()
     lesson = serializers.SerializerMethodField()
     created_by = serializers.SerializerMethodField()
     updated_by = serializers.SerializerMethodField()
+    expandable_users = ['student', 'created_by', 'updated_by']
+    expandable_nested = {'lesson': LessonSerializer}
 
     class Meta:
         model = Grade
         fields = '__all__'
+        list_serializer_class = ExpandableListSerializer
 
     def get_student(self, obj):
-        if not obj.student:
-            return None
-        return {
-            'id': obj.student.id,
-            'full_name': self.user_full_name(obj.student),
-            'email': obj.student.email,
-            'dateofbirth': obj.student.profile.dateofbirth,
-        }
+        if not self.is_expanded('student'):
+            return obj.student_id
+        return self.user_summary(obj.student_id)
     
     def get_created_by(self, obj):
-        if not obj.created_by:
-            return None
-        return {
-            'id': obj.created_by.id,
-            'full_name':self.user_full_name(obj.created_by),
-            'email': obj.created_by.email,
-            'dateofbirth': obj.created_by.profile.dateofbirth,
-        }
+        if not self.is_expanded('created_by'):
+            return obj.created_by_id
+        return self.user_summary(obj.created_by_id)
     
     def get_updated_by(self, obj):
-        if not obj.updated_by:
-            return None
-        return {
-            'id': obj.updated_by.id,
-            'full_name': self.user_full_name(obj.updated_by),
-            'email': obj.updated_by.email,
-            'dateofbirth': obj.updated_by.profile.dateofbirth,
-        }
+        if not self.is_expanded('updated_by'):
+            return obj.updated_by_id
+        return self.user_summary(obj.updated_by_id)
     
     def get_lesson(self, obj):
+        if not self.is_expanded('lesson'):
+            return obj.lesson_id
         if not obj.lesson:
             return None
-        return LessonSerializer(obj.lesson).data
+        return self.nested_representation('lesson', obj.lesson)
          
     
-    def user_full_name(self, obj):
-        name = obj.profile.name if obj.profile.name else ''
-        surname = obj.profile.surname if obj.profile.surname else ''
-        return name + ' ' + surname
     
 
 
+class LessonGradeStatsSerializer(serializers.ModelSerializer):
+    mean = serializers.FloatField(read_only=True)
+    median = serializers.SerializerMethodField()
+    std_dev = serializers.FloatField(read_only=True)
+    pass_rate = serializers.FloatField(read_only=True)
+    histogram = serializers.SerializerMethodField()
+
+    class Meta:
+        model = LessonGradeStats
+        fields = ['lesson', 'count', 'mean', 'median', 'std_dev', 'minimum', 'maximum', 'passed', 'pass_rate', 'histogram', 'updated_at']
+
+    def get_median(self, obj):
+        return obj.get_median()
+
+    def get_histogram(self, obj):
+        buckets = []
+        counts = obj.histogram or [0] * obj.bucket_count()
+        for index, count in enumerate(counts):
+            start = GradeConstants.MIN_GRADE + index * GradeConstants.HISTOGRAM_BUCKET_SIZE
+            buckets.append({
+                'from': start,
+                'to': min(start + GradeConstants.HISTOGRAM_BUCKET_SIZE - 1, GradeConstants.MAX_GRADE),
+                'count': count,
+            })
+        return buckets
+
+
+class GradeRevisionSerializer(serializers.ModelSerializer):
+    '''
+    A grade as it was at a point in time, read from its revision.
+    '''
+    id = serializers.IntegerField(source='grade_id')
+    student = serializers.IntegerField(source='student_id')
+    lesson = serializers.IntegerField(source='lesson_id')
+    updated_at = serializers.DateTimeField(source='valid_from')
+    updated_by = serializers.IntegerField(source='changed_by_id')
+    revision = serializers.IntegerField(source='pk')
+
+    class Meta:
+        model = GradeRevision
+        fields = ['id', 'student', 'lesson', 'grade', 'date', 'description', 'updated_at', 'updated_by', 'action', 'revision']
+
+
+class GradeRevisionFilter(filters.FilterSet):
+    student = filters.NumberFilter(field_name='student_id')
+    lesson = filters.NumberFilter(field_name='lesson_id')
+
+    class Meta:
+        model = GradeRevision
+        fields = {
+            'description': SearchConstants.STRING,
+            'date': SearchConstants.DATE,
+        }
+
+
 class GradeFilter(filters.FilterSet):
     class Meta:
         model = Grade
         fields = {
+            'student': ['exact', 'in'],
+            'lesson': ['exact', 'in'],
+            'lesson__teacher': ['exact', 'in'],
             'lesson__name': SearchConstants.STRING,
             'description': SearchConstants.STRING,
             'date': SearchConstants.DATE,
         }
 
 
-class GradeViewSet(viewsets.ModelViewSet):
+class GradeViewSet(ResponseCacheMixin, ConditionalGetMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     queryset = Grade.objects.all()
     serializer_class = GradeSerializer
     filterset_class = GradeFilter
     authentication_classes = [OAuth2Authentication]
+    keyset_ordering = ('date', 'id')
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + ROWS_PARSERS
+    # most queries per action whatever the number of rows (custom.query_budget)
+    query_budgets = {
+        'list': 6,
+        'retrieve': 5,
+        'list_student_grades': 6,
+        'list_lesson_grades': 5,
+        'list_teacher_grades': 6,
+    }
 
     def get_permissions(self):
-        if self.action == 'list' or self.action == 'list_student_grades':
+        if self.action == 'list' or self.action == 'list_student_grades' or self.action == 'lesson_stats':
             permission_classes = [permissions.IsAuthenticated]
         else:
             permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
         return [permission() for permission in permission_classes]
 
+    def get_renderers(self):
+        if self.action == 'export_grades':
+            return [CSVRenderer(), NDJSONRenderer()]
+        return super().get_renderers()
+
+    def get_queryset(self):
+        '''
+        Grades with the relations the requested fields read loaded up front.
+        '''
+        select, prefetch = GradeSerializer.request_plan(self.request)
+        return with_relations(Grade.objects.all(), select, prefetch).order_by('id')
+
+    def get_as_of(self):
+        '''
+        Moment of ?as_of= (a datetime, or a date meaning the end of that day),
+        None when not given. Raises ValueError when it can not be parsed.
+        '''
+        value = self.request.query_params.get('as_of')
+        if not value:
+            return None
+        # a plain date first, parse_datetime also reads it (as midnight)
+        day = parse_date(value)
+        moment = datetime.datetime.combine(day, datetime.time.max) if day else parse_datetime(value)
+        if moment is None:
+            raise ValueError('Invalid as_of: %s' % value)
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
+
+    def revisions_response(self, revisions):
+        return self.keyset_response(revisions.order_by('id'), lambda rows: GradeRevisionSerializer(rows, many=True).data)
+
     # return success with message
     def success(self, message):
         return Response({'success': True, 'message': message}, status=status.HTTP_200_OK)
     
     # return success = False with message
-    def fail(self, message):
-        return Response({'success': False, 'message': message}, status=status.HTTP_200_OK)
+    def fail(self, message, status_code=status.HTTP_200_OK):
+        return Response({'success': False, 'message': message}, status=status_code)
     
 
     def list(self, request, *args, **kwargs):
         '''
-        Get list of all grades.
+        Get list of all grades, as they were at ?as_of= when given (together
+        with a ?student= or ?lesson= filter).
         '''
         try:
-            return super().list(request, *args, **kwargs)
+            try:
+                as_of = self.get_as_of()
+            except ValueError:
+                return self.fail('Invalid as_of date')
+            if as_of:
+                # the anti-join of every grade is too slow to count and page through
+                if not (request.query_params.get('student') or request.query_params.get('lesson')):
+                    return self.fail('as_of needs a student or lesson filter')
+                revisions = GradeRevisionFilter(request.query_params, GradeRevision.as_of(as_of)).qs.order_by('id')
+                page = self.paginate_queryset(revisions)
+                return self.get_paginated_response(GradeRevisionSerializer(page, many=True).data)
+            return self.conditional_response(self.filter_queryset(self.get_queryset()), partial(super().list, request, *args, **kwargs))
         except Exception as e:
             logging.getLogger('db').exception(e)
             return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -121,10 +233,8 @@ class GradeViewSet(viewsets.ModelViewSet):
         Get details of a grade.
         '''
         try:
-            queryset = Grade.objects.all()
-            grade = get_object_or_404(queryset, pk=pk)
-            serializer = GradeSerializer(grade)
-            return Response(serializer.data)
+            queryset = self.get_queryset().filter(pk=pk)
+            return self.conditional_response(queryset, lambda: Response(self.get_serializer(get_object_or_404(queryset)).data))
         except Exception as e:
             logging.getLogger('db').exception(e)
             return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -183,6 +293,8 @@ class GradeViewSet(viewsets.ModelViewSet):
         try:
             queryset = Grade.objects.all()
             grade = get_object_or_404(queryset, pk=pk)
+            # recorded as the author of the delete revision
+            grade.updated_by = request.user
             grade.delete()
             return self.success('Grade deleted successfully')
         except Exception as e:
@@ -227,7 +339,7 @@ class GradeViewSet(viewsets.ModelViewSet):
     # get all grades of a student
     def list_student_grades(self, request, pk=None):
         '''
-        Get list of all grades of a student.
+        Get list of all grades of a student, as they were at ?as_of= when given.
         '''
         try:
             if not pk:
@@ -237,9 +349,14 @@ class GradeViewSet(viewsets.ModelViewSet):
             if not request.user.is_staff and request.user.id != pk:
                 return self.fail('You are not allowed to view this student grades')
             student = Profile.objects.filter(pk=pk).first()
-            queryset = Grade.objects.filter(student__pk=student.user.pk)
-            serializer = GradeSerializer(queryset, many=True)
-            return Response(serializer.data)
+            try:
+                as_of = self.get_as_of()
+            except ValueError:
+                return self.fail('Invalid as_of date')
+            if as_of:
+                return self.revisions_response(GradeRevision.as_of(as_of).filter(student_id=student.user_id))
+            queryset = self.get_queryset().filter(student__pk=student.user_id)
+            return self.conditional_response(queryset, lambda: self.keyset_response(queryset, lambda rows: self.get_serializer(rows, many=True).data))
         except Exception as e:
             logging.getLogger('db').exception(e)
             return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -248,16 +365,21 @@ class GradeViewSet(viewsets.ModelViewSet):
     # get all grades of a lesson
     def list_lesson_grades(self, request, pk=None):
         '''
-        Get list of all grades of a lesson.
+        Get list of all grades of a lesson, as they were at ?as_of= when given.
         '''
         try:
             if not pk:
                 return self.fail('Lesson id is required')
             if not Lesson.objects.filter(pk=pk).exists():
                 return self.fail('Lesson not found')
-            queryset = Grade.objects.filter(lesson=pk)
-            serializer = GradeSerializer(queryset, many=True)
-            return Response(serializer.data)
+            try:
+                as_of = self.get_as_of()
+            except ValueError:
+                return self.fail('Invalid as_of date')
+            if as_of:
+                return self.revisions_response(GradeRevision.as_of(as_of).filter(lesson_id=pk))
+            queryset = self.get_queryset().filter(lesson=pk)
+            return self.conditional_response(queryset, lambda: self.keyset_response(queryset, lambda rows: self.get_serializer(rows, many=True).data))
         except Exception as e:
             logging.getLogger('db').exception(e)
             return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -266,16 +388,177 @@ class GradeViewSet(viewsets.ModelViewSet):
     # get all grades of a teacher
     def list_teacher_grades(self, request, pk=None):
         '''
-        Get list of all grades of a teacher.
+        Get list of all grades of a teacher, as they were at ?as_of= when given.
         '''
         try:
             if not pk:
                 return self.fail('Teacher id is required')
             if not User.objects.filter(pk=pk).exists():
                 return self.fail('Teacher not found')
-            queryset = Grade.objects.filter(lesson__teacher__pk=pk)
-            serializer = GradeSerializer(queryset, many=True)
+            try:
+                as_of = self.get_as_of()
+            except ValueError:
+                return self.fail('Invalid as_of date')
+            if as_of:
+                return self.revisions_response(GradeRevision.as_of(as_of).filter(lesson_id__in=Lesson.objects.filter(teacher=pk).values('id')))
+            queryset = self.get_queryset().filter(lesson__teacher__pk=pk)
+            return self.conditional_response(queryset, lambda: self.keyset_response(queryset, lambda rows: self.get_serializer(rows, many=True).data))
+        except Exception as e:
+            logging.getLogger('db').exception(e)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+
+    # get grade statistics of a lesson
+    def lesson_stats(self, request, pk=None):
+        '''
+        Get grade statistics of a lesson.
+        '''
+        try:
+            if not Lesson.objects.filter(pk=pk).exists():
+                return self.fail('Lesson not found')
+            stats = LessonGradeStats.objects.filter(lesson=pk).first() or LessonGradeStats(lesson_id=pk)
+            serializer = LessonGradeStatsSerializer(stats)
             return Response(serializer.data)
+        except Exception as e:
+            logging.getLogger('db').exception(e)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+
+    # update and delete many grades at once
+    def batch(self, request):
+        '''
+        Apply partial updates and deletions of many grades in one transaction.
+        Body: {"update": [{"id": 1, "grade": 90, ...}, ...], "delete": [2, 3, ...]}
+        '''
+        try:
+            report = GradeBatch(request.user).run(request.data.get('update', []), request.data.get('delete', []))
+            return Response(report)
+        except Exception as e:
+            logging.getLogger('db').exception(e)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+
+    # import grades from a CSV or JSON Lines body
+    def import_grades(self, request):
+        '''
+        Bulk import grades streamed as CSV (text/csv, with a header row) or
+        JSON Lines (application/x-ndjson). Columns: student, lesson, grade, date, description.
+        '''
+        try:
+            if request.stream is None:
+                return self.fail('Request body is empty')
+            if request.content_type.split(';')[0].strip() not in CSV_TYPES + NDJSON_TYPES:
+                return self.fail('Unsupported content type, use text/csv or application/x-ndjson')
+            # lazy rows of RowsParser, read while importing
+            report = GradeImporter(request.user).run(request.data)
+            return Response(report)
+        except Exception as e:
+            logging.getLogger('db').exception(e)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+
+    # export grades as CSV or JSON Lines
+    def export_grades(self, request):
+        '''
+        Stream all grades matching the GradeFilter parameters.
+        Use ?format=csv (default) or ?format=ndjson.
+        '''
+        try:
+            queryset = self.filter_queryset(Grade.objects.all())
+            return GradeExporter(queryset).stream(request.accepted_renderer.format)
+        except Exception as e:
+            logging.getLogger('db').exception(e)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+
+    # gradebook of a period as a students x lessons matrix
+    def matrix(self, request):
+        '''
+        Get average grade of every student (rows) in every lesson (columns) of
+        ?period=, as a columnar matrix: values is the row-major flat list of
+        len(rows) * len(columns) cells, null where the student has no grade.
+        '''
+        try:
+            period = request.query_params.get('period')
+            if not period:
+                return self.fail('Period is required')
+            lessons = list(Lesson.objects.filter(period=period).order_by('id').values_list('id', 'name'))
+            grades = Grade.objects.filter(lesson__period=period, student__isnull=False, grade__isnull=False)
+            # enrolled students and students graded without being enrolled, both part of the gradebook
+            enrolled = Lesson.students.through.objects.filter(lesson__period=period).values('user_id')
+            students = list(User.objects.filter(Q(pk__in=enrolled) | Q(pk__in=grades.values('student_id')))
+                            .values_list('id', 'profile__name', 'profile__surname').order_by('id'))
+            cells = grades.values_list('student_id', 'lesson_id').annotate(average=Avg('grade')).order_by()
+            rows = [student[0] for student in students]
+            columns = [lesson[0] for lesson in lessons]
+            row_index = {id: index for index, id in enumerate(rows)}
+            column_index = {id: index for index, id in enumerate(columns)}
+            values = [None] * (len(rows) * len(columns))
+            for student_id, lesson_id, average in cells:
+                values[row_index[student_id] * len(columns) + column_index[lesson_id]] = round(float(average), 2)
+            return Response({
+                'period': period,
+                'rows': rows,
+                'row_labels': [(name or '') + ' ' + (surname or '') for _, name, surname in students],
+                'columns': columns,
+                'column_labels': [name for _, name in lessons],
+                'values': values,
+            })
+        except Exception as e:
+            logging.getLogger('db').exception(e)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+
+    # rank students of a lesson (or of the lesson's period) by their grades
+    def lesson_ranking(self, request, pk=None):
+        '''
+        Get rank and percentile of each student, computed with window functions.
+        ?scope=lesson (default) ranks by the average grade in the lesson,
+        ?scope=period by the average grade over all lessons of the lesson's period.
+        ?top=N returns only students ranked N or better.
+        '''
+        try:
+            lesson = Lesson.objects.filter(pk=pk).values('id', 'period').first()
+            if not lesson:
+                return self.fail('Lesson not found')
+            scope = request.query_params.get('scope', 'lesson')
+            if scope == 'lesson':
+                grades = Grade.objects.filter(lesson=pk)
+            elif scope == 'period':
+                grades = Grade.objects.filter(lesson__period=lesson['period'])
+            else:
+                return self.fail('Scope must be lesson or period')
+            top = request.query_params.get('top')
+            if top:
+                try:
+                    top = int(top)
+                except ValueError:
+                    top = 0
+                if top < 1:
+                    return self.fail('Top must be a positive integer', status.HTTP_400_BAD_REQUEST)
+            order = Avg('grade').desc()
+            ranking = grades.filter(student__isnull=False, grade__isnull=False) \
+                .values('student_id', 'student__profile__name', 'student__profile__surname') \
+                .annotate(
+                    average=Avg('grade'),
+                    grades=Count('id'),
+                    rank=Window(Rank(), order_by=order),
+                    percent_rank=Window(PercentRank(), order_by=order),
+                ).order_by('rank', 'student_id')
+            if top:
+                # filtering on a window function runs in an outer query, after ranking
+                ranking = ranking.filter(rank__lte=top)
+            results = []
+            for row in ranking:
+                results.append({
+                    'student': row['student_id'],
+                    'full_name': (row['student__profile__name'] or '') + ' ' + (row['student__profile__surname'] or ''),
+                    'average': float(row['average']),
+                    'grades': row['grades'],
+                    'rank': row['rank'],
+                    'percentile': round((1 - row['percent_rank']) * 100, 2),
+                })
+            return Response({'lesson': lesson['id'], 'period': lesson['period'], 'scope': scope, 'results': results})
         except Exception as e:
             logging.getLogger('db').exception(e)
             return Response(status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
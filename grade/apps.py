@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class GradeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'grade'
+
+    def ready(self):
+        # connect transcript cache invalidation receivers
+        from . import transcripts
+        # connect response cache generation receivers
+        import custom.response_cache
@@ -0,0 +1,377 @@
+import csv
+import json
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from itertools import islice
+from rest_framework import renderers
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.db import transaction
+from django.utils import timezone
+from accounts.models import Profile
+from lesson.models import Lesson
+from .models import Grade, GradeRevision, LessonGradeStats, defer_changes, refresh_lesson_grade_counters
+from custom.response_cache import bump_on_commit
+from .transcripts import invalidate_transcripts
+
+
+@contextmanager
+def deferred_summaries():
+    '''
+    Skip per-row maintenance of lesson statistics, lesson grade counters and
+    transcripts inside the block, then rebuild the touched lessons and drop
+    the touched transcripts once. Writes that send no signals (bulk_create,
+    bulk_update) add their ids to the yielded sets themselves, and every
+    write in the block records its own GradeRevision rows.
+    '''
+    touched = {'lessons': set(), 'students': set()}
+    defer_changes(touched)
+    try:
+        yield touched
+    finally:
+        defer_changes(None)
+    touched['lessons'].discard(None)
+    if touched['lessons']:
+        LessonGradeStats.rebuild(touched['lessons'])
+        refresh_lesson_grade_counters(touched['lessons'])
+    invalidate_transcripts(touched['students'])
+    bump_on_commit('grade.Grade', 'lesson.Lesson')
+
+
+def clean_values(row, names):
+    '''
+    Validate plain Grade fields of a row with the model fields.
+    Returns (values, errors).
+    '''
+    values = {}
+    errors = {}
+    for name in names:
+        value = row.get(name)
+        try:
+            values[name] = Grade._meta.get_field(name).clean(None if value == '' else value, None)
+        except ValidationError as e:
+            errors[name] = e.messages
+    return values, errors
+
+
+def to_int(value):
+    '''
+    Parse an id, None when empty and -1 when not a number.
+    '''
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+
+class GradeImporter:
+    '''
+    Streams grade rows into the database in chunks.
+
+    Each chunk resolves its student (profile) and lesson ids with one query per
+    model and is written with a single bulk_create. Invalid rows are skipped
+    and reported, the whole import runs in one transaction.
+    '''
+    CHUNK_SIZE = 2000
+    MAX_ERRORS = 1000
+
+    def __init__(self, user, chunk_size=None):
+        self.user = user
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, number, errors):
+        self.failed += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append({'row': number, 'errors': errors})
+
+    def clean(self, row, students, lessons):
+        '''
+        Build an unsaved Grade from a row, or return a dict of field errors.
+        @students: profile id -> user id of the chunk
+        @lessons: existing lesson ids of the chunk
+        '''
+        if '__invalid__' in row:
+            return {'row': ['Row is not a JSON object.']}
+        values, errors = clean_values(row, ('grade', 'date', 'description'))
+        student = to_int(row.get('student'))
+        if student is not None and student not in students:
+            errors['student'] = ['Student not found']
+        lesson = to_int(row.get('lesson'))
+        if lesson is not None and lesson not in lessons:
+            errors['lesson'] = ['Lesson not found']
+        if errors:
+            return errors
+        return Grade(
+            student_id=students.get(student),
+            lesson_id=lesson,
+            created_by=self.user,
+            updated_by=self.user,
+            **values
+        )
+
+    def fetch_ids(self, grades, last):
+        '''
+        Set the primary keys of bulk inserted grades from the rows this importer
+        wrote after @last, matched on their values in insertion order.
+        '''
+        fields = ('created_at', 'student_id', 'lesson_id', 'grade', 'date', 'description')
+        ids = defaultdict(deque)
+        rows = Grade.objects.filter(pk__gt=last, created_by=self.user).order_by('pk').values_list('pk', *fields)
+        for pk, *values in rows:
+            ids[tuple(values)].append(pk)
+        for grade in grades:
+            grade.pk = ids[tuple(getattr(grade, name) for name in fields)].popleft()
+
+    def import_chunk(self, chunk):
+        student_ids = set()
+        lesson_ids = set()
+        for _, row in chunk:
+            if '__invalid__' in row:
+                continue
+            student_ids.add(to_int(row.get('student')))
+            lesson_ids.add(to_int(row.get('lesson')))
+        student_ids.discard(None)
+        lesson_ids.discard(None)
+        students = dict(Profile.objects.filter(pk__in=student_ids).values_list('pk', 'user_id'))
+        lessons = set(Lesson.objects.filter(pk__in=lesson_ids).values_list('pk', flat=True))
+        grades = []
+        for number, row in chunk:
+            grade = self.clean(row, students, lessons)
+            if isinstance(grade, Grade):
+                grades.append(grade)
+            else:
+                self.add_error(number, grade)
+        last = Grade.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        Grade.objects.bulk_create(grades, batch_size=self.chunk_size)
+        if any(grade.pk is None for grade in grades):
+            # backends that do not return primary keys from bulk inserts
+            self.fetch_ids(grades, last)
+        GradeRevision.objects.bulk_create([GradeRevision.of(grade, GradeRevision.CREATE, valid_from=grade.created_at) for grade in grades], batch_size=self.chunk_size)
+        self.created += len(grades)
+        # bulk_create sends no signals
+        self.touched['lessons'].update(grade.lesson_id for grade in grades)
+        self.touched['students'].update(grade.student_id for grade in grades)
+
+    def run(self, rows):
+        '''
+        Import all rows and return the report.
+        '''
+        started = time.monotonic()
+        rows = iter(rows)
+        with transaction.atomic(), deferred_summaries() as self.touched:
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                self.import_chunk(chunk)
+        seconds = time.monotonic() - started
+        total = self.created + self.failed
+        return {
+            'success': self.failed == 0,
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(total / seconds) if seconds else total,
+        }
+
+
+class GradeBatch:
+    '''
+    Applies a list of partial grade updates and a list of deletions at once.
+
+    All items are validated together and nothing is written when any of them
+    is invalid. Grades, students (profiles) and lessons are each loaded with
+    one query; changes are written with bulk_update and one DELETE ... IN,
+    inside one transaction.
+    '''
+    MAX_ITEMS = 10000
+    FIELDS = ['grade', 'date', 'description']
+
+    def __init__(self, user):
+        self.user = user
+        self.errors = []
+        # (lesson id, student id) of the updated grades before the change
+        self.previous = []
+
+    def add_error(self, index, id, errors):
+        self.errors.append({'index': index, 'id': id, 'errors': errors})
+
+    def clean(self, item, students, lessons):
+        '''
+        Validated attribute values of an update item, or None with errors.
+        '''
+        values, errors = clean_values(item, [name for name in self.FIELDS if name in item])
+        if 'student' in item:
+            student = to_int(item['student'])
+            if student is not None and student not in students:
+                errors['student'] = ['Student not found']
+            values['student_id'] = students.get(student)
+        if 'lesson' in item:
+            lesson = to_int(item['lesson'])
+            if lesson is not None and lesson not in lessons:
+                errors['lesson'] = ['Lesson not found']
+            values['lesson_id'] = lesson
+        return values, errors
+
+    def validate(self, updates, deletes):
+        '''
+        Returns the changed grades, the field names to write and the grades to delete.
+        '''
+        updates = [item if isinstance(item, dict) else {'id': None} for item in updates]
+        ids = [to_int(item.get('id')) for item in updates]
+        delete_ids = [to_int(id) for id in deletes]
+        deleted = set(delete_ids)
+        grades = Grade.objects.in_bulk([id for id in ids + delete_ids if id])
+        students = dict(Profile.objects.filter(pk__in=[to_int(item['student']) for item in updates if item.get('student')]).values_list('pk', 'user_id'))
+        lessons = set(Lesson.objects.filter(pk__in=[to_int(item['lesson']) for item in updates if item.get('lesson')]).values_list('pk', flat=True))
+        changed = []
+        fields = set()
+        for index, (id, item) in enumerate(zip(ids, updates)):
+            if id not in grades:
+                self.add_error(index, id, {'id': ['Grade not found']})
+                continue
+            if id in deleted:
+                self.add_error(index, id, {'id': ['Grade is both updated and deleted']})
+                continue
+            values, errors = self.clean(item, students, lessons)
+            if errors:
+                self.add_error(index, id, errors)
+                continue
+            grade = grades[id]
+            self.previous.append((grade.lesson_id, grade.student_id))
+            for name, value in values.items():
+                setattr(grade, name, value)
+            changed.append(grade)
+            fields.update(values)
+        for index, id in enumerate(delete_ids):
+            if id not in grades:
+                self.add_error(len(updates) + index, id, {'id': ['Grade not found']})
+        return changed, fields, [grades[id] for id in deleted if id in grades]
+
+    def run(self, updates, deletes):
+        '''
+        Validate and apply the batch, returning the report.
+        '''
+        if not isinstance(updates, list) or not isinstance(deletes, list):
+            return {'success': False, 'message': 'update and delete must be lists'}
+        if len(updates) + len(deletes) > self.MAX_ITEMS:
+            return {'success': False, 'message': 'A batch can have at most %d items' % self.MAX_ITEMS}
+        changed, fields, deleted = self.validate(updates, deletes)
+        if self.errors:
+            return {'success': False, 'errors': self.errors}
+        now = timezone.now()
+        with transaction.atomic(), deferred_summaries() as touched:
+            if changed:
+                for grade in changed:
+                    grade.updated_by = self.user
+                    grade.updated_at = now
+                Grade.objects.bulk_update(changed, list(fields) + ['updated_by', 'updated_at'], batch_size=500)
+                # bulk_update sends no signals
+                for lesson_id, student_id in self.previous:
+                    touched['lessons'].add(lesson_id)
+                    touched['students'].add(student_id)
+                touched['lessons'].update(grade.lesson_id for grade in changed)
+                touched['students'].update(grade.student_id for grade in changed)
+            revisions = [GradeRevision.of(grade, GradeRevision.UPDATE, valid_from=now) for grade in changed]
+            revisions += [GradeRevision.of(grade, GradeRevision.DELETE, self.user.id, now) for grade in deleted]
+            GradeRevision.objects.bulk_create(revisions, batch_size=500)
+            if deleted:
+                Grade.objects.filter(id__in=[grade.id for grade in deleted]).delete()
+        return {'success': True, 'updated': len(changed), 'deleted': len(deleted)}
+
+
+class ExportRenderer(renderers.BaseRenderer):
+    '''
+    Lets ?format= of the streamed exports pass content negotiation.
+    Only non-streamed responses (errors) are rendered here, as JSON.
+    '''
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, cls=DjangoJSONEncoder).encode(self.charset)
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class NDJSONRenderer(ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class Echo:
+    '''
+    File-like object for csv.writer that returns the written line.
+    '''
+    def write(self, value):
+        return value
+
+
+class GradeExporter:
+    '''
+    Streams grades as CSV or JSON Lines from a server-side cursor.
+
+    Rows are read as flat value tuples, so no model instances or serializers
+    are built and memory stays flat regardless of the row count.
+    '''
+    CHUNK_SIZE = 2000
+    COLUMNS = [
+        ('id', 'id'),
+        ('student', 'student_id'),
+        ('student_name', 'student__profile__name'),
+        ('student_surname', 'student__profile__surname'),
+        ('lesson', 'lesson_id'),
+        ('lesson_name', 'lesson__name'),
+        ('period', 'lesson__period'),
+        ('teacher', 'lesson__teacher_id'),
+        ('grade', 'grade'),
+        ('date', 'date'),
+        ('description', 'description'),
+        ('created_at', 'created_at'),
+        ('updated_at', 'updated_at'),
+    ]
+    CONTENT_TYPES = {
+        'csv': 'text/csv; charset=utf-8',
+        'ndjson': 'application/x-ndjson; charset=utf-8',
+    }
+
+    def __init__(self, queryset, chunk_size=None):
+        self.queryset = queryset
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+
+    def rows(self):
+        paths = [path for _, path in self.COLUMNS]
+        return self.queryset.order_by('id').values_list(*paths).iterator(chunk_size=self.chunk_size)
+
+    def csv_lines(self):
+        writer = csv.writer(Echo())
+        yield writer.writerow([name for name, _ in self.COLUMNS])
+        for row in self.rows():
+            yield writer.writerow(row)
+
+    def ndjson_lines(self):
+        names = [name for name, _ in self.COLUMNS]
+        for row in self.rows():
+            yield json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) + '\n'
+
+    def stream(self, format):
+        '''
+        Return a StreamingHttpResponse in the given format (csv or ndjson).
+        '''
+        lines = self.csv_lines() if format == 'csv' else self.ndjson_lines()
+        response = StreamingHttpResponse(lines, content_type=self.CONTENT_TYPES[format])
+        response['Content-Disposition'] = 'attachment; filename="grades.%s"' % format
+        return response
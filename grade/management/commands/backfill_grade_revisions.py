@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from grade.models import GradeRevision
+
+class Command(BaseCommand):
+    help = 'Create the first revision of grades written before grade history was recorded'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Revisions written per bulk insert (default: 1000)')
+
+    def handle(self, *args, **options):
+        created = GradeRevision.backfill(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Created %d grade revisions\n' % created))
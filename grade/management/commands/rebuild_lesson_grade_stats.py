@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from grade.models import LessonGradeStats
+
+class Command(BaseCommand):
+    help = 'Rebuild lesson grade statistics from grades'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lesson', type=int, nargs='*', help='Lesson ids to rebuild (default: all lessons)')
+
+    def handle(self, *args, **options):
+        lesson_ids = options.get('lesson') or None
+        rebuilt = LessonGradeStats.rebuild(lesson_ids)
+        self.stdout.write(self.style.SUCCESS('Rebuilt grade statistics of %d lessons\n' % rebuilt))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+from custom.caches import is_shared
+from grade.transcripts import rebuild_transcripts
+
+class Command(BaseCommand):
+    help = 'Recompute and cache transcripts of all students (needs a shared CACHE_BACKEND, e.g. file based or Redis)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--student', type=int, nargs='*', help='Student (user) ids to rebuild (default: all students)')
+
+    def handle(self, *args, **options):
+        if not is_shared():
+            raise CommandError('The default cache is local memory: transcripts cached by this command are not seen by the server')
+        student_ids = options.get('student') or None
+        rebuilt = rebuild_transcripts(student_ids)
+        self.stdout.write(self.style.SUCCESS('Cached transcripts of %d students\n' % rebuilt))
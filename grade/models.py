@@ -1,11 +1,31 @@
-from django.db import models
+import math
+import threading
+from django.db import models, transaction
+from django.db.models import Count, Exists, F, Max, Min, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
+from custom.constants import GradeConstants
 from lesson.models import Lesson
 
 
+_deferral = threading.local()
+
+
+def deferred_changes():
+    '''
+    Sets of lesson and student ids touched while summary maintenance is
+    deferred (see grade.bulk.deferred_summaries), None when it is not.
+    '''
+    return getattr(_deferral, 'touched', None)
+
+
+def defer_changes(touched):
+    _deferral.touched = touched
+
+
 class Grade(models.Model):
     student = models.ForeignKey(User, on_delete=models.CASCADE, related_name="grade_student", verbose_name="Student", null=True)
     lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name="grade_lesson", verbose_name="Lesson", null=True)
@@ -18,5 +38,339 @@ class Grade(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     updated_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="grade_updated_by", null=True)
 
+    class Meta:
+        indexes = [
+            # lesson / student / teacher grade lists, keyset ordered by (date, id)
+            models.Index(fields=['lesson', 'date', 'id'], name='grade_lesson_date_idx'),
+            models.Index(fields=['student', 'date', 'id'], name='grade_student_date_idx'),
+            models.Index(fields=['date', 'id'], name='grade_date_idx'),
+            # lesson statistics bounds, median and ranking
+            models.Index(fields=['lesson', 'grade'], name='grade_lesson_grade_idx'),
+        ]
+
     def __str__(self):
-        return "%s %s : %s" % (self.student.profile.name, self.student.profile.surname, self.grade)
\ No newline at end of file
+        return "%s %s : %s" % (self.student.profile.name, self.student.profile.surname, self.grade)
+
+    # fields whose stored values the receivers compare against to apply deltas
+    STORED_FIELDS = ('student_id', 'lesson_id', 'grade')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored = {name: instance.__dict__[name] for name in cls.STORED_FIELDS if name in instance.__dict__}
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # after post_save, so every receiver compares against the same values
+        self._stored = {name: getattr(self, name) for name in self.STORED_FIELDS}
+
+    def stored(self, name):
+        '''
+        Value of a STORED_FIELDS field as last loaded or saved. When it is not
+        known (an instance that was not loaded, or a deferred field) the current
+        value is taken, the field is treated as unchanged.
+        '''
+        return getattr(self, '_stored', {}).get(name, getattr(self, name))
+
+
+class LessonGradeStats(models.Model):
+    '''
+    Grade summary of a lesson, maintained incrementally from Grade signals.
+
+    Median is computed on first read and cached until the next grade change.
+    '''
+    lesson = models.OneToOneField(Lesson, on_delete=models.CASCADE, related_name="grade_stats", primary_key=True)
+    count = models.PositiveIntegerField(default=0, verbose_name="Count")
+    total = models.BigIntegerField(default=0, verbose_name="Sum")
+    total_squares = models.BigIntegerField(default=0, verbose_name="Sum of Squares")
+    minimum = models.IntegerField(blank=True, verbose_name="Minimum", null=True)
+    maximum = models.IntegerField(blank=True, verbose_name="Maximum", null=True)
+    passed = models.PositiveIntegerField(default=0, verbose_name="Passed")
+    histogram = models.JSONField(default=list, verbose_name="Histogram")
+    median = models.FloatField(blank=True, verbose_name="Median", null=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "%s : %s" % (self.lesson_id, self.count)
+
+    @staticmethod
+    def bucket_count():
+        return math.ceil((GradeConstants.MAX_GRADE - GradeConstants.MIN_GRADE + 1) / GradeConstants.HISTOGRAM_BUCKET_SIZE)
+
+    @staticmethod
+    def bucket(value):
+        value = min(max(value, GradeConstants.MIN_GRADE), GradeConstants.MAX_GRADE)
+        return (value - GradeConstants.MIN_GRADE) // GradeConstants.HISTOGRAM_BUCKET_SIZE
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    @property
+    def std_dev(self):
+        if not self.count:
+            return None
+        variance = self.total_squares / self.count - (self.total / self.count) ** 2
+        return math.sqrt(max(variance, 0))
+
+    @property
+    def pass_rate(self):
+        if not self.count:
+            return None
+        return self.passed / self.count
+
+    def add(self, value, sign=1):
+        '''
+        Add (sign > 0) or remove (sign < 0) |sign| occurrences of a grade value.
+        Returns False when min/max can not be derived without a rescan.
+        '''
+        if len(self.histogram) != self.bucket_count():
+            self.histogram = [0] * self.bucket_count()
+        self.count += sign
+        self.total += sign * value
+        self.total_squares += sign * value * value
+        self.passed += sign if value >= GradeConstants.PASS_GRADE else 0
+        self.histogram[self.bucket(value)] += sign
+        self.median = None
+        if sign > 0:
+            self.minimum = value if self.minimum is None else min(self.minimum, value)
+            self.maximum = value if self.maximum is None else max(self.maximum, value)
+            return True
+        return value != self.minimum and value != self.maximum
+
+    def refresh_bounds(self):
+        bounds = Grade.objects.filter(lesson_id=self.lesson_id, grade__isnull=False).aggregate(minimum=Min('grade'), maximum=Max('grade'))
+        self.minimum = bounds['minimum']
+        self.maximum = bounds['maximum']
+
+    def get_median(self):
+        '''
+        Exact median, read from the ordered grades only when the cache is empty.
+        '''
+        if not self.count:
+            return None
+        if self.median is None:
+            grades = Grade.objects.filter(lesson_id=self.lesson_id, grade__isnull=False).order_by('grade')
+            middle = list(grades.values_list('grade', flat=True)[(self.count - 1) // 2:self.count // 2 + 1])
+            self.median = sum(middle) / len(middle)
+            if self.pk:
+                LessonGradeStats.objects.filter(pk=self.pk).update(median=self.median)
+        return self.median
+
+    @classmethod
+    def record(cls, lesson_id, value, sign):
+        '''
+        Apply a grade change to the summary of a lesson.
+        '''
+        if lesson_id is None or value is None:
+            return
+        with transaction.atomic():
+            if sign > 0:
+                cls.objects.get_or_create(lesson_id=lesson_id)
+            stats = cls.objects.select_for_update().filter(lesson_id=lesson_id).first()
+            if not stats:
+                return
+            if not stats.add(value, sign):
+                stats.refresh_bounds()
+            stats.save()
+
+    @classmethod
+    def rebuild(cls, lesson_ids=None):
+        '''
+        Recompute summaries from Grade with one grouped query.
+        @lesson_ids: lessons to rebuild, all lessons when None
+        '''
+        grades = Grade.objects.filter(lesson__isnull=False, grade__isnull=False)
+        if lesson_ids is not None:
+            grades = grades.filter(lesson_id__in=lesson_ids)
+        summaries = {}
+        for lesson_id, value, number in grades.values_list('lesson_id', 'grade').annotate(number=Count('id')).order_by():
+            summaries.setdefault(lesson_id, cls(lesson_id=lesson_id)).add(value, number)
+        with transaction.atomic():
+            existing = cls.objects.all() if lesson_ids is None else cls.objects.filter(lesson_id__in=lesson_ids)
+            existing.delete()
+            cls.objects.bulk_create(summaries.values(), batch_size=500)
+        return len(summaries)
+
+
+class GradeRevision(models.Model):
+    '''
+    Append-only history of grades. A revision is valid from valid_from until
+    the next revision of the same grade; a delete revision ends the grade.
+
+    Ids are stored as plain columns so the history outlives deleted rows.
+    '''
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    ACTIONS = [(CREATE, 'Create'), (UPDATE, 'Update'), (DELETE, 'Delete')]
+
+    grade_id = models.BigIntegerField(verbose_name="Grade")
+    action = models.CharField(max_length=6, choices=ACTIONS, verbose_name="Action")
+    student_id = models.BigIntegerField(blank=True, verbose_name="Student", null=True)
+    lesson_id = models.BigIntegerField(blank=True, verbose_name="Lesson", null=True)
+    grade = models.IntegerField(blank=True, verbose_name="Grade", null=True)
+    date = models.DateField(blank=True, verbose_name="Date", null=True)
+    description = models.CharField(max_length=160, blank=True, verbose_name="Description", null=True)
+    valid_from = models.DateTimeField(verbose_name="Valid From")
+    changed_by_id = models.BigIntegerField(blank=True, verbose_name="Changed By", null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['grade_id', 'valid_from'], name='revision_grade_valid_idx'),
+            models.Index(fields=['lesson_id', 'valid_from'], name='revision_lesson_valid_idx'),
+            models.Index(fields=['student_id', 'valid_from'], name='revision_student_valid_idx'),
+        ]
+
+    def __str__(self):
+        return "%s %s : %s" % (self.grade_id, self.action, self.valid_from)
+
+    @classmethod
+    def of(cls, grade, action, changed_by_id=None, valid_from=None):
+        '''
+        Unsaved revision capturing the current values of a grade.
+        '''
+        return cls(
+            grade_id=grade.pk,
+            action=action,
+            student_id=grade.student_id,
+            lesson_id=grade.lesson_id,
+            grade=grade.grade,
+            date=grade.date,
+            description=grade.description,
+            valid_from=valid_from or timezone.now(),
+            changed_by_id=changed_by_id if changed_by_id is not None else grade.updated_by_id,
+        )
+
+    @classmethod
+    def as_of(cls, moment):
+        '''
+        Revisions in effect at the given moment, one per grade that existed then.
+
+        Each candidate is checked with an index seek on (grade_id, valid_from)
+        for a newer revision before the moment, history is never replayed.
+        '''
+        newer = cls.objects.filter(grade_id=OuterRef('grade_id'), valid_from__lte=moment) \
+            .filter(Q(valid_from__gt=OuterRef('valid_from')) | Q(valid_from=OuterRef('valid_from'), id__gt=OuterRef('id')))
+        return cls.objects.filter(valid_from__lte=moment).exclude(action=cls.DELETE).filter(~Exists(newer))
+
+    @classmethod
+    def backfill(cls, batch_size=1000):
+        '''
+        Create a revision for each grade without one, so grades written before
+        revisions were recorded show up in as_of queries. Their earlier values
+        are unknown: the current values are taken as valid since created_at.
+        Returns the number of revisions created.
+        '''
+        grades = Grade.objects.filter(~Exists(cls.objects.filter(grade_id=OuterRef('pk')))).order_by('pk')
+        created = 0
+        batch = []
+        for grade in grades.iterator(chunk_size=batch_size):
+            batch.append(cls.of(grade, cls.CREATE, valid_from=grade.created_at or grade.updated_at))
+            if len(batch) >= batch_size:
+                created += len(cls.objects.bulk_create(batch))
+                batch = []
+        if batch:
+            created += len(cls.objects.bulk_create(batch))
+        return created
+
+
+@receiver(post_save, sender=Grade)
+def update_lesson_grade_stats(sender, instance, created, **kwargs):
+    '''
+    Moves the grade between lesson summaries when it is created or changed.
+    '''
+    stored = (None, None) if created else (instance.stored('lesson_id'), instance.stored('grade'))
+    current = (instance.lesson_id, instance.grade)
+    if stored == current:
+        return
+    touched = deferred_changes()
+    if touched is not None:
+        touched['lessons'].update(lesson_id for lesson_id in (stored[0], current[0]) if lesson_id)
+        return
+    LessonGradeStats.record(stored[0], stored[1], -1)
+    LessonGradeStats.record(current[0], current[1], 1)
+
+
+@receiver(post_delete, sender=Grade)
+def remove_lesson_grade_stats(sender, instance, **kwargs):
+    '''
+    Removes the grade from its lesson summary when it is deleted.
+    '''
+    lesson_id, value = instance.stored('lesson_id'), instance.stored('grade')
+    touched = deferred_changes()
+    if touched is not None:
+        touched['lessons'].add(lesson_id)
+        return
+    LessonGradeStats.record(lesson_id, value, -1)
+
+
+def refresh_lesson_grade_counters(lesson_ids=None):
+    '''
+    Recompute Lesson.grade_count and last_graded_at of all (or the given)
+    lessons in one statement.
+    '''
+    grades = Grade.objects.filter(lesson_id=OuterRef('pk')).order_by().values('lesson_id')
+    lessons = Lesson.objects.all() if lesson_ids is None else Lesson.objects.filter(pk__in=lesson_ids)
+    return lessons.update(
+        grade_count=Coalesce(Subquery(grades.annotate(count=Count('id')).values('count')), 0),
+        last_graded_at=Subquery(grades.annotate(last=Max('updated_at')).values('last')),
+    )
+
+
+@receiver(post_save, sender=Grade)
+def update_lesson_grade_counters(sender, instance, created, **kwargs):
+    '''
+    Counts a created grade on its lesson and moves it when its lesson changes.
+    '''
+    stored_lesson = None if created else instance.stored('lesson_id')
+    touched = deferred_changes()
+    if touched is not None:
+        touched['lessons'].update(lesson_id for lesson_id in (stored_lesson, instance.lesson_id) if lesson_id)
+        return
+    if instance.lesson_id and stored_lesson != instance.lesson_id:
+        Lesson.objects.filter(pk=instance.lesson_id).update(grade_count=F('grade_count') + 1, last_graded_at=instance.updated_at)
+    elif instance.lesson_id:
+        Lesson.objects.filter(pk=instance.lesson_id).update(last_graded_at=instance.updated_at)
+    if stored_lesson and stored_lesson != instance.lesson_id:
+        Lesson.objects.filter(pk=stored_lesson).update(grade_count=F('grade_count') - 1)
+
+
+@receiver(post_delete, sender=Grade)
+def remove_lesson_grade_counter(sender, instance, **kwargs):
+    '''
+    Uncounts a deleted grade, last_graded_at falls back to the latest remaining grade.
+    '''
+    lesson_id = instance.stored('lesson_id')
+    touched = deferred_changes()
+    if touched is not None:
+        touched['lessons'].add(lesson_id)
+        return
+    if lesson_id:
+        last = Grade.objects.filter(lesson_id=lesson_id).order_by().values('lesson_id').annotate(last=Max('updated_at')).values('last')
+        Lesson.objects.filter(pk=lesson_id).update(grade_count=F('grade_count') - 1, last_graded_at=Subquery(last))
+
+
+@receiver(post_save, sender=Grade)
+def record_grade_revision(sender, instance, created, **kwargs):
+    '''
+    Appends a revision for every saved grade. Bulk writes (deferred mode)
+    record their own revisions.
+    '''
+    if deferred_changes() is not None:
+        return
+    GradeRevision.of(instance, GradeRevision.CREATE if created else GradeRevision.UPDATE, valid_from=instance.updated_at).save()
+
+
+@receiver(post_delete, sender=Grade)
+def record_grade_deletion(sender, instance, **kwargs):
+    '''
+    Appends a delete revision, changed_by is the grade's updated_by set by the caller.
+    '''
+    if deferred_changes() is not None:
+        return
+    GradeRevision.of(instance, GradeRevision.DELETE).save()
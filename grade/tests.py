@@ -1,3 +1,641 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import re
+import tempfile
+import unittest
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Avg, Count, Max, Min
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, Application
+from rest_framework.test import APIClient
+from accounts.models import Profile
+from custom.pagination import KeysetPagination
+from custom.query_budget import QueryBudgetTestMixin
+from custom.testing import api_client
+from lesson.models import Lesson
+from . import transcripts
+from .api import GradeViewSet
+from .models import Grade, GradeRevision, LessonGradeStats
 
-# Create your tests here.
+
+class IndexUsageTests(TestCase):
+    '''
+    Checks the EXPLAIN output of the API query shapes on a seeded dataset
+    and fails when a table is read with a sequential (full) scan.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create(username='teacher')
+        cls.lessons = [Lesson.objects.create(name='Lesson %d' % i, period='2024-%d' % (i % 2), teacher=cls.teacher) for i in range(5)]
+        cls.students = [User.objects.create(username='student%d' % i) for i in range(40)]
+        Profile.objects.filter(user__in=cls.students).update(name='Name', surname='Surname', identity_number='12345678901')
+        Grade.objects.bulk_create([
+            Grade(student=student, lesson=lesson, grade=(i * 7 + j) % 101, date=datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 60))
+            for i, student in enumerate(cls.students) for j, lesson in enumerate(cls.lessons)
+        ])
+
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise unittest.SkipTest('EXPLAIN checks support SQLite and PostgreSQL')
+        if connection.vendor == 'postgresql':
+            # small tables are always cheaper to scan, make the planner prefer any usable index
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def tearDown(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = on')
+
+    def full_scans(self, plan):
+        tables = set(connection.introspection.table_names())
+        if connection.vendor == 'postgresql':
+            return [table for table in re.findall(r'Seq Scan on (\w+)', plan) if table in tables]
+        return [table for table, index in re.findall(r'\bSCAN (\w+)( USING)?', plan) if table in tables and not index]
+
+    def assertIndexed(self, queryset):
+        plan = queryset.explain()
+        scans = self.full_scans(plan)
+        self.assertFalse(scans, 'Sequential scan on %s:\n%s\n%s' % (', '.join(scans), queryset.query, plan))
+
+    def assertOrderedByIndex(self, queryset):
+        plan = queryset.explain()
+        sort = r'\bSort\b' if connection.vendor == 'postgresql' else r'TEMP B-TREE FOR ORDER BY'
+        self.assertFalse(re.search(sort, plan), 'Rows sorted after reading:\n%s\n%s' % (queryset.query, plan))
+
+    def test_lesson_grades(self):
+        '''list_lesson_grades, export with ?lesson='''
+        self.assertIndexed(Grade.objects.filter(lesson=self.lessons[0]).order_by('date', 'id'))
+
+    def test_student_grades(self):
+        '''list_student_grades'''
+        self.assertIndexed(Grade.objects.filter(student=self.students[0]).order_by('date', 'id'))
+
+    def test_teacher_grades(self):
+        '''list_teacher_grades'''
+        self.assertIndexed(Grade.objects.filter(lesson__teacher=self.teacher).order_by('date', 'id'))
+
+    def test_lesson_grades_keyset_page(self):
+        '''list_lesson_grades?cursor= (next and previous pages)'''
+        paginator = KeysetPagination(GradeViewSet.keyset_ordering)
+        for reverse in (False, True):
+            with self.subTest(reverse=reverse):
+                page = paginator.page_queryset(Grade.objects.filter(lesson=self.lessons[0]), ['2024-01-10', 50], reverse, paginator.page_size)
+                self.assertIndexed(page)
+                self.assertOrderedByIndex(page)
+
+    def test_grade_date_filter(self):
+        '''GradeFilter date lookups'''
+        self.assertIndexed(Grade.objects.filter(date__gte=datetime.date(2024, 2, 1)).order_by('date', 'id'))
+
+    def test_grade_lesson_name_filter(self):
+        '''GradeFilter lesson__name'''
+        self.assertIndexed(Grade.objects.filter(lesson__name='Lesson 1'))
+
+    def test_lesson_stats(self):
+        '''LessonGradeStats bounds and median'''
+        grades = Grade.objects.filter(lesson=self.lessons[0], grade__isnull=False)
+        self.assertIndexed(grades.order_by('grade').values_list('grade', flat=True))
+        self.assertIndexed(grades.values('lesson').annotate(minimum=Min('grade'), maximum=Max('grade')).order_by())
+
+    def test_lesson_ranking(self):
+        '''lesson_ranking'''
+        self.assertIndexed(Grade.objects.filter(lesson=self.lessons[0], grade__isnull=False).values('student_id').annotate(average=Avg('grade')).order_by())
+
+    def test_period_ranking(self):
+        '''lesson_ranking?scope=period'''
+        self.assertIndexed(Grade.objects.filter(lesson__period='2024-1', grade__isnull=False).values('student_id').annotate(average=Avg('grade')).order_by())
+
+    def test_transcript(self):
+        '''student transcript'''
+        grades = Grade.objects.filter(student_id__in=[self.students[0].id], grade__isnull=False)
+        self.assertIndexed(grades.values('student_id', 'lesson_id', 'lesson__period').annotate(final=Avg('grade'), grades=Count('id')).order_by())
+
+    def test_lesson_grades_as_of(self):
+        '''list_lesson_grades?as_of='''
+        moment = datetime.datetime(2024, 2, 1, tzinfo=datetime.timezone.utc)
+        self.assertIndexed(GradeRevision.as_of(moment).filter(lesson_id=self.lessons[0].id).order_by('id'))
+
+    def test_profile_filters(self):
+        '''StudentFilter exact lookups'''
+        self.assertIndexed(Profile.objects.filter(identity_number='12345678901'))
+        self.assertIndexed(Profile.objects.filter(surname='Surname', name='Name'))
+        self.assertIndexed(Profile.objects.filter(name='Name'))
+
+    def test_lesson_filters(self):
+        '''LessonFilter exact lookups'''
+        self.assertIndexed(Lesson.objects.filter(period='2024-1'))
+        self.assertIndexed(Lesson.objects.filter(name='Lesson 1'))
+
+    def test_lesson_counters(self):
+        '''LessonFilter counter lookups and ordering'''
+        self.assertIndexed(Lesson.objects.filter(grade_count__gte=10))
+        self.assertIndexed(Lesson.objects.filter(student_count__gte=10).order_by('student_count', 'id'))
+        self.assertIndexed(Lesson.objects.filter(last_graded_at__isnull=False).order_by('-last_graded_at', '-id'))
+
+
+@override_settings(QUERY_BUDGET_MODE='raise')
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    '''
+    Runs the read actions with 5 and 50 rows (cold caches, OAuth2 token
+    authentication) under the query budgets of their viewsets: the query
+    count may not grow with the rows and must stay within the budget.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        cls.teacher = User.objects.create(username='teacher')
+        cls.student = User.objects.create(username='student')
+        cls.lesson = Lesson.objects.create(name='Lesson', teacher=cls.teacher)
+        application = Application.objects.create(name='tests', client_type='confidential', authorization_grant_type='password', user=cls.admin)
+        AccessToken.objects.create(user=cls.admin, token='budget', application=application, expires=timezone.now() + datetime.timedelta(hours=1), scope='read write')
+
+    def setUp(self):
+        self.client = APIClient(HTTP_AUTHORIZATION='Bearer budget')
+        self.created = 0
+
+    def users(self, count):
+        users = User.objects.bulk_create([User(username='user%d' % (self.created + i)) for i in range(count)])
+        Profile.objects.bulk_create([Profile(user=user, name='Name', surname='Surname', created_by=self.admin, updated_by=self.teacher) for user in users])
+        self.created += count
+        return users
+
+    def lessons(self, count):
+        return Lesson.objects.bulk_create([Lesson(name='Lesson %d' % i, teacher=self.teacher) for i in range(count)])
+
+    def seed_lesson_grades(self, count):
+        Grade.objects.bulk_create([Grade(student=user, lesson=self.lesson, grade=50) for user in self.users(count)])
+
+    def seed_student_grades(self, count):
+        Grade.objects.bulk_create([Grade(student=self.student, lesson=lesson, grade=50) for lesson in self.lessons(count)])
+
+    def seed_enrollments(self, count):
+        self.lesson.students.add(*self.users(count))
+
+    def seed_student_lessons(self, count):
+        self.student.lesson_students.add(*self.lessons(count))
+
+    def check(self, url, seed):
+        self.assertConstantQueries(lambda: self.client.get(url), seed)
+
+    def test_grade_list(self):
+        self.check('/api/grades/?expand=student,lesson,lesson.teacher', self.seed_lesson_grades)
+
+    def test_grade_retrieve(self):
+        self.seed_lesson_grades(1)
+        self.check('/api/grades/%d/?expand=student,lesson' % Grade.objects.first().pk, lambda count: None)
+
+    def test_lesson_grades(self):
+        self.check('/api/grades/list/lesson/%d/?expand=student' % self.lesson.pk, self.seed_lesson_grades)
+
+    def test_student_grades(self):
+        self.check('/api/grades/list/student/%d/?expand=lesson' % self.student.profile.pk, self.seed_student_grades)
+
+    def test_teacher_grades(self):
+        self.check('/api/grades/list/teacher/%d/?expand=student,lesson' % self.teacher.pk, self.seed_lesson_grades)
+
+    def test_lesson_list(self):
+        self.check('/api/lessons/?expand=teacher,students', self.seed_enrollments)
+
+    def test_lesson_retrieve(self):
+        self.check('/api/lessons/%d/?expand=teacher,students' % self.lesson.pk, self.seed_enrollments)
+
+    def test_lesson_students(self):
+        self.check('/api/lessons/%d/students/' % self.lesson.pk, self.seed_enrollments)
+
+    def test_student_list(self):
+        self.check('/api/students/?expand=created_by,updated_by', self.users)
+
+    def test_student_retrieve(self):
+        self.check('/api/students/%d/?expand=created_by,updated_by' % self.student.profile.pk, lambda count: None)
+
+    def test_student_lessons(self):
+        self.check('/api/students/%d/lessons/?expand=teacher' % self.student.profile.pk, self.seed_student_lessons)
+
+
+class BulkApiTests(TestCase):
+    '''
+    Import, export and batch endpoints called with an OAuth2 bearer token.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        cls.teacher = User.objects.create(username='teacher')
+        cls.lesson = Lesson.objects.create(name='Lesson', teacher=cls.teacher)
+        cls.students = [User.objects.create(username='student%d' % i) for i in range(3)]
+
+    def setUp(self):
+        self.client = api_client(self.admin)
+
+    def test_import_csv(self):
+        lines = ['student,lesson,grade,date'] + ['%d,%d,%d,2024-01-01' % (student.profile.pk, self.lesson.pk, 50 + i) for i, student in enumerate(self.students)]
+        lines.append('%d,%d,abc,2024-01-01' % (self.students[0].profile.pk, self.lesson.pk))
+        response = self.client.post('/api/grades/import/', '\n'.join(lines), content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['failed']), (3, 1))
+        self.assertEqual(response.data['errors'][0]['row'], 4)
+        self.assertEqual(sorted(Grade.objects.values_list('grade', flat=True)), [50, 51, 52])
+
+    def test_import_ndjson(self):
+        lines = [json.dumps({'student': student.profile.pk, 'lesson': self.lesson.pk, 'grade': 70}) for student in self.students]
+        lines.append('not json')
+        response = self.client.post('/api/grades/import/', '\n'.join(lines), content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['failed']), (3, 1))
+        self.assertEqual(Grade.objects.filter(lesson=self.lesson, grade=70).count(), 3)
+        self.assertEqual(Lesson.objects.get(pk=self.lesson.pk).grade_count, 3)
+
+    def test_batch(self):
+        other = Lesson.objects.create(name='Other', teacher=self.teacher)
+        grades = [Grade.objects.create(student=student, lesson=self.lesson, grade=40) for student in self.students]
+        response = self.client.post('/api/grades/batch/', {
+            'update': [{'id': grades[0].pk, 'grade': 95, 'description': 'retake'}, {'id': grades[1].pk, 'lesson': other.pk}],
+            'delete': [grades[2].pk],
+        }, format='json')
+        self.assertEqual(response.data, {'success': True, 'updated': 2, 'deleted': 1})
+        self.assertEqual(list(Grade.objects.order_by('pk').values_list('grade', 'description', 'lesson')), [(95, 'retake', self.lesson.pk), (40, None, other.pk)])
+        self.assertEqual(GradeRevision.objects.filter(action__in=[GradeRevision.UPDATE, GradeRevision.DELETE]).count(), 3)
+        # bulk writes send no signals, summaries and counters are refreshed by the batch
+        self.assertEqual([Lesson.objects.get(pk=lesson.pk).grade_count for lesson in (self.lesson, other)], [1, 1])
+        self.assertEqual([stats.total for stats in LessonGradeStats.objects.order_by('lesson')], [95, 40])
+
+    def test_batch_invalid(self):
+        grade = Grade.objects.create(student=self.students[0], lesson=self.lesson, grade=40)
+        response = self.client.post('/api/grades/batch/', {
+            'update': [{'id': grade.pk, 'grade': 90}, {'id': grade.pk, 'grade': 'abc'}, {'id': 0, 'grade': 1}],
+            'delete': [grade.pk + 100],
+        }, format='json')
+        self.assertFalse(response.data['success'])
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2, 3])
+        self.assertEqual(Grade.objects.get(pk=grade.pk).grade, 40)
+
+    def export(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_export(self):
+        other = Lesson.objects.create(name='Other', period='2024-2', teacher=self.teacher)
+        Profile.objects.filter(user=self.students[0]).update(name='Ada', surname='Lovelace')
+        grades = [Grade.objects.create(student=student, lesson=self.lesson, grade=60 + i, date=datetime.date(2024, 3, i + 1)) for i, student in enumerate(self.students)]
+        Grade.objects.create(student=self.students[0], lesson=other, grade=10)
+        response, content = self.export('/api/grades/export/?lesson=%d' % self.lesson.pk)
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        rows = list(csv.DictReader(content.splitlines()))
+        self.assertEqual([int(row['id']) for row in rows], [grade.pk for grade in grades])
+        self.assertEqual((rows[0]['student_name'], rows[0]['student_surname'], rows[0]['lesson_name'], rows[0]['grade'], rows[0]['date']), ('Ada', 'Lovelace', 'Lesson', '60', '2024-03-01'))
+        response, content = self.export('/api/grades/export/?format=ndjson')
+        self.assertTrue(response['Content-Type'].startswith('application/x-ndjson'))
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual((rows[-1]['lesson'], rows[-1]['period'], rows[-1]['teacher'], rows[-1]['grade']), (other.pk, '2024-2', self.teacher.pk, 10))
+
+    def test_import_unsupported_type(self):
+        response = self.client.post('/api/grades/import/', {'student': 1}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['success'])
+        self.assertEqual(Grade.objects.count(), 0)
+
+
+class GradeHistoryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        cls.lesson = Lesson.objects.create(name='Lesson', teacher=cls.admin)
+        cls.students = [User.objects.create(username='student%d' % i) for i in range(3)]
+        # written in bulk, without revisions, like grades older than the history
+        Grade.objects.bulk_create([Grade(student=student, lesson=cls.lesson, grade=60) for student in cls.students])
+
+    def setUp(self):
+        self.client = api_client(self.admin)
+
+    def test_backfill(self):
+        url = '/api/grades/?lesson=%d&as_of=%s' % (self.lesson.pk, timezone.now().date().isoformat())
+        self.assertEqual(self.client.get(url).data['count'], 0)
+        self.assertEqual(GradeRevision.backfill(batch_size=2), 3)
+        self.assertEqual(GradeRevision.backfill(), 0)
+        response = self.client.get(url)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual({row['action'] for row in response.data['results']}, {GradeRevision.CREATE})
+        yesterday = (timezone.now() - datetime.timedelta(days=1)).date().isoformat()
+        self.assertEqual(self.client.get('/api/grades/?lesson=%d&as_of=%s' % (self.lesson.pk, yesterday)).data['count'], 0)
+
+    def as_of(self, moment, lesson):
+        response = self.client.get('/api/grades/', {'lesson': lesson.pk, 'as_of': moment.isoformat()})
+        return sorted((row['id'], row['grade'], row['action']) for row in response.data['results'])
+
+    def test_as_of_update_and_delete(self):
+        lesson = Lesson.objects.create(name='History', teacher=self.admin)
+        ids = [Grade.objects.create(student=student, lesson=lesson, grade=50).pk for student in self.students[:2]]
+        created = timezone.now()
+        self.client.patch('/api/grades/%d/' % ids[0], {'grade': 80}, format='json')
+        updated = timezone.now()
+        self.client.delete('/api/grades/%d/' % ids[1])
+        self.assertEqual(self.as_of(created, lesson), [(ids[0], 50, 'create'), (ids[1], 50, 'create')])
+        self.assertEqual(self.as_of(updated, lesson), [(ids[0], 80, 'update'), (ids[1], 50, 'create')])
+        self.assertEqual(self.as_of(timezone.now(), lesson), [(ids[0], 80, 'update')])
+
+    def test_as_of_batch(self):
+        lesson = Lesson.objects.create(name='History', teacher=self.admin)
+        lines = [json.dumps({'student': student.profile.pk, 'lesson': lesson.pk, 'grade': 40 + i}) for i, student in enumerate(self.students)]
+        self.client.post('/api/grades/import/', '\n'.join(lines), content_type='application/x-ndjson')
+        ids = list(Grade.objects.filter(lesson=lesson).order_by('pk').values_list('pk', flat=True))
+        imported = timezone.now()
+        self.client.post('/api/grades/batch/', {'update': [{'id': ids[0], 'grade': 90}], 'delete': [ids[1]]}, format='json')
+        self.assertEqual(self.as_of(imported, lesson), [(ids[0], 40, 'create'), (ids[1], 41, 'create'), (ids[2], 42, 'create')])
+        self.assertEqual(self.as_of(timezone.now(), lesson), [(ids[0], 90, 'update'), (ids[2], 42, 'create')])
+
+    def test_import_without_returned_ids(self):
+        lesson = Lesson.objects.create(name='History', teacher=self.admin)
+        lines = [json.dumps({'student': student.profile.pk, 'lesson': lesson.pk, 'grade': 70}) for student in self.students]
+        # like MySQL, where bulk_create leaves the primary keys unset
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            self.client.post('/api/grades/import/', '\n'.join(lines), content_type='application/x-ndjson')
+        revisions = GradeRevision.objects.filter(lesson_id=lesson.pk).order_by('grade_id')
+        self.assertEqual(list(revisions.values_list('grade_id', 'student_id')), list(Grade.objects.filter(lesson=lesson).order_by('pk').values_list('pk', 'student_id')))
+
+    def test_as_of_needs_filter(self):
+        response = self.client.get('/api/grades/?as_of=2024-01-01')
+        self.assertFalse(response.data['success'])
+
+
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        cls.lesson = Lesson.objects.create(name='Lesson', teacher=cls.admin)
+        student = User.objects.create(username='student')
+        # undated grades sort where the database puts NULLs
+        dates = [None, datetime.date(2024, 1, 2), datetime.date(2024, 1, 1), None, datetime.date(2024, 1, 2), datetime.date(2024, 1, 3), None]
+        Grade.objects.bulk_create([Grade(student=student, lesson=cls.lesson, grade=50, date=date) for date in dates])
+
+    def test_pages_follow_the_ordering(self):
+        client = api_client(self.admin)
+        expected = list(Grade.objects.filter(lesson=self.lesson).order_by('date', 'id').values_list('id', flat=True))
+        url = '/api/grades/list/lesson/%d/?pagination=cursor&page_size=2' % self.lesson.pk
+        pages = []
+        while url:
+            response = client.get(url)
+            pages.append([row['id'] for row in response.data['results']])
+            url = response.data['next']
+        self.assertEqual(sum(pages, []), expected)
+        # and back from the last page
+        url = response.data['previous']
+        back = [pages[-1]]
+        while url:
+            response = client.get(url)
+            back.insert(0, [row['id'] for row in response.data['results']])
+            url = response.data['previous']
+        self.assertEqual(sum(back, []), expected)
+
+
+class LessonGradeStatsTests(TestCase):
+    '''
+    Summaries kept by the Grade signals must match a rebuild from the grades.
+    '''
+    FIELDS = ['count', 'total', 'total_squares', 'minimum', 'maximum', 'passed', 'histogram']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        cls.lessons = [Lesson.objects.create(name='Lesson %d' % i, teacher=cls.admin) for i in range(2)]
+        cls.students = [User.objects.create(username='student%d' % i) for i in range(6)]
+
+    def summaries(self):
+        summaries = {}
+        for stats in LessonGradeStats.objects.all():
+            # a summary whose grades were all removed equals a missing one
+            if stats.count:
+                summaries[stats.lesson_id] = [getattr(stats, field) for field in self.FIELDS] + [stats.get_median()]
+        return summaries
+
+    def assertRebuilt(self):
+        recorded = self.summaries()
+        LessonGradeStats.rebuild()
+        self.assertEqual(recorded, self.summaries())
+        return recorded
+
+    def test_changes_match_rebuild(self):
+        client = api_client(self.admin)
+        first, second = self.lessons
+        values = [35, 50, 72, 100, 0, 72]
+        grades = [Grade.objects.create(student=student, lesson=first, grade=value) for student, value in zip(self.students, values)]
+        self.assertEqual(self.assertRebuilt()[first.pk][:6], [6, sum(values), sum(value * value for value in values), 0, 100, 4])
+        # value changes, the minimum and maximum included
+        client.patch('/api/grades/%d/' % grades[4].pk, {'grade': 60}, format='json')
+        client.patch('/api/grades/%d/' % grades[3].pk, {'grade': 90}, format='json')
+        self.assertEqual(self.assertRebuilt()[first.pk][3:5], [35, 90])
+        # moved to another lesson
+        client.patch('/api/grades/%d/' % grades[0].pk, {'lesson': second.pk}, format='json')
+        client.patch('/api/grades/%d/' % grades[1].pk, {'lesson': second.pk, 'grade': 45}, format='json')
+        recorded = self.assertRebuilt()
+        self.assertEqual([recorded[lesson.pk][0] for lesson in self.lessons], [4, 2])
+        # deletes, down to an empty lesson
+        for grade in grades[:2]:
+            client.delete('/api/grades/%d/' % grade.pk)
+        grades[2].delete()
+        recorded = self.assertRebuilt()
+        self.assertNotIn(second.pk, recorded)
+        self.assertEqual(recorded[first.pk][3:5], [60, 90])
+
+    def test_saved_instance(self):
+        first, second = self.lessons
+        grade = Grade.objects.create(student=self.students[0], lesson=first, grade=50)
+        # saving the same instance again compares with what the first save wrote
+        grade.lesson, grade.grade = second, 70
+        grade.save()
+        grade.save()
+        self.assertEqual(self.assertRebuilt()[second.pk][:2], [1, 70])
+        self.assertEqual([Lesson.objects.get(pk=lesson.pk).grade_count for lesson in self.lessons], [0, 1])
+        # an instance that was not loaded: every receiver takes the row as unchanged
+        Grade(pk=grade.pk, student=self.students[0], lesson=second, grade=70, created_at=grade.created_at).save()
+        self.assertEqual(self.summaries()[second.pk][:2], [1, 70])
+        self.assertEqual([Lesson.objects.get(pk=lesson.pk).grade_count for lesson in self.lessons], [0, 1])
+
+    def test_stats_api(self):
+        lesson = self.lessons[0]
+        for student, value in zip(self.students, [40, 55, 70, 85]):
+            Grade.objects.create(student=student, lesson=lesson, grade=value)
+        client = api_client(self.admin)
+        data = client.get('/api/lessons/%d/stats/' % lesson.pk).data
+        self.assertEqual((data['count'], data['mean'], data['median'], data['minimum'], data['maximum']), (4, 62.5, 62.5, 40, 85))
+        self.assertEqual((data['passed'], data['pass_rate']), (3, 0.75))
+        LessonGradeStats.rebuild([lesson.pk])
+        rebuilt = client.get('/api/lessons/%d/stats/' % lesson.pk).data
+        self.assertEqual({**rebuilt, 'updated_at': None}, {**data, 'updated_at': None})
+
+
+class LessonRankingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        cls.lesson = Lesson.objects.create(name='Lesson', period='2024-1', teacher=cls.admin)
+        cls.other = Lesson.objects.create(name='Other', period='2024-1', teacher=cls.admin)
+        cls.students = [User.objects.create(username='student%d' % i) for i in range(5)]
+        Profile.objects.filter(user=cls.students[0]).update(name='Ada', surname='Lovelace')
+        Grade.objects.bulk_create([
+            Grade(student=cls.students[0], lesson=cls.lesson, grade=90),
+            Grade(student=cls.students[1], lesson=cls.lesson, grade=70),
+            Grade(student=cls.students[1], lesson=cls.lesson, grade=90),
+            Grade(student=cls.students[2], lesson=cls.lesson, grade=80),
+            Grade(student=cls.students[3], lesson=cls.lesson, grade=70),
+            # ungraded rows are not ranked
+            Grade(student=cls.students[4], lesson=cls.lesson, grade=None),
+            Grade(student=cls.students[3], lesson=cls.other, grade=100),
+        ])
+
+    def setUp(self):
+        self.client = api_client(self.admin)
+
+    def ranking(self, query=''):
+        response = self.client.get('/api/lessons/%d/ranking/%s' % (self.lesson.pk, query))
+        return [(row['student'], row['average'], row['grades'], row['rank'], row['percentile']) for row in response.data['results']]
+
+    def test_lesson_ranks_ties_and_percentiles(self):
+        student = [student.pk for student in self.students]
+        self.assertEqual(self.ranking(), [
+            (student[0], 90.0, 1, 1, 100.0),
+            (student[1], 80.0, 2, 2, 66.67),
+            (student[2], 80.0, 1, 2, 66.67),
+            (student[3], 70.0, 1, 4, 0.0),
+        ])
+        response = self.client.get('/api/lessons/%d/ranking/' % self.lesson.pk)
+        self.assertEqual(response.data['results'][0]['full_name'], 'Ada Lovelace')
+
+    def test_period_scope(self):
+        student = [student.pk for student in self.students]
+        self.assertEqual([row[0::3] for row in self.ranking('?scope=period')], [(student[0], 1), (student[3], 2), (student[1], 3), (student[2], 3)])
+
+    def test_top(self):
+        self.assertEqual([row[3] for row in self.ranking('?top=2')], [1, 2, 2])
+
+    def test_invalid_parameters(self):
+        for query in ('?top=abc', '?top=0'):
+            with self.subTest(query=query):
+                response = self.client.get('/api/lessons/%d/ranking/%s' % (self.lesson.pk, query))
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.data['success'])
+        self.assertFalse(self.client.get('/api/lessons/%d/ranking/?scope=school' % self.lesson.pk).data['success'])
+
+
+class MatrixTests(TestCase):
+
+    def test_matrix(self):
+        admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        first = Lesson.objects.create(name='First', period='2024-1', teacher=admin)
+        second = Lesson.objects.create(name='Second', period='2024-1', teacher=admin)
+        other = Lesson.objects.create(name='Other', period='2024-2', teacher=admin)
+        students = [User.objects.create(username='student%d' % i) for i in range(4)]
+        for student, (name, surname) in zip(students, [('Ada', 'Lovelace'), ('Alan', 'Turing'), ('Grace', 'Hopper'), ('Edsger', 'Dijkstra')]):
+            Profile.objects.filter(user=student).update(name=name, surname=surname)
+        first.students.add(students[1], students[3])
+        second.students.add(students[1])
+        Grade.objects.bulk_create([
+            Grade(student=students[1], lesson=first, grade=60),
+            Grade(student=students[1], lesson=first, grade=85),
+            Grade(student=students[1], lesson=second, grade=None),
+            # graded without being enrolled, sorted in with the enrolled students
+            Grade(student=students[0], lesson=second, grade=90),
+            Grade(student=students[2], lesson=other, grade=50),
+        ])
+        data = api_client(admin).get('/api/grades/matrix/?period=2024-1').data
+        self.assertEqual(data['rows'], [students[0].pk, students[1].pk, students[3].pk])
+        self.assertEqual(data['row_labels'], ['Ada Lovelace', 'Alan Turing', 'Edsger Dijkstra'])
+        self.assertEqual((data['columns'], data['column_labels']), ([first.pk, second.pk], ['First', 'Second']))
+        self.assertEqual(data['values'], [None, 90.0, 72.5, None, None, None])
+
+    def test_period_required(self):
+        admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        self.assertFalse(api_client(admin).get('/api/grades/matrix/').data['success'])
+
+
+class TranscriptTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        cls.lessons = [Lesson.objects.create(name='Lesson %d' % i, period='2024-%d' % (i + 1), teacher=cls.admin) for i in range(2)]
+        cls.student = User.objects.create(username='student')
+        cls.other = User.objects.create(username='other')
+        Grade.objects.create(student=cls.student, lesson=cls.lessons[0], grade=60)
+        Grade.objects.create(student=cls.student, lesson=cls.lessons[0], grade=80)
+        Grade.objects.create(student=cls.student, lesson=cls.lessons[1], grade=90)
+
+    def setUp(self):
+        cache.clear()
+
+    def cached(self, student=None):
+        return cache.get(transcripts.cache_key((student or self.student).pk))
+
+    def test_get_transcript(self):
+        transcript = transcripts.get_transcript(self.student.pk)
+        self.assertEqual([(lesson['name'], lesson['final'], lesson['grades']) for lesson in transcript['lessons']], [('Lesson 0', 70.0, 2), ('Lesson 1', 90.0, 1)])
+        self.assertEqual(transcript['periods'], [{'period': '2024-1', 'average': 70.0, 'lessons': 1}, {'period': '2024-2', 'average': 90.0, 'lessons': 1}])
+        self.assertEqual((transcript['average'], transcript['gpa']), (80.0, 3.2))
+        with self.assertNumQueries(0):
+            self.assertEqual(transcripts.get_transcript(self.student.pk), transcript)
+        response = api_client(self.admin).get('/api/students/%d/transcript/' % self.student.profile.pk)
+        self.assertEqual(response.data, transcript)
+        self.assertEqual(transcripts.get_transcript(self.other.pk)['lessons'], [])
+
+    def test_grade_write_invalidates(self):
+        transcripts.get_transcript(self.student.pk)
+        grade = Grade.objects.create(student=self.student, lesson=self.lessons[1], grade=70)
+        self.assertIsNone(self.cached())
+        transcripts.get_transcript(self.student.pk)
+        transcripts.get_transcript(self.other.pk)
+        # moved to another student: both transcripts change
+        grade.student = self.other
+        grade.save()
+        self.assertIsNone(self.cached())
+        self.assertIsNone(self.cached(self.other))
+        self.assertEqual(transcripts.get_transcript(self.other.pk)['average'], 70.0)
+        grade.delete()
+        self.assertIsNone(self.cached(self.other))
+
+    def test_lesson_rename_invalidates(self):
+        transcripts.get_transcript(self.student.pk)
+        lesson = self.lessons[0]
+        lesson.name = 'Renamed'
+        lesson.save()
+        self.assertIsNone(self.cached())
+        self.assertEqual(transcripts.get_transcript(self.student.pk)['lessons'][0]['name'], 'Renamed')
+
+    def test_lesson_delete_invalidates(self):
+        transcripts.get_transcript(self.student.pk)
+        Lesson.objects.filter(pk=self.lessons[1].pk).delete()
+        self.assertIsNone(self.cached())
+        self.assertEqual([lesson['name'] for lesson in transcripts.get_transcript(self.student.pk)['lessons']], ['Lesson 0'])
+
+    def test_rebuild_transcripts(self):
+        self.assertEqual(transcripts.rebuild_transcripts([self.student.pk, self.other.pk]), 2)
+        self.assertEqual(self.cached()['average'], 80.0)
+        self.assertEqual(self.cached(self.other)['lessons'], [])
+        cache.clear()
+        # all students with grades
+        self.assertEqual(transcripts.rebuild_transcripts(), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(transcripts.get_transcript(self.student.pk)['gpa'], 3.2)
+
+    def test_rebuild_command_needs_shared_cache(self):
+        with self.assertRaises(CommandError):
+            call_command('rebuild_transcripts', stdout=io.StringIO())
+        with tempfile.TemporaryDirectory() as location:
+            with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}):
+                out = io.StringIO()
+                call_command('rebuild_transcripts', '--student', str(self.student.pk), stdout=out)
+                self.assertIn('Cached transcripts of 1 students', out.getvalue())
+                self.assertEqual(self.cached()['average'], 80.0)
@@ -0,0 +1,142 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, Max
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from custom.caches import is_shared
+from custom.constants import GradeConstants
+from lesson.models import Lesson
+from .models import Grade, deferred_changes
+
+
+CACHE_PREFIX = 'transcript:'
+BATCH_SIZE = 500
+# seconds a transcript is kept in a local memory cache, which only sees the
+# invalidations of its own process
+LOCAL_CACHE_TIMEOUT = 60
+
+
+def cache_key(student_id):
+    return '%s%s' % (CACHE_PREFIX, student_id)
+
+
+def cache_timeout():
+    if is_shared():
+        return settings.TRANSCRIPT_CACHE_TIMEOUT
+    return min(settings.TRANSCRIPT_CACHE_TIMEOUT, LOCAL_CACHE_TIMEOUT)
+
+
+def lesson_rows(student_ids=None):
+    '''
+    One grouped query: final grade (average) of each student in each lesson.
+    @student_ids: limit to these students (user ids), all students when None
+    '''
+    grades = Grade.objects.filter(student__isnull=False, lesson__isnull=False, grade__isnull=False)
+    if student_ids is not None:
+        grades = grades.filter(student_id__in=student_ids)
+    return grades.values('student_id', 'lesson_id', 'lesson__name', 'lesson__period') \
+        .annotate(final=Avg('grade'), grades=Count('id'), last_date=Max('date')) \
+        .order_by('student_id', 'lesson__period', 'lesson_id')
+
+
+def average(values):
+    return sum(values) / len(values) if values else None
+
+
+def build(student_id, rows):
+    '''
+    Transcript of a student from its lesson rows.
+    '''
+    lessons = []
+    periods = {}
+    for row in rows:
+        final = float(row['final'])
+        lessons.append({
+            'lesson': row['lesson_id'],
+            'name': row['lesson__name'],
+            'period': row['lesson__period'],
+            'final': final,
+            'grades': row['grades'],
+            'last_date': row['last_date'],
+        })
+        periods.setdefault(row['lesson__period'], []).append(final)
+    overall = average([lesson['final'] for lesson in lessons])
+    return {
+        'student': student_id,
+        'lessons': lessons,
+        'periods': [{'period': period, 'average': average(finals), 'lessons': len(finals)} for period, finals in periods.items()],
+        'average': overall,
+        'gpa': None if overall is None else overall / GradeConstants.MAX_GRADE * GradeConstants.GPA_SCALE,
+    }
+
+
+def get_transcript(student_id):
+    '''
+    Cached transcript of a student (user id), computed with one query on a miss.
+    '''
+    key = cache_key(student_id)
+    transcript = cache.get(key)
+    if transcript is None:
+        transcript = build(student_id, lesson_rows([student_id]))
+        cache.set(key, transcript, cache_timeout())
+    return transcript
+
+
+def rebuild_transcripts(student_ids=None):
+    '''
+    Recompute and cache transcripts of all (or the given) students from one
+    streamed grouped query, writing the cache in batches. Only useful with a
+    shared cache, other processes do not see a local memory cache.
+    '''
+    batch = {}
+    count = 0
+    current = None
+    rows = []
+    for row in lesson_rows(student_ids).iterator(chunk_size=2000):
+        if row['student_id'] != current:
+            if current is not None:
+                batch[cache_key(current)] = build(current, rows)
+            current = row['student_id']
+            rows = []
+            if len(batch) >= BATCH_SIZE:
+                cache.set_many(batch, cache_timeout())
+                count += len(batch)
+                batch = {}
+        rows.append(row)
+    if current is not None:
+        batch[cache_key(current)] = build(current, rows)
+    # students without grades still get an (empty) cached transcript
+    for student_id in student_ids or []:
+        batch.setdefault(cache_key(student_id), build(student_id, []))
+    cache.set_many(batch, cache_timeout())
+    return count + len(batch)
+
+
+def invalidate_transcripts(student_ids):
+    touched = deferred_changes()
+    if touched is not None:
+        touched['students'].update(student_ids)
+        return
+    cache.delete_many([cache_key(student_id) for student_id in student_ids if student_id is not None])
+
+
+@receiver(post_save, sender=Grade)
+def invalidate_grade_transcript(sender, instance, **kwargs):
+    '''
+    Drops the cached transcripts of the grade's student (old and new).
+    '''
+    invalidate_transcripts({instance.stored('student_id'), instance.student_id})
+
+
+@receiver(post_delete, sender=Grade)
+def invalidate_deleted_grade_transcript(sender, instance, **kwargs):
+    invalidate_transcripts([instance.stored('student_id')])
+
+
+@receiver(post_save, sender=Lesson)
+def invalidate_lesson_transcripts(sender, instance, created, **kwargs):
+    '''
+    Lesson name and period are part of the transcript.
+    '''
+    if not created:
+        invalidate_transcripts(Grade.objects.filter(lesson=instance).values_list('student_id', flat=True).distinct())
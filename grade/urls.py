@@ -4,6 +4,10 @@ from . import api
 
 urlpatterns = [
     path('', api.GradeViewSet.as_view({"get": "list", "post": "create"})),
+    path('matrix/', api.GradeViewSet.as_view({"get": "matrix"})),
+    path('batch/', api.GradeViewSet.as_view({"post": "batch"})),
+    path('export/', api.GradeViewSet.as_view({"get": "export_grades"})),
+    path('import/', api.GradeViewSet.as_view({"post": "import_grades"})),
     path('<int:pk>/', api.GradeViewSet.as_view({"get": "retrieve", "put": "update", "delete": "destroy", "patch": "partial_update"})),
     path('list/student/<int:pk>/', api.GradeViewSet.as_view({"get": "list_student_grades"})),
     path('list/lesson/<int:pk>/', api.GradeViewSet.as_view({"get": "list_lesson_grades"})),
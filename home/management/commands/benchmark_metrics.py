@@ -0,0 +1,42 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve
+from middleware.metrics import MetricsMiddleware, MetricsRegistry
+import middleware.metrics
+
+class Command(BaseCommand):
+    help = 'Measure the per request cost of the metrics middleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000, help='Requests per run (default: 20000)')
+        parser.add_argument('--queries', type=int, default=5, help='SQL queries per request (default: 5)')
+        parser.add_argument('--path', default='/api/lessons/', help='Path the requests are labelled with (default: /api/lessons/)')
+
+    def handle(self, *args, **options):
+        count, queries = options['requests'], options['queries']
+        request = RequestFactory().get(options['path'])
+        request.resolver_match = resolve(options['path'])
+        body = b'x' * 2048
+
+        def view(request):
+            with connection.cursor() as cursor:
+                for _ in range(queries):
+                    cursor.execute('SELECT 1')
+            return HttpResponse(body)
+
+        # a fresh registry, the benchmark does not show up in /metrics
+        middleware.metrics.registry = MetricsRegistry()
+        wrapped = MetricsMiddleware(view)
+        timings = {}
+        for name, handler in (('bare', view), ('metrics', wrapped), ('bare ', view), ('metrics ', wrapped)):
+            started = time.perf_counter()
+            for _ in range(count):
+                handler(request)
+            timings[name.strip()] = min(timings.get(name.strip(), float('inf')), (time.perf_counter() - started) / count)
+        overhead = timings['metrics'] - timings['bare']
+        self.stdout.write('without middleware: %.1f us/request' % (timings['bare'] * 1e6))
+        self.stdout.write('with middleware:    %.1f us/request' % (timings['metrics'] * 1e6))
+        self.stdout.write(self.style.SUCCESS('overhead: %.1f us/request (%d queries each)\n' % (overhead * 1e6, queries)))
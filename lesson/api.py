@@ -10,67 +10,67 @@ from django.contrib.admin.views.decorators import staff_member_required
 from rest_framework import permissions
 import logging
 from .models import Lesson
+from custom.relations import with_relations
+from custom.summaries import user_summaries
+from custom.serializers import ExpandableFieldsMixin, ExpandableListSerializer
+from custom.pagination import KeysetPaginationMixin
+from custom.conditional import ConditionalGetMixin
+from custom.response_cache import ResponseCacheMixin
+from functools import partial
+
+def id_list(value):
+    '''
+    List of integer ids from request data, None when it is not one.
+    '''
+    if not isinstance(value, list):
+        return None
+    try:
+        return [int(id) for id in value]
+    except (TypeError, ValueError):
+        return None
+
 
 class IsAdminUser(permissions.BasePermission):
     def has_permission(self, request, view):
         return request.user and request.user.is_staff
 
 
-class LessonSerializer(serializers.ModelSerializer):
+class LessonSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     teacher = serializers.SerializerMethodField()
     created_by = serializers.SerializerMethodField()
     updated_by = serializers.SerializerMethodField()
     students = serializers.SerializerMethodField()
+    expandable_users = ['teacher', 'created_by', 'updated_by']
+    expandable_user_lists = ['students']
+    # counters change without touching updated_at
+    validator_timestamps = ['updated_at', 'last_graded_at']
+    validator_totals = ['student_count', 'grade_count']
 
     class Meta:
         model = Lesson
         fields = '__all__'
+        list_serializer_class = ExpandableListSerializer
+        read_only_fields = Lesson.COUNTER_FIELDS
 
     def get_teacher(self, obj):
-        if not obj.teacher:
-            return None
-        return {
-            'id': obj.teacher.id,
-            'full_name': self.user_full_name(obj.teacher),
-            'email': obj.teacher.email,
-            'dateofbirth': obj.teacher.profile.dateofbirth,
-        }
+        if not self.is_expanded('teacher'):
+            return obj.teacher_id
+        return self.user_summary(obj.teacher_id)
     
     def get_created_by(self, obj):
-        if not obj.created_by:
-            return None
-        return {
-            'id': obj.created_by.id,
-            'full_name':self.user_full_name(obj.created_by),
-            'email': obj.created_by.email,
-            'dateofbirth': obj.created_by.profile.dateofbirth,
-        }
+        if not self.is_expanded('created_by'):
+            return obj.created_by_id
+        return self.user_summary(obj.created_by_id)
     
     def get_updated_by(self, obj):
-        if not obj.updated_by:
-            return None
-        return {
-            'id': obj.updated_by.id,
-            'full_name': self.user_full_name(obj.updated_by),
-            'email': obj.updated_by.email,
-            'dateofbirth': obj.updated_by.profile.dateofbirth,
-        }
+        if not self.is_expanded('updated_by'):
+            return obj.updated_by_id
+        return self.user_summary(obj.updated_by_id)
     
     def get_students(self, obj):
-        students = []
-        for student in obj.students.all():
-            students.append({
-                'id': student.id,
-                'full_name': self.user_full_name(student),
-                'email': student.email,
-                'dateofbirth': student.profile.dateofbirth,
-            })
-        return students
-    
-    def user_full_name(self, obj):
-        name = obj.profile.name if obj.profile.name else ''
-        surname = obj.profile.surname if obj.profile.surname else ''
-        return name + ' ' + surname
+        if not self.is_expanded('students'):
+            return [student.id for student in obj.students.all()]
+        return [self.user_summary(student.id) for student in obj.students.all()]
     
 
 
@@ -81,15 +81,34 @@ class LessonFilter(filters.FilterSet):
             'name': SearchConstants.STRING,
             'description': SearchConstants.STRING,
             'period': SearchConstants.STRING,
+            'student_count': SearchConstants.INT,
+            'grade_count': SearchConstants.INT,
+            'last_graded_at': SearchConstants.DATETIME,
         }
 
+    # ?ordering=-student_count, served by the counter indexes without joins
+    ordering = filters.OrderingFilter(fields=('id', 'name', 'period', 'student_count', 'grade_count', 'last_graded_at'))
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.form.cleaned_data.get('ordering'):
+            # id breaks ties so pages are stable
+            queryset = queryset.order_by(*queryset.query.order_by, 'id')
+        return queryset
 
-class LessonViewSet(viewsets.ModelViewSet):
+
+class LessonViewSet(ResponseCacheMixin, ConditionalGetMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     queryset = Lesson.objects.all()
     serializer_class = LessonSerializer
     filterset_class = LessonFilter
     # permission_classes = [permissions.IsAuthenticated, IsAdminUser]
     authentication_classes = [OAuth2Authentication]
+    # most queries per action whatever the number of rows (custom.query_budget)
+    query_budgets = {
+        'list': 6,
+        'retrieve': 5,
+        'list_students': 4,
+    }
 
     def get_permissions(self):
         if self.action == 'list' or self.action == 'list_students' or self.action == 'retrieve':
@@ -98,6 +117,13 @@ class LessonViewSet(viewsets.ModelViewSet):
             permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
         return [permission() for permission in permission_classes]
 
+    def get_queryset(self):
+        '''
+        Lessons with the relations the requested fields read loaded up front.
+        '''
+        select, prefetch = LessonSerializer.request_plan(self.request)
+        return with_relations(Lesson.objects.all(), select, prefetch).order_by('id')
+
     # return success with message
     def success(self, message):
         return Response({'success': True, 'message': message}, status=status.HTTP_200_OK)
@@ -112,8 +138,7 @@ class LessonViewSet(viewsets.ModelViewSet):
         Get list of all lessons.
         '''
         try:
-            queryset = Lesson.objects.all().select_related('created_by', 'updated_by', 'teacher', 'students').order_by('id')
-            return super().list(queryset, *args, **kwargs)
+            return self.conditional_response(self.filter_queryset(self.get_queryset()), partial(super().list, request, *args, **kwargs))
         except Exception as e:
             logging.getLogger('db').exception(e)
             return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -124,10 +149,8 @@ class LessonViewSet(viewsets.ModelViewSet):
         Get details of a lesson.
         '''
         try:
-            queryset = Lesson.objects.all()
-            lesson = get_object_or_404(queryset, pk=pk)
-            serializer = LessonSerializer(lesson)
-            return Response(serializer.data)
+            queryset = self.get_queryset().filter(pk=pk)
+            return self.conditional_response(queryset, lambda: Response(self.get_serializer(get_object_or_404(queryset)).data))
         except Exception as e:
             logging.getLogger('db').exception(e)
             return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -221,10 +244,9 @@ class LessonViewSet(viewsets.ModelViewSet):
             if not student:
                 return self.fail('Student not found.')
 
-            if student in lesson.students.all():
+            if lesson.students.filter(pk=student.pk).exists():
                 return self.fail('Student already in lesson.')
             lesson.students.add(student)
-            lesson.save()
             return self.success('Student added to lesson.')
         except Exception as e:
             logging.getLogger('db').exception(e)
@@ -244,20 +266,74 @@ class LessonViewSet(viewsets.ModelViewSet):
             student = User.objects.filter(pk=spk).first()
             if not student:
                 return self.fail('Student not found.')
-            if student not in lesson.students.all():
+            if not lesson.students.filter(pk=student.pk).exists():
                 return self.fail('Student not in lesson.')
             lesson.students.remove(student)
-            lesson.save()
             return self.success('Student removed from lesson.')
         except Exception as e:
             logging.getLogger('db').exception(e)
             return Response(status=status.HTTP_400_BAD_REQUEST)
         
 
-    def user_full_name(self, obj):
-        name = obj.profile.name if obj.profile.name else ''
-        surname = obj.profile.surname if obj.profile.surname else ''
-        return name + ' ' + surname
+    # add many students to lesson
+    def add_students(self, request, pk=None, *args, **kwargs):
+        '''
+        Add students to lesson.
+        @pk: lesson id
+        Body: {"students": [student id, ...]}
+        '''
+        try:
+            ids = id_list(request.data.get('students'))
+            if ids is None:
+                return self.fail('Students must be a list of ids.')
+            lesson = Lesson.objects.filter(pk=pk).first()
+            if not lesson:
+                return self.fail('Lesson not found.')
+            found = set(User.objects.filter(pk__in=ids).values_list('pk', flat=True))
+            enrolled = set(lesson.students.filter(pk__in=found).values_list('pk', flat=True))
+            added = found - enrolled
+            lesson.students.add(*added)
+            return Response({
+                'success': True,
+                'message': '%d students added to lesson.' % len(added),
+                'added': sorted(added),
+                'already_added': sorted(enrolled),
+                'not_found': sorted(set(ids) - found),
+            })
+        except Exception as e:
+            logging.getLogger('db').exception(e)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+    # remove many students from lesson
+    def remove_students(self, request, pk=None, *args, **kwargs):
+        '''
+        Remove students from lesson.
+        @pk: lesson id
+        Body: {"students": [student id, ...]}
+        '''
+        try:
+            ids = id_list(request.data.get('students'))
+            if ids is None:
+                return self.fail('Students must be a list of ids.')
+            lesson = Lesson.objects.filter(pk=pk).first()
+            if not lesson:
+                return self.fail('Lesson not found.')
+            removed = set(lesson.students.filter(pk__in=ids).values_list('pk', flat=True))
+            lesson.students.remove(*removed)
+            return Response({
+                'success': True,
+                'message': '%d students removed from lesson.' % len(removed),
+                'removed': sorted(removed),
+                'not_in_lesson': sorted(set(ids) - removed),
+            })
+        except Exception as e:
+            logging.getLogger('db').exception(e)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+
+    def student_summaries(self, students):
+        summaries = user_summaries.get_many([student.id for student in students])
+        return [summaries.get(student.id) for student in students]
 
     # list students of lesson
     def list_students(self, request, pk=None, *args, **kwargs):
@@ -269,15 +345,8 @@ class LessonViewSet(viewsets.ModelViewSet):
             lesson = Lesson.objects.filter(pk=pk).first()
             if not lesson:
                 return self.fail('Lesson not found.')
-            students = []
-            for student in lesson.students.all():
-                students.append({
-                    'id': student.id,
-                    'full_name': self.user_full_name(student),
-                    'email': student.email,
-                    'dateofbirth': student.profile.dateofbirth,
-                })
-            return Response(students)
+            students = User.objects.filter(lesson_students=lesson).only('id').order_by('id')
+            return self.keyset_response(students, self.student_summaries)
         except Exception as e:
             logging.getLogger('db').exception(e)
             return Response(status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from custom.response_cache import bump
+from grade.models import refresh_lesson_grade_counters
+from lesson.models import Lesson
+
+class Command(BaseCommand):
+    help = 'Recompute lesson student and grade counters from enrollments and grades'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lesson', type=int, nargs='*', help='Lesson ids to repair (default: all lessons)')
+
+    def handle(self, *args, **options):
+        lesson_ids = options.get('lesson') or None
+        repaired = Lesson.refresh_student_counts(lesson_ids)
+        refresh_lesson_grade_counters(lesson_ids)
+        bump('lesson.Lesson')
+        self.stdout.write(self.style.SUCCESS('Repaired counters of %d lessons\n' % repaired))
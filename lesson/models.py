@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_save
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, pre_save, m2m_changed, pre_delete, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 
@@ -18,5 +20,79 @@ class Lesson(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     updated_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="lesson_updated_by", null=True)
 
+    # denormalized counters, kept current by signal receivers (see grade.models
+    # for the grade counters) and repaired with the repair_lesson_counters command
+    student_count = models.PositiveIntegerField(default=0, verbose_name="Student Count")
+    grade_count = models.PositiveIntegerField(default=0, verbose_name="Grade Count")
+    last_graded_at = models.DateTimeField(blank=True, verbose_name="Last Graded At", null=True)
+
+    COUNTER_FIELDS = ('student_count', 'grade_count', 'last_graded_at')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['name'], name='lesson_name_idx'),
+            models.Index(fields=['period'], name='lesson_period_idx'),
+            models.Index(fields=['student_count', 'id'], name='lesson_student_count_idx'),
+            models.Index(fields=['grade_count', 'id'], name='lesson_grade_count_idx'),
+            models.Index(fields=['last_graded_at', 'id'], name='lesson_last_graded_idx'),
+        ]
+
     def __str__(self):
-        return "%s %s" % (self.name, self.description)
\ No newline at end of file
+        return "%s %s" % (self.name, self.description)
+
+    def save(self, *args, **kwargs):
+        # counters are only written with atomic updates, saving a loaded
+        # (possibly stale) lesson must not overwrite them
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.COUNTER_FIELDS]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def refresh_student_counts(cls, lesson_ids=None, **values):
+        '''
+        Recompute student_count of all (or the given) lessons in one statement.
+        @values: other fields to set in the same update
+        '''
+        through = cls.students.through
+        counts = through.objects.filter(lesson_id=OuterRef('pk')).order_by() \
+            .values('lesson_id').annotate(count=Count('id')).values('count')
+        lessons = cls.objects.all() if lesson_ids is None else cls.objects.filter(pk__in=lesson_ids)
+        return lessons.update(student_count=Coalesce(Subquery(counts), 0), **values)
+
+
+@receiver(m2m_changed, sender=Lesson.students.through)
+def update_student_count(sender, instance, action, reverse, pk_set, **kwargs):
+    '''
+    Keeps Lesson.student_count current on lesson.students and
+    user.lesson_students changes; enrollment is part of the lesson, so
+    updated_at moves too.
+    '''
+    now = timezone.now()
+    if action == 'pre_clear' and reverse:
+        # remember the lessons of the user, the post_clear pk_set is empty
+        instance._cleared_lessons = list(instance.lesson_students.values_list('pk', flat=True))
+    elif action == 'post_add' and pk_set:
+        # pk_set only holds the rows actually inserted
+        if reverse:
+            Lesson.objects.filter(pk__in=pk_set).update(student_count=F('student_count') + 1, updated_at=now)
+        else:
+            Lesson.objects.filter(pk=instance.pk).update(student_count=F('student_count') + len(pk_set), updated_at=now)
+    elif action == 'post_remove' and pk_set:
+        # pk_set holds the submitted ids, members or not, so recount
+        Lesson.refresh_student_counts(pk_set if reverse else [instance.pk], updated_at=now)
+    elif action == 'post_clear':
+        Lesson.refresh_student_counts(instance.__dict__.pop('_cleared_lessons', []) if reverse else [instance.pk], updated_at=now)
+
+
+@receiver(pre_delete, sender=User)
+def remember_user_lessons(sender, instance, **kwargs):
+    # enrollments of a deleted user are removed without m2m_changed
+    instance._enrolled_lessons = list(instance.lesson_students.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=User)
+def update_deleted_user_lessons(sender, instance, **kwargs):
+    lesson_ids = instance.__dict__.pop('_enrolled_lessons', None)
+    if lesson_ids:
+        Lesson.refresh_student_counts(lesson_ids, updated_at=timezone.now())
\ No newline at end of file
@@ -1,3 +1,205 @@
-from django.test import TestCase
+import tempfile
+from django.contrib.auth.models import User
+from django.core import checks
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from accounts.models import Profile
+from custom.response_cache import bump, check_response_cache, response_cache
+from custom.summaries import user_summaries
+from custom.testing import api_client
+from grade.models import Grade, refresh_lesson_grade_counters
+from .models import Lesson
 
-# Create your tests here.
+
+class ResponseCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        cls.teacher = User.objects.create(username='teacher')
+        Profile.objects.filter(user=cls.teacher).update(name='Ada', surname='Lovelace')
+        cls.lesson = Lesson.objects.create(name='Lesson', teacher=cls.teacher)
+
+    def setUp(self):
+        self.client = api_client(self.admin)
+        user_summaries.clear()
+
+    def use_shared_cache(self):
+        '''
+        Turn the response cache on with a file based cache, shared like in production.
+        '''
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        caches = {
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location.name},
+        }
+        shared = override_settings(CACHES=caches, RESPONSE_CACHE_ALIAS='shared', RESPONSE_CACHE_TIMEOUT=300)
+        shared.enable()
+        self.addCleanup(shared.disable)
+
+    def teacher_name(self):
+        return self.client.get('/api/lessons/%d/?expand=teacher' % self.lesson.pk).data['teacher']['full_name']
+
+    def test_off_by_default(self):
+        self.assertIsNone(response_cache())
+        self.assertEqual(check_response_cache(None), [])
+
+    @override_settings(RESPONSE_CACHE_ALIAS='default', RESPONSE_CACHE_TIMEOUT=300)
+    def test_local_memory_refused(self):
+        self.assertEqual([error.id for error in check_response_cache(None)], ['response_cache.E001'])
+        self.assertIn('response_cache.E001', [error.id for error in checks.run_checks(tags=[checks.Tags.caches])])
+
+    def test_shared_cache(self):
+        self.use_shared_cache()
+        self.assertEqual(self.teacher_name(), 'Ada Lovelace')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.teacher_name(), 'Ada Lovelace')
+        self.assertFalse([query for query in queries if 'lesson_lesson' in query['sql']])
+        # written by another process (a management command): no signal reaches this one
+        Profile.objects.filter(user=self.teacher).update(name='Grace', surname='Hopper')
+        self.assertEqual(self.teacher_name(), 'Ada Lovelace')
+        bump('accounts.Profile')
+        # the summary LRU of this process still holds the old name, the response is built without it
+        self.assertEqual(user_summaries.get(self.teacher.pk)['full_name'], 'Ada Lovelace')
+        self.assertEqual(self.teacher_name(), 'Grace Hopper')
+
+
+class LessonCounterTests(TestCase):
+    '''
+    Counters kept by the enrollment and Grade signals must match a recount.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        cls.lessons = [Lesson.objects.create(name='Lesson %d' % i, teacher=cls.admin) for i in range(2)]
+        cls.students = [User.objects.create(username='student%d' % i) for i in range(5)]
+
+    def setUp(self):
+        self.client = api_client(self.admin)
+
+    def counters(self):
+        return {lesson.pk: [getattr(lesson, field) for field in Lesson.COUNTER_FIELDS] for lesson in Lesson.objects.all()}
+
+    def assertRecounted(self):
+        counted = self.counters()
+        Lesson.refresh_student_counts()
+        refresh_lesson_grade_counters()
+        self.assertEqual(counted, self.counters())
+        return counted
+
+    def test_student_count(self):
+        first, second = self.lessons
+        self.client.post('/api/lessons/%d/students/%d/' % (first.pk, self.students[0].pk))
+        self.client.post('/api/lessons/%d/students/bulk/' % first.pk, {'students': [student.pk for student in self.students]}, format='json')
+        self.client.post('/api/lessons/%d/students/bulk/' % second.pk, {'students': [student.pk for student in self.students[:2]]}, format='json')
+        self.assertEqual([counters[0] for counters in self.assertRecounted().values()], [5, 2])
+        self.client.delete('/api/lessons/%d/students/%d/' % (first.pk, self.students[0].pk))
+        self.client.delete('/api/lessons/%d/students/bulk/' % first.pk, {'students': [student.pk for student in self.students[1:3]]}, format='json')
+        # from the user side of the relation, and by deleting a user
+        self.students[3].lesson_students.clear()
+        self.students[1].delete()
+        self.assertEqual([counters[0] for counters in self.assertRecounted().values()], [1, 1])
+
+    def test_grade_count(self):
+        first, second = self.lessons
+        grades = [Grade.objects.create(student=student, lesson=first, grade=70) for student in self.students]
+        self.assertEqual(self.assertRecounted()[first.pk][1], 5)
+        self.client.patch('/api/grades/%d/' % grades[0].pk, {'lesson': second.pk}, format='json')
+        self.client.patch('/api/grades/%d/' % grades[1].pk, {'grade': 80}, format='json')
+        self.client.delete('/api/grades/%d/' % grades[4].pk)
+        counted = self.assertRecounted()
+        self.assertEqual([counted[lesson.pk][1] for lesson in self.lessons], [3, 1])
+        self.assertEqual(counted[first.pk][2], Grade.objects.get(pk=grades[1].pk).updated_at)
+        Grade.objects.get(pk=grades[0].pk).delete()
+        self.assertEqual(self.assertRecounted()[second.pk][1:], [0, None])
+
+    def test_ordering_by_counters(self):
+        first, second = self.lessons
+        second.students.add(*self.students[:3])
+        first.students.add(self.students[0])
+        Grade.objects.create(student=self.students[0], lesson=first, grade=90)
+        rows = self.client.get('/api/lessons/?ordering=-student_count').data['results']
+        self.assertEqual([(row['id'], row['student_count'], row['grade_count']) for row in rows], [(second.pk, 3, 0), (first.pk, 1, 1)])
+
+
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        cls.student = User.objects.create(username='student')
+        cls.lesson = Lesson.objects.create(name='Lesson', teacher=cls.admin)
+
+    def setUp(self):
+        self.client = api_client(self.admin)
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_not_modified(self):
+        url = '/api/lessons/?expand=teacher,students'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        cached = self.revalidate(url, response)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual((cached['ETag'], cached.content), (response['ETag'], b''))
+        # another query or format is another representation
+        self.assertEqual(self.client.get('/api/lessons/?expand=teacher', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_changes(self):
+        url = '/api/lessons/%d/?expand=teacher,students' % self.lesson.pk
+        changes = [
+            lambda: self.lesson.students.add(self.student),
+            lambda: Grade.objects.create(student=self.student, lesson=self.lesson, grade=70),
+            lambda: Profile.objects.get(user=self.student).save(),
+            lambda: Lesson.objects.create(name='Other', teacher=self.admin),
+        ]
+        response = self.client.get(url)
+        for index, change in enumerate(changes):
+            change()
+            current = self.revalidate(url, response)
+            # a new lesson is not part of this one
+            self.assertEqual(current.status_code, 304 if index == 3 else 200, index)
+            response = current if current.status_code == 200 else response
+
+    def test_per_user(self):
+        url = '/api/lessons/'
+        response = self.client.get(url)
+        other = api_client(self.student).get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(other.status_code, 200)
+        self.assertNotEqual(other['ETag'], response['ETag'])
+
+    def test_grade_list(self):
+        grade = Grade.objects.create(student=self.student, lesson=self.lesson, grade=70)
+        url = '/api/grades/list/lesson/%d/' % self.lesson.pk
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+        grade.grade = 80
+        grade.save()
+        current = self.revalidate(url, response)
+        self.assertEqual((current.status_code, current.data[0]['grade']), (200, 80))
+
+    def test_body_matches_validators(self):
+        self.lesson.students.add(self.student)
+        url = '/api/lessons/%d/?expand=students' % self.lesson.pk
+        response = self.client.get(url)
+        # the summary LRU of this process is warm, the profile changes elsewhere (no signal here)
+        self.assertIn(self.student.pk, user_summaries.entries)
+        Profile.objects.filter(user=self.student).update(name='Grace', surname='Hopper', updated_at=timezone.now())
+        current = self.revalidate(url, response)
+        self.assertEqual(current.status_code, 200)
+        self.assertEqual(current.data['students'][0]['full_name'], 'Grace Hopper')
+        self.assertEqual(self.revalidate(url, current).status_code, 304)
+
+    def test_cursor_pages_without_validators(self):
+        response = self.client.get('/api/lessons/?pagination=cursor')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/lessons/?pagination=cursor')
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql'].upper()])
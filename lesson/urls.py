@@ -1,13 +1,17 @@
 from django.urls import path, include
 from rest_framework import routers, renderers
 from . import api
+from grade import api as grade_api
 
 
 urlpatterns = [
     path('', api.LessonViewSet.as_view({"get": "list", "post": "create"})),
     path('<int:pk>/', api.LessonViewSet.as_view({"get": "retrieve", "put": "update", "delete": "destroy", "patch": "partial_update"})),
     path('<int:pk>/students/', api.LessonViewSet.as_view({"get": "list_students"})),
+    path('<int:pk>/students/bulk/', api.LessonViewSet.as_view({"post": "add_students", "delete": "remove_students"})),
     path('<int:lpk>/students/<int:spk>/', api.LessonViewSet.as_view({"post": "add_student", "delete": "remove_student"})),
+    path('<int:pk>/stats/', grade_api.GradeViewSet.as_view({"get": "lesson_stats"})),
+    path('<int:pk>/ranking/', grade_api.GradeViewSet.as_view({"get": "lesson_ranking"})),
 
     
 ]
\ No newline at end of file
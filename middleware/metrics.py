@@ -0,0 +1,323 @@
+import atexit
+import copy
+import fcntl
+import glob
+import hmac
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (seconds) of the request duration histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAMILIES = [
+    ('sgs_requests_total', 'counter', 'Requests by view action and status code.'),
+    ('sgs_request_duration_seconds', 'histogram', 'Time spent handling requests.'),
+    ('sgs_sql_queries_total', 'counter', 'SQL queries run by requests.'),
+    ('sgs_sql_duration_seconds_total', 'counter', 'Time spent in SQL queries by requests.'),
+    ('sgs_response_bytes_total', 'counter', 'Bytes of response bodies.'),
+]
+
+
+class MetricsRegistry:
+    '''
+    Request metrics of this process, summed across processes.
+
+    Every view action has one series [requests, seconds, per bucket counts,
+    queries, query seconds, bytes] and a count per status code. All values
+    are sums, so the series of several processes merge by adding them. With
+    METRICS_DIR set every process writes its series to its own file there at
+    most every METRICS_DUMP_INTERVAL seconds and at exit, and collect() adds
+    up all files. Files of exited processes are folded into one
+    EXITED_FILE, so counters do not go back and the directory does not grow
+    with every restarted worker. Without it only this process is reported.
+    '''
+    EXITED_FILE = 'metrics-exited.json'
+    LOCK_FILE = '.metrics.lock'
+    PROCESS_FILE = re.compile(r'^metrics-(\d+)-\d+\.json$')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # labels -> [requests, seconds, buckets, queries, query seconds, bytes]
+        self.series = {}
+        # (labels, status) -> requests
+        self.statuses = {}
+        self.pid = None
+        self.path = None
+        self.dumped_at = 0
+
+    @staticmethod
+    def new_series():
+        return [0, 0.0, [0] * (len(BUCKETS) + 1), 0, 0.0, 0]
+
+    def observe(self, labels, status, seconds, queries, sql_seconds, size):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = self.new_series()
+            series[0] += 1
+            series[1] += seconds
+            series[2][bisect_left(BUCKETS, seconds)] += 1
+            series[3] += queries
+            series[4] += sql_seconds
+            series[5] += size
+            key = (labels, status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+        if settings.METRICS_DIR and time.monotonic() - self.dumped_at > settings.METRICS_DUMP_INTERVAL:
+            self.dump()
+
+    def add_bytes(self, labels, size):
+        with self.lock:
+            self.series.setdefault(labels, self.new_series())[5] += size
+
+    def dump(self):
+        '''
+        Write the series of this process to its file in METRICS_DIR.
+        '''
+        with self.lock:
+            if self.pid != os.getpid():
+                if self.pid is not None:
+                    # forked after dumping, the series are the parent's
+                    self.series = {}
+                    self.statuses = {}
+                # one file per process, named by pid and start time as pids are reused
+                self.pid = os.getpid()
+                self.path = os.path.join(settings.METRICS_DIR, 'metrics-%d-%d.json' % (self.pid, time.time_ns()))
+            data = self.payload(self.series, self.statuses)
+            self.dumped_at = time.monotonic()
+        try:
+            self.write(self.path, data)
+        except OSError as e:
+            # metrics never fail a request; retried after the next interval
+            logger.error('Could not write request metrics to %s: %s', settings.METRICS_DIR, e)
+
+    @staticmethod
+    def payload(series, statuses):
+        return {
+            'series': [[labels] + values for labels, values in series.items()],
+            'statuses': [[labels, status, count] for (labels, status), count in statuses.items()],
+        }
+
+    @staticmethod
+    def write(path, data):
+        '''
+        Replace a metrics file atomically, through a temporary file of its own.
+        '''
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.metrics-', suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w') as file:
+                json.dump(data, file)
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def read(path, series, statuses):
+        '''
+        Add the series of a metrics file; False when it can not be read.
+        '''
+        try:
+            with open(path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return False
+        for row in data['series']:
+            labels = tuple(tuple(label) for label in row[0])
+            MetricsRegistry.merge(series.setdefault(labels, MetricsRegistry.new_series()), row[1:])
+        for labels, status, count in data['statuses']:
+            key = (tuple(tuple(label) for label in labels), status)
+            statuses[key] = statuses.get(key, 0) + count
+        return True
+
+    @staticmethod
+    def running(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def fold_exited(self):
+        '''
+        Add the files of exited processes to EXITED_FILE and remove them.
+        '''
+        directory = settings.METRICS_DIR
+        exited = []
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            match = self.PROCESS_FILE.match(os.path.basename(path))
+            if match and path != self.path and not self.running(int(match.group(1))):
+                exited.append(path)
+        if not exited:
+            return
+        with open(os.path.join(directory, self.LOCK_FILE), 'a') as lock:
+            # collectors of other workers may fold at the same time
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            series = {}
+            statuses = {}
+            exited_path = os.path.join(directory, self.EXITED_FILE)
+            self.read(exited_path, series, statuses)
+            exited = [path for path in exited if self.read(path, series, statuses)]
+            if not exited:
+                return
+            self.write(exited_path, self.payload(series, statuses))
+            for path in exited:
+                os.unlink(path)
+
+    @staticmethod
+    def merge(total, values):
+        for index, value in enumerate(values):
+            if isinstance(value, list):
+                MetricsRegistry.merge(total[index], value)
+            else:
+                total[index] += value
+
+    def collect(self):
+        '''
+        (series, statuses) of all processes.
+        '''
+        if not settings.METRICS_DIR:
+            with self.lock:
+                return {labels: copy.deepcopy(values) for labels, values in self.series.items()}, dict(self.statuses)
+        self.dump()
+        try:
+            self.fold_exited()
+        except OSError as e:
+            logger.error('Could not fold metrics of exited processes in %s: %s', settings.METRICS_DIR, e)
+        series = {}
+        statuses = {}
+        for path in glob.glob(os.path.join(settings.METRICS_DIR, 'metrics-*.json')):
+            self.read(path, series, statuses)
+        return series, statuses
+
+    @staticmethod
+    def sample(name, labels, value):
+        text = ','.join('%s="%s"' % (label, label_value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for label, label_value in labels)
+        return '%s{%s} %s' % (name, text, repr(value) if isinstance(value, float) else value)
+
+    def render(self):
+        '''
+        All series in the Prometheus text exposition format.
+        '''
+        series, statuses = self.collect()
+        lines = []
+        for name, kind, description in FAMILIES:
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            if name == 'sgs_requests_total':
+                for (labels, status), count in sorted(statuses.items()):
+                    lines.append(self.sample(name, labels + (('status', str(status)),), count))
+                continue
+            for labels, (requests, seconds, buckets, queries, sql_seconds, size) in sorted(series.items()):
+                if kind == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS + ('+Inf',), buckets):
+                        cumulative += count
+                        lines.append(self.sample(name + '_bucket', labels + (('le', str(bound)),), cumulative))
+                    lines.append(self.sample(name + '_sum', labels, seconds))
+                    lines.append(self.sample(name + '_count', labels, requests))
+                else:
+                    value = {'sgs_sql_queries_total': queries, 'sgs_sql_duration_seconds_total': sql_seconds, 'sgs_response_bytes_total': size}[name]
+                    lines.append(self.sample(name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+@atexit.register
+def dump_at_exit():
+    if settings.METRICS_DIR and registry.pid == os.getpid():
+        registry.dump()
+
+
+class QueryCounter:
+    '''
+    Database execute wrapper counting queries and their time.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+def view_labels(request):
+    '''
+    (view, action) labels of a request: the viewset and its action for DRF
+    views, the view for other views.
+    '''
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved', ''
+    view = getattr(match.func, 'cls', None) or getattr(match.func, 'view_class', None)
+    actions = getattr(match.func, 'actions', None) or {}
+    if view is None:
+        return match.view_name or match._func_path, ''
+    return view.__name__, actions.get(request.method.lower(), '')
+
+
+def counted(content, labels):
+    for chunk in content:
+        registry.add_bytes(labels, len(chunk))
+        yield chunk
+
+
+class MetricsMiddleware:
+    '''
+    Records duration, SQL queries, response size and status of every request
+    in the metrics registry, labelled with the view action. Put it first so
+    the other middleware is measured too.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        view, action = view_labels(request)
+        labels = (('view', view), ('action', action), ('method', request.method))
+        if response.streaming:
+            # the body is produced after the view returns; its bytes are added as they are sent
+            size = 0
+            response.streaming_content = counted(response.streaming_content, labels)
+        else:
+            size = len(response.content)
+        registry.observe(labels, response.status_code, time.perf_counter() - started, queries.count, queries.seconds, size)
+        return response
+
+
+def metrics(request):
+    '''
+    Metrics of all workers for Prometheus. With METRICS_TOKEN set the scraper
+    must send it as a bearer token.
+    '''
+    token = settings.METRICS_TOKEN
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
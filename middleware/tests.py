@@ -0,0 +1,125 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from django.test import SimpleTestCase, override_settings
+from .metrics import BUCKETS, MetricsRegistry
+
+
+LABELS = (('view', 'LessonViewSet'), ('action', 'list'), ('method', 'GET'))
+
+
+def exited_pid():
+    '''
+    Pid of a process that has exited.
+    '''
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    return process.pid
+
+
+@override_settings(METRICS_DUMP_INTERVAL=3600)
+class MetricsRegistryTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(METRICS_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def files(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+
+    def process_file(self, pid, requests, status=200):
+        '''
+        Metrics file of another process with `requests` requests of 0.02 seconds.
+        '''
+        registry = MetricsRegistry()
+        # keeps observe() from dumping it as a file of this process
+        registry.dumped_at = time.monotonic()
+        for i in range(requests):
+            registry.observe(LABELS, status, 0.02, 2, 0.01, 100)
+        path = os.path.join(self.directory, 'metrics-%d-1.json' % pid)
+        MetricsRegistry.write(path, MetricsRegistry.payload(registry.series, registry.statuses))
+        return path
+
+    def test_dump(self):
+        registry = MetricsRegistry()
+        registry.observe(LABELS, 200, 0.02, 3, 0.01, 100)
+        registry.observe(LABELS, 404, 3.0, 1, 0.5, 20)
+        registry.add_bytes(LABELS, 5)
+        registry.dump()
+        self.assertEqual(self.files(), [os.path.basename(registry.path)])
+        self.assertEqual(MetricsRegistry.PROCESS_FILE.match(os.path.basename(registry.path)).group(1), str(os.getpid()))
+        with open(registry.path) as file:
+            data = json.load(file)
+        buckets = [0] * (len(BUCKETS) + 1)
+        buckets[BUCKETS.index(0.025)] = buckets[BUCKETS.index(5.0)] = 1
+        self.assertEqual(data['series'], [[[list(label) for label in LABELS], 2, 3.02, buckets, 4, 0.51, 125]])
+        self.assertEqual(sorted(status for _, status, _ in data['statuses']), [200, 404])
+        # the next dump replaces the file of this process
+        registry.observe(LABELS, 200, 0.02, 3, 0.01, 100)
+        registry.dump()
+        self.assertEqual(len(self.files()), 1)
+
+    def test_collect_merges_processes(self):
+        running = self.process_file(os.getppid(), 2)
+        registry = MetricsRegistry()
+        registry.observe(LABELS, 200, 0.02, 2, 0.01, 100)
+        series, statuses = registry.collect()
+        self.assertEqual(series[LABELS][0], 3)
+        self.assertEqual(series[LABELS][3], 6)
+        self.assertEqual(statuses, {(LABELS, 200): 3})
+        # files of running processes are kept
+        self.assertTrue(os.path.exists(running))
+
+    def test_exited_processes_folded(self):
+        registry = MetricsRegistry()
+        registry.observe(LABELS, 200, 0.02, 2, 0.01, 100)
+        exited = [self.process_file(exited_pid(), 2), self.process_file(exited_pid(), 1, status=500)]
+        series, statuses = registry.collect()
+        self.assertEqual(statuses, {(LABELS, 200): 3, (LABELS, 500): 1})
+        self.assertFalse(any(os.path.exists(path) for path in exited))
+        self.assertEqual(self.files(), sorted([MetricsRegistry.EXITED_FILE, os.path.basename(registry.path)]))
+        # folded once: counters neither go back nor count the exited processes again
+        self.process_file(exited_pid(), 1)
+        series, statuses = registry.collect()
+        self.assertEqual(series[LABELS][0], 5)
+        self.assertEqual(statuses, {(LABELS, 200): 4, (LABELS, 500): 1})
+        self.assertEqual(len(self.files()), 2)
+
+    def test_unreadable_file_skipped(self):
+        with open(os.path.join(self.directory, 'metrics-%d-1.json' % exited_pid()), 'w') as file:
+            file.write('{')
+        registry = MetricsRegistry()
+        registry.observe(LABELS, 200, 0.02, 2, 0.01, 100)
+        self.assertEqual(registry.collect()[1], {(LABELS, 200): 1})
+
+    def test_render(self):
+        registry = MetricsRegistry()
+        registry.observe(LABELS, 200, 0.02, 2, 0.01, 100)
+        registry.observe(LABELS, 200, 0.2, 2, 0.01, 100)
+        lines = registry.render().splitlines()
+        self.assertIn('sgs_requests_total{view="LessonViewSet",action="list",method="GET",status="200"} 2', lines)
+        self.assertIn('sgs_request_duration_seconds_bucket{view="LessonViewSet",action="list",method="GET",le="0.025"} 1', lines)
+        self.assertIn('sgs_request_duration_seconds_bucket{view="LessonViewSet",action="list",method="GET",le="+Inf"} 2', lines)
+        self.assertIn('sgs_sql_queries_total{view="LessonViewSet",action="list",method="GET"} 4', lines)
+
+
+class MetricsViewTests(SimpleTestCase):
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE sgs_requests_total counter', response.content.decode())
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_without_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
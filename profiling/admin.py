@@ -0,0 +1,61 @@
+import json
+from django.contrib import admin
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+from .models import RequestProfile
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'view', 'action', 'status_code', 'duration', 'query_count', 'query_seconds', 'user', 'sampled', 'download')
+    list_filter = ('sampled', 'view', 'action', 'status_code')
+    search_fields = ('path',)
+    date_hierarchy = 'created_at'
+    exclude = ('stats', 'queries')
+    readonly_fields = ('created_at', 'user', 'method', 'path', 'view', 'action', 'status_code', 'sampled', 'duration',
+                       'query_count', 'query_seconds', 'download', 'sql', 'summary')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/download/', self.admin_site.admin_view(self.download_view), name='profiling_requestprofile_download'),
+            path('<int:pk>/sql/', self.admin_site.admin_view(self.sql_view), name='profiling_requestprofile_sql'),
+        ] + super().get_urls()
+
+    @admin.display(description='Download')
+    def download(self, obj):
+        return format_html(
+            '<a href="{}">profile</a> | <a href="{}">sql</a>',
+            reverse('admin:profiling_requestprofile_download', args=[obj.pk]),
+            reverse('admin:profiling_requestprofile_sql', args=[obj.pk]),
+        )
+
+    @admin.display(description='SQL')
+    def sql(self, obj):
+        return format_html('<pre>{}</pre>', '\n\n'.join('-- %.6fs\n%s' % (query['seconds'], query['sql']) for query in obj.queries))
+
+    def download_view(self, request, pk):
+        '''
+        pstats file of a profile, for pstats.Stats(path) or snakeviz.
+        '''
+        if not self.has_view_permission(request):
+            return HttpResponse(status=403)
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        response = HttpResponse(bytes(profile.stats), content_type='application/octet-stream')
+        response['Content-Disposition'] = 'attachment; filename="request-%d.prof"' % profile.pk
+        return response
+
+    def sql_view(self, request, pk):
+        if not self.has_view_permission(request):
+            return HttpResponse(status=403)
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        response = HttpResponse(json.dumps(profile.queries, indent=2), content_type='application/json')
+        response['Content-Disposition'] = 'attachment; filename="request-%d-sql.json"' % profile.pk
+        return response
@@ -0,0 +1,119 @@
+import cProfile
+import io
+import marshal
+import pstats
+import random
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from oauth2_provider.settings import oauth2_settings
+from middleware.metrics import view_labels
+from .models import RequestProfile
+
+
+class QueryRecorder:
+    '''
+    Database execute wrapper keeping the SQL of a request and its time.
+    '''
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.queries = []
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            seconds = time.perf_counter() - started
+            self.count += 1
+            self.seconds += seconds
+            if len(self.queries) < self.limit:
+                # no parameters: they can hold tokens and password hashes
+                self.queries.append({'sql': sql, 'seconds': round(seconds, 6)})
+
+
+def staff_user(request):
+    '''
+    The staff user who made the request, or None, known before the view runs:
+    the session user, else the user of a valid OAuth2 bearer token (loaded
+    through the configured, cached validator, the body is not read).
+    '''
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        user = None
+        kind, _, token = request.headers.get('Authorization', '').partition(' ')
+        if kind.lower() == 'bearer' and token:
+            access_token = oauth2_settings.OAUTH2_VALIDATOR_CLASS()._load_access_token(token)
+            if access_token is not None and access_token.is_valid():
+                user = access_token.user
+    return user if user is not None and user.is_active and user.is_staff else None
+
+
+class ProfilingMiddleware:
+    '''
+    Runs a request under cProfile, records its SQL and stores both as a
+    RequestProfile, for a PROFILING_SAMPLE_RATE share of the requests and
+    for staff requests sending the PROFILING_HEADER header. The id of the
+    stored profile is returned in the X-Profile-Id response header and the
+    profile can be downloaded from the admin. The header is checked against
+    the staff user before the profiler starts, so other clients can not make
+    requests pay for it. With PROFILING_ENABLED off the middleware removes
+    itself from the chain when it is loaded.
+    '''
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.header = settings.PROFILING_HEADER
+        self.rate = settings.PROFILING_SAMPLE_RATE
+
+    def __call__(self, request):
+        user = staff_user(request) if self.header in request.headers else None
+        sampled = self.rate > 0 and random.random() < self.rate
+        if user is None and not sampled:
+            return self.get_response(request)
+        profiler = cProfile.Profile()
+        queries = QueryRecorder(settings.PROFILING_MAX_QUERIES)
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - started
+        profile = self.store(request, response, user, user is None, profiler, queries, duration)
+        response['X-Profile-Id'] = str(profile.pk)
+        return response
+
+    def store(self, request, response, user, sampled, profiler, queries, duration):
+        summary = io.StringIO()
+        stats = pstats.Stats(profiler, stream=summary)
+        stats.sort_stats('cumulative').print_stats(50)
+        view, action = view_labels(request)
+        if user is None and getattr(request, 'user', None) is not None and request.user.is_authenticated:
+            user = request.user
+        profile = RequestProfile.objects.create(
+            user=user,
+            method=request.method,
+            path=request.get_full_path(),
+            view=view,
+            action=action,
+            status_code=response.status_code,
+            sampled=sampled,
+            duration=duration,
+            query_count=queries.count,
+            query_seconds=queries.seconds,
+            queries=queries.queries,
+            summary=summary.getvalue(),
+            stats=marshal.dumps(stats.stats),
+        )
+        # keep the newest PROFILING_KEEP profiles
+        expired = RequestProfile.objects.order_by('-created_at', '-id').values_list('id', flat=True)[settings.PROFILING_KEEP:]
+        RequestProfile.objects.filter(id__in=list(expired)).delete()
+        return profile
@@ -0,0 +1,30 @@
+from django.db import models
+from django.contrib.auth.models import User
+
+
+class RequestProfile(models.Model):
+    '''
+    cProfile statistics and SQL of one profiled request (see profiling.middleware).
+    '''
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, related_name="request_profiles", null=True)
+    method = models.CharField(max_length=10, verbose_name="Method")
+    path = models.TextField(verbose_name="Path")
+    view = models.CharField(max_length=200, blank=True, verbose_name="View")
+    action = models.CharField(max_length=100, blank=True, verbose_name="Action")
+    status_code = models.PositiveSmallIntegerField(verbose_name="Status")
+    sampled = models.BooleanField(default=False, verbose_name="Sampled", help_text="Picked by sampling rather than requested with the header")
+    duration = models.FloatField(verbose_name="Seconds")
+    query_count = models.PositiveIntegerField(default=0, verbose_name="Queries")
+    query_seconds = models.FloatField(default=0, verbose_name="Query seconds")
+    # [{sql, seconds}] of the first PROFILING_MAX_QUERIES queries, parameters are not stored
+    queries = models.JSONField(default=list)
+    summary = models.TextField(blank=True, verbose_name="Summary")
+    # pstats (marshal) data, loadable with pstats.Stats or snakeviz
+    stats = models.BinaryField()
+
+    class Meta:
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return "%s %s (%.3fs)" % (self.method, self.path, self.duration)
@@ -0,0 +1,72 @@
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from custom.testing import api_client
+from .models import RequestProfile
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0.0, PROFILING_KEEP=500)
+class ProfilingMiddlewareTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create(username='staff', is_staff=True, is_superuser=True)
+        cls.student = User.objects.create(username='student')
+
+    def test_not_profiled_without_header(self):
+        response = api_client(self.staff).get('/api/lessons/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_staff_header(self):
+        response = api_client(self.staff).get('/api/lessons/', HTTP_X_PROFILE='1')
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual((profile.user, profile.sampled, profile.status_code), (self.staff, False, 200))
+        self.assertEqual((profile.view, profile.action), ('LessonViewSet', 'list'))
+        self.assertEqual(profile.query_count, len(profile.queries))
+        self.assertTrue(all(set(query) == {'sql', 'seconds'} for query in profile.queries))
+        self.assertTrue(profile.stats)
+
+    def test_staff_header_with_body(self):
+        # authenticated by the view, the middleware does not parse the body
+        response = api_client(self.staff).post('/api/lessons/', {'name': 'Lesson', 'teacher': self.staff.pk}, format='json', HTTP_X_PROFILE='1')
+        self.assertIn(response.status_code, (200, 201))
+        self.assertTrue(RequestProfile.objects.filter(pk=response['X-Profile-Id'], method='POST').exists())
+
+    def test_staff_session(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/admin/', HTTP_X_PROFILE='1')
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual((profile.user, profile.sampled), (self.staff, False))
+
+    def test_header_ignored_for_other_users(self):
+        clients = {
+            'student': api_client(self.student),
+            'anonymous': self.client,
+            'unknown token': APIClient(HTTP_AUTHORIZATION='Bearer unknown'),
+        }
+        for name, client in clients.items():
+            with self.subTest(name), mock.patch('profiling.middleware.cProfile.Profile') as profiler:
+                response = client.get('/api/lessons/', HTTP_X_PROFILE='1')
+                # checked before profiling, the request does not pay for the profiler
+                profiler.assert_not_called()
+                self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(PROFILING_SAMPLE_RATE=0.5)
+    def test_sampling(self):
+        client = api_client(self.student)
+        with mock.patch('profiling.middleware.random.random', side_effect=[0.9, 0.1]):
+            skipped = client.get('/api/lessons/')
+            sampled = client.get('/api/lessons/')
+        self.assertNotIn('X-Profile-Id', skipped)
+        profile = RequestProfile.objects.get(pk=sampled['X-Profile-Id'])
+        self.assertEqual((profile.user, profile.sampled), (self.student, True))
+
+    @override_settings(PROFILING_KEEP=3)
+    def test_keep(self):
+        client = api_client(self.staff)
+        ids = [int(client.get('/api/lessons/', HTTP_X_PROFILE='1')['X-Profile-Id']) for i in range(5)]
+        self.assertEqual(sorted(RequestProfile.objects.values_list('id', flat=True)), ids[2:])
@@ -0,0 +1,83 @@
+from rest_framework import serializers, viewsets, permissions
+from rest_framework.response import Response
+from rest_framework import status
+from oauth2_provider.contrib.rest_framework import OAuth2Authentication
+import logging
+from .models import SearchDocument
+from .index import MIN_QUERY_LENGTH, search
+from .typeahead import prefix_index
+
+
+class SearchResultSerializer(serializers.ModelSerializer):
+    type = serializers.CharField(source='kind')
+    id = serializers.IntegerField(source='object_id')
+    rank = serializers.FloatField()
+
+    class Meta:
+        model = SearchDocument
+        fields = ['type', 'id', 'title', 'detail', 'rank']
+
+
+class SearchViewSet(viewsets.ViewSet):
+    permission_classes = [permissions.IsAuthenticated]
+    authentication_classes = [OAuth2Authentication]
+    default_limit = 20
+    max_limit = 100
+
+    # return success = False with message
+    def fail(self, message):
+        return Response({'success': False, 'message': message}, status=status.HTTP_200_OK)
+
+    def get_permissions(self):
+        if self.action == 'list':
+            permission_classes = [permissions.IsAuthenticated]
+        else:
+            permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
+        return [permission() for permission in permission_classes]
+
+    def list(self, request, *args, **kwargs):
+        '''
+        Search users (name, surname, identity number, email) and lessons
+        (name, description), best matches first.
+        ?q: search text, ?type: user and/or lesson (comma separated), ?limit
+        Users are only searched by staff.
+        '''
+        try:
+            query = request.query_params.get('q', '').strip()
+            if len(query) < MIN_QUERY_LENGTH:
+                return self.fail('Search text must be at least %d characters.' % MIN_QUERY_LENGTH)
+            kinds = [kind.strip() for kind in request.query_params.get('type', '').split(',') if kind.strip()]
+            allowed = [SearchDocument.USER, SearchDocument.LESSON] if request.user.is_staff else [SearchDocument.LESSON]
+            kinds = [kind for kind in kinds if kind in allowed] if kinds else allowed
+            if not kinds:
+                return Response({'results': []})
+            try:
+                limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+            except ValueError:
+                limit = self.default_limit
+            documents = search(query, kinds, max(limit, 1))
+            return Response({'results': SearchResultSerializer(documents, many=True).data})
+        except Exception as e:
+            logging.getLogger('db').exception(e)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+    def typeahead(self, request, *args, **kwargs):
+        '''
+        Users whose name, surname or identity number starts with ?q, for
+        student and teacher pickers. ?limit: number of matches (default 10).
+        '''
+        try:
+            try:
+                limit = min(int(request.query_params.get('limit', 10)), self.max_limit)
+            except ValueError:
+                limit = 10
+            return Response({'results': prefix_index.lookup(request.query_params.get('q', ''), max(limit, 1))})
+        except Exception as e:
+            logging.getLogger('db').exception(e)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+    def typeahead_stats(self, request, *args, **kwargs):
+        '''
+        Size, memory footprint and lookup times of this process's typeahead index.
+        '''
+        return Response(prefix_index.stats())
@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+class SearchConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'search'
+
+    def ready(self):
+        # connect index maintenance receivers; the full text structures are
+        # database specific, they are created after migrate instead of in a
+        # (generated) migration
+        from .index import install_receiver
+        from . import typeahead
+        post_migrate.connect(install_receiver, sender=self)
@@ -0,0 +1,190 @@
+import re
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from accounts.models import Profile
+from custom.relations import users_with_profile
+from lesson.models import Lesson
+from .models import SearchDocument
+
+
+MIN_QUERY_LENGTH = 3
+BATCH_SIZE = 2000
+TABLE = SearchDocument._meta.db_table
+FTS_TABLE = TABLE + '_fts'
+
+# PostgreSQL: word search with a tsvector expression index, substring and
+# fuzzy matches with a pg_trgm index
+POSTGRES_INSTALL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS search_document_vector_idx ON {table} USING gin (to_tsvector('simple', text))",
+    "CREATE INDEX IF NOT EXISTS search_document_trigram_idx ON {table} USING gin (text gin_trgm_ops)",
+]
+
+# SQLite: FTS5 table over the documents (external content) kept current by
+# triggers; the trigram tokenizer matches substrings like pg_trgm
+SQLITE_INSTALL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(text, content='{table}', content_rowid='id', tokenize='{tokenizer}')",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+    "INSERT INTO {fts}(rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, text) VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE ON {table} BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, text) VALUES ('delete', old.id, old.text); "
+    "INSERT INTO {fts}(rowid, text) VALUES (new.id, new.text); END",
+]
+
+
+def install(using=None):
+    '''
+    Create the full text search structures of the database, if missing.
+    '''
+    database = connections[using or DEFAULT_DB_ALIAS]
+    with database.cursor() as cursor:
+        if TABLE not in database.introspection.table_names(cursor):
+            # post_migrate also runs when only other apps were migrated
+            return
+        if database.vendor == 'postgresql':
+            for statement in POSTGRES_INSTALL:
+                cursor.execute(statement.format(table=TABLE))
+        elif database.vendor == 'sqlite':
+            exists = FTS_TABLE in database.introspection.table_names(cursor)
+            # the trigram tokenizer needs SQLite 3.34
+            tokenizer = 'trigram' if database.Database.sqlite_version_info >= (3, 34) else 'unicode61 remove_diacritics 2'
+            for statement in SQLITE_INSTALL:
+                cursor.execute(statement.format(table=TABLE, fts=FTS_TABLE, tokenizer=tokenizer))
+            if not exists:
+                cursor.execute("INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(fts=FTS_TABLE))
+
+
+def install_receiver(sender, using=None, **kwargs):
+    install(using)
+
+
+def user_document(user):
+    profile = user.profile
+    full_name = ' '.join(part for part in (profile.name, profile.surname) if part)
+    return SearchDocument(
+        kind=SearchDocument.USER,
+        object_id=user.pk,
+        title=full_name or user.username,
+        detail=user.email,
+        text=' '.join(part for part in (profile.name, profile.surname, profile.identity_number, user.email) if part),
+    )
+
+
+def lesson_document(lesson):
+    return SearchDocument(
+        kind=SearchDocument.LESSON,
+        object_id=lesson.pk,
+        title=lesson.name,
+        detail=lesson.period,
+        text=' '.join(part for part in (lesson.name, lesson.description) if part),
+    )
+
+
+def replace_documents(kind, object_ids, documents):
+    '''
+    Replace the documents of the given objects, one delete and one insert.
+    '''
+    with transaction.atomic():
+        SearchDocument.objects.filter(kind=kind, object_id__in=object_ids).delete()
+        SearchDocument.objects.bulk_create(documents, batch_size=BATCH_SIZE)
+
+
+def index_users(user_ids):
+    users = users_with_profile().filter(pk__in=user_ids, profile__isnull=False)
+    replace_documents(SearchDocument.USER, user_ids, [user_document(user) for user in users])
+
+
+def index_lessons(lesson_ids):
+    lessons = Lesson.objects.filter(pk__in=lesson_ids)
+    replace_documents(SearchDocument.LESSON, lesson_ids, [lesson_document(lesson) for lesson in lessons])
+
+
+def rebuild():
+    '''
+    Recreate all documents from users and lessons, in batches.
+    '''
+    install()
+    SearchDocument.objects.all().delete()
+    count = 0
+    for queryset, build in ((users_with_profile().filter(profile__isnull=False), user_document), (Lesson.objects.all(), lesson_document)):
+        batch = []
+        for instance in queryset.order_by('pk').iterator(chunk_size=BATCH_SIZE):
+            batch.append(build(instance))
+            if len(batch) >= BATCH_SIZE:
+                count += len(SearchDocument.objects.bulk_create(batch))
+                batch = []
+        count += len(SearchDocument.objects.bulk_create(batch))
+    return count
+
+
+def terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def search(query, kinds=None, limit=20):
+    '''
+    Documents matching all words of the query, best first, with a `rank`.
+    Words match as prefixes (PostgreSQL) or substrings (SQLite trigram).
+    '''
+    words = terms(query)
+    if not words:
+        return []
+    kind_sql = ''
+    kind_params = []
+    if kinds:
+        kind_sql = ' AND kind IN (%s)' % ', '.join(['%s'] * len(kinds))
+        kind_params = list(kinds)
+    if connection.vendor == 'postgresql':
+        sql = (
+            "SELECT *, ts_rank(to_tsvector('simple', text), query) + similarity(text, %s) AS rank "
+            "FROM {table}, to_tsquery('simple', %s) query "
+            "WHERE (to_tsvector('simple', text) @@ query OR text ILIKE %s){kinds} "
+            "ORDER BY rank DESC, id LIMIT %s"
+        ).format(table=TABLE, kinds=kind_sql)
+        like = '%' + query.strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        params = [query, ' & '.join(word + ':*' for word in words), like] + kind_params + [limit]
+        return list(SearchDocument.objects.raw(sql, params))
+    if connection.vendor == 'sqlite':
+        words = [word for word in words if len(word) >= MIN_QUERY_LENGTH]
+        if not words:
+            return []
+        sql = (
+            "SELECT {table}.*, -bm25({fts}) AS rank FROM {fts} JOIN {table} ON {table}.id = {fts}.rowid "
+            "WHERE {fts} MATCH %s{kinds} ORDER BY rank DESC, {table}.id LIMIT %s"
+        ).format(table=TABLE, fts=FTS_TABLE, kinds=kind_sql.replace('kind', TABLE + '.kind'))
+        params = [' AND '.join('"%s"' % word for word in words)] + kind_params + [limit]
+        return list(SearchDocument.objects.raw(sql, params))
+    documents = SearchDocument.objects.all()
+    for word in words:
+        documents = documents.filter(text__icontains=word)
+    if kinds:
+        documents = documents.filter(kind__in=kinds)
+    documents = list(documents.order_by('id')[:limit])
+    for document in documents:
+        document.rank = 0
+    return documents
+
+
+# User saves reach the index through update_user_profile, which saves the profile
+@receiver(post_save, sender=Profile)
+def index_saved_profile(sender, instance, **kwargs):
+    index_users([instance.user_id])
+
+
+@receiver(post_delete, sender=User)
+def remove_deleted_user(sender, instance, **kwargs):
+    SearchDocument.objects.filter(kind=SearchDocument.USER, object_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Lesson)
+def index_saved_lesson(sender, instance, **kwargs):
+    index_lessons([instance.pk])
+
+
+@receiver(post_delete, sender=Lesson)
+def remove_deleted_lesson(sender, instance, **kwargs):
+    SearchDocument.objects.filter(kind=SearchDocument.LESSON, object_id=instance.pk).delete()
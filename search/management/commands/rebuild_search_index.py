@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from search.index import rebuild
+
+class Command(BaseCommand):
+    help = 'Rebuild the full text search index of users and lessons'
+
+    def handle(self, *args, **options):
+        count = rebuild()
+        self.stdout.write(self.style.SUCCESS('Indexed %d documents\n' % count))
@@ -0,0 +1,27 @@
+from django.db import models
+
+
+class SearchDocument(models.Model):
+    '''
+    Searchable text of a user (profile) or lesson, indexed with the database's
+    full text search (see search.index).
+    '''
+    USER = 'user'
+    LESSON = 'lesson'
+    KIND_CHOICES = [(USER, 'User'), (LESSON, 'Lesson')]
+
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES, verbose_name="Kind")
+    object_id = models.BigIntegerField(verbose_name="Object")
+    title = models.CharField(max_length=200, blank=True, verbose_name="Title", null=True)
+    detail = models.CharField(max_length=200, blank=True, verbose_name="Detail", null=True)
+    text = models.TextField(blank=True, default='', verbose_name="Text")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='search_document_object_unique'),
+        ]
+
+    def __str__(self):
+        return "%s %s : %s" % (self.kind, self.object_id, self.title)
+
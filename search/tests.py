@@ -0,0 +1,186 @@
+import tempfile
+import unittest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from accounts.models import Profile
+from custom.testing import api_client
+from lesson.models import Lesson
+from .index import rebuild, search
+from .models import SearchDocument
+from .typeahead import PrefixIndex, check_typeahead_cache, prefix_index
+
+
+def trigram_matching():
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 34)
+    return connection.vendor == 'postgresql'
+
+
+class SearchIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create(username='teacher', email='teacher@example.com')
+        cls.teacher.profile.name = 'Ada'
+        cls.teacher.profile.surname = 'Lovelace'
+        cls.teacher.profile.identity_number = '12345678901'
+        cls.teacher.profile.save()
+        cls.algebra = Lesson.objects.create(name='Linear Algebra', description='Vectors and matrices', period='2024-1', teacher=cls.teacher)
+        cls.history = Lesson.objects.create(name='History', description='Modern history', period='2024-1', teacher=cls.teacher)
+
+    def found(self, query, kinds=None):
+        return [(document.kind, document.object_id) for document in search(query, kinds)]
+
+    def test_words(self):
+        self.assertEqual(self.found('algebra'), [(SearchDocument.LESSON, self.algebra.pk)])
+        self.assertEqual(self.found('linear matrices'), [(SearchDocument.LESSON, self.algebra.pk)])
+        # every word has to match
+        self.assertEqual(self.found('algebra modern'), [])
+        self.assertEqual(self.found('lovelace'), [(SearchDocument.USER, self.teacher.pk)])
+        self.assertEqual(self.found('12345678901'), [(SearchDocument.USER, self.teacher.pk)])
+
+    def test_kinds_and_rank(self):
+        self.assertEqual(self.found('history', [SearchDocument.USER]), [])
+        documents = search('history')
+        self.assertEqual([document.object_id for document in documents], [self.history.pk])
+        self.assertIsNotNone(documents[0].rank)
+
+    def test_substrings(self):
+        if not trigram_matching():
+            raise unittest.SkipTest('Substring matches need pg_trgm or the SQLite trigram tokenizer')
+        self.assertEqual(self.found('lgebr'), [(SearchDocument.LESSON, self.algebra.pk)])
+        self.assertEqual(self.found('velac'), [(SearchDocument.USER, self.teacher.pk)])
+
+    def test_profile_save_updates_index(self):
+        profile = self.teacher.profile
+        profile.surname = 'Byron'
+        profile.save()
+        self.assertEqual(self.found('lovelace'), [])
+        self.assertEqual(self.found('byron'), [(SearchDocument.USER, self.teacher.pk)])
+        # saving the user saves its profile
+        self.teacher.email = 'countess@example.org'
+        self.teacher.save()
+        self.assertEqual(self.found('countess'), [(SearchDocument.USER, self.teacher.pk)])
+        self.assertEqual(SearchDocument.objects.filter(kind=SearchDocument.USER, object_id=self.teacher.pk).count(), 1)
+
+    def test_lesson_save_and_delete(self):
+        self.history.name = 'Ancient Rome'
+        self.history.save()
+        self.assertEqual(self.found('rome'), [(SearchDocument.LESSON, self.history.pk)])
+        self.history.delete()
+        self.assertEqual(self.found('rome'), [])
+
+    def test_rebuild(self):
+        SearchDocument.objects.all().delete()
+        self.assertEqual(self.found('algebra'), [])
+        self.assertEqual(rebuild(), SearchDocument.objects.count())
+        self.assertEqual(self.found('algebra'), [(SearchDocument.LESSON, self.algebra.pk)])
+
+
+class SearchApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create(username='staff', is_staff=True)
+        cls.student = User.objects.create(username='student')
+        for user in (cls.staff, cls.student):
+            user.profile.name = 'Grace'
+            user.profile.save()
+        cls.lesson = Lesson.objects.create(name='Grace Notes', teacher=cls.staff)
+
+    def test_staff_find_users(self):
+        response = api_client(self.staff).get('/api/search/?q=grace')
+        self.assertEqual(sorted((row['type'], row['id']) for row in response.data['results']), [
+            (SearchDocument.LESSON, self.lesson.pk), (SearchDocument.USER, self.staff.pk), (SearchDocument.USER, self.student.pk),
+        ])
+
+    def test_others_find_lessons_only(self):
+        response = api_client(self.student).get('/api/search/?q=grace&type=user,lesson')
+        self.assertEqual([(row['type'], row['id']) for row in response.data['results']], [(SearchDocument.LESSON, self.lesson.pk)])
+
+    def test_short_query(self):
+        self.assertFalse(api_client(self.student).get('/api/search/?q=gr').data['success'])
+
+
+class PrefixIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        people = [('Ayşe', 'Yılmaz', '11111111111'), ('Ayhan', 'Demir', '22222222222'), ('Mehmet', 'Ayaz', '12345678901')]
+        cls.users = []
+        for index, (name, surname, identity_number) in enumerate(people):
+            user = User.objects.create(username='user%d' % index)
+            Profile.objects.filter(user=user).update(name=name, surname=surname, identity_number=identity_number)
+            cls.users.append(user)
+
+    def setUp(self):
+        self.index = PrefixIndex()
+
+    def found(self, query, limit=10):
+        return [result['id'] for result in self.index.lookup(query, limit)]
+
+    def test_lookup_order(self):
+        # keys in order: "ayaz" (Mehmet), "ayhan demir", "ayse yilmaz"
+        self.assertEqual(self.found('ay'), [self.users[2].pk, self.users[1].pk, self.users[0].pk])
+        self.assertEqual(self.found('ay', limit=2), [self.users[2].pk, self.users[1].pk])
+        # case and accent insensitive, word suffixes and identity numbers
+        self.assertEqual(self.found('AYSE Y'), [self.users[0].pk])
+        self.assertEqual(self.found('yilm'), [self.users[0].pk])
+        self.assertEqual(self.found('1'), [self.users[0].pk, self.users[2].pk])
+        self.assertEqual(self.index.lookup('demir')[0], {'id': self.users[1].pk, 'profile': self.users[1].profile.pk, 'full_name': 'Ayhan Demir', 'identity_number': '22222222222'})
+        self.assertEqual(self.found(''), [])
+
+    def test_incremental_changes(self):
+        self.found('ay')
+        built_at = self.index.built_at
+        profile = Profile.objects.get(user=self.users[1])
+        profile.surname = 'Kaya'
+        self.index.update(profile)
+        self.assertEqual(self.found('demir'), [])
+        self.assertEqual(self.found('kay'), [self.users[1].pk])
+        user = User.objects.create(username='new')
+        profile = Profile.objects.get(user=user)
+        profile.name = 'Aydan'
+        self.index.update(profile)
+        self.assertEqual(self.found('ayd'), [user.pk])
+        self.index.remove(self.users[0].pk)
+        self.assertEqual(self.found('ay'), [self.users[2].pk, user.pk, self.users[1].pk])
+        # changed in place, and the sorted lists stay in step
+        self.assertEqual(self.index.built_at, built_at)
+        self.assertEqual(self.index.keys, sorted(self.index.keys))
+        self.assertEqual(len(self.index.keys), len(self.index.ids))
+
+    def test_profile_signals(self):
+        prefix_index.lookup('ay')
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = self.users[2].profile
+            profile.name = 'Zeki'
+            profile.save()
+        self.assertEqual([result['id'] for result in prefix_index.lookup('zek')], [self.users[2].pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users[2].delete()
+        self.assertEqual(prefix_index.lookup('zek'), [])
+
+    @override_settings(TYPEAHEAD_SYNC_INTERVAL=0, TYPEAHEAD_LOCAL_MAX_AGE=0)
+    def test_local_cache_rebuilds_by_age(self):
+        self.found('ay')
+        # written by another process, which can not reach this one through a local memory cache
+        Profile.objects.filter(user=self.users[1]).update(name='Zeki')
+        self.index.built_at -= 1
+        self.assertEqual(self.found('zek'), [self.users[1].pk])
+
+    @override_settings(TYPEAHEAD_SYNC_INTERVAL=0, TYPEAHEAD_LOCAL_MAX_AGE=3600)
+    def test_shared_generation(self):
+        with tempfile.TemporaryDirectory() as location:
+            caches = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}
+            with override_settings(CACHES=caches):
+                self.found('ay')
+                Profile.objects.filter(user=self.users[1]).update(name='Zeki')
+                self.assertEqual(self.found('zek'), [])
+                # another process announces its change
+                PrefixIndex().changed()
+                self.assertEqual(self.found('zek'), [self.users[1].pk])
+
+    def test_check(self):
+        self.assertEqual([warning.id for warning in check_typeahead_cache(None)], ['search.W001'])
@@ -0,0 +1,251 @@
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from accounts.models import Profile
+from custom.caches import is_shared
+
+
+GENERATION_KEY = 'typeahead:generation'
+# dotless/dotted i do not decompose to i
+FOLD = str.maketrans({'ı': 'i', 'İ': 'i'})
+
+
+def normalize(text):
+    '''
+    Case and accent insensitive form of a name: "Ayşe  YILMAZ" -> "ayse yilmaz".
+    '''
+    text = unicodedata.normalize('NFKD', (text or '').translate(FOLD)).casefold()
+    return ' '.join(''.join(char for char in text if not unicodedata.combining(char)).split())
+
+
+class PrefixIndex:
+    '''
+    Per-process sorted index of profile names and identity numbers.
+
+    Every profile has a key per word suffix of its normalized full name
+    ("ayse yilmaz", "yilmaz") and its identity number; a lookup bisects to
+    the prefix and walks forward until k users are found. Keys are kept in
+    a sorted list of interned strings with a parallel array of user ids,
+    so common names are stored once. The index is built with one query at
+    first use and updated from Profile signals of this process. Saves in
+    other processes bump a generation in the shared cache, checked every
+    TYPEAHEAD_SYNC_INTERVAL seconds, which makes the index rebuild at its
+    next use. With a local memory cache the generation is not seen by the
+    other processes, so the index is instead rebuilt once it is older than
+    TYPEAHEAD_LOCAL_MAX_AGE seconds.
+    '''
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # sorted by (key, user id)
+        self.keys = []
+        self.ids = array('q')
+        # user id -> (profile id, full name, identity number)
+        self.users = {}
+        self.built = False
+        self.generation = None
+        self.checked_at = 0
+        self.built_at = None
+        self.build_seconds = None
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+
+    @staticmethod
+    def record(profile_id, name, surname, identity_number):
+        return (profile_id, ' '.join(part for part in (name, surname) if part), identity_number)
+
+    @staticmethod
+    def record_keys(record):
+        words = normalize(record[1]).split()
+        keys = {' '.join(words[index:]) for index in range(len(words))}
+        if record[2]:
+            keys.add(normalize(record[2]))
+        return [sys.intern(key) for key in keys]
+
+    def shared_generation(self):
+        return cache.get(GENERATION_KEY, 0)
+
+    def build(self):
+        started = time.monotonic()
+        generation = self.shared_generation()
+        entries = []
+        users = {}
+        rows = Profile.objects.values_list('user_id', 'pk', 'name', 'surname', 'identity_number')
+        for user_id, profile_id, name, surname, identity_number in rows.iterator(chunk_size=5000):
+            record = self.record(profile_id, name, surname, identity_number)
+            users[user_id] = record
+            entries.extend((key, user_id) for key in self.record_keys(record))
+        entries.sort()
+        self.keys = [key for key, _ in entries]
+        self.ids = array('q', (user_id for _, user_id in entries))
+        self.users = users
+        self.generation = generation
+        self.checked_at = time.monotonic()
+        self.built = True
+        self.built_at = time.time()
+        self.build_seconds = time.monotonic() - started
+
+    def ensure(self):
+        '''
+        Build the index at first use, or again when another process changed profiles.
+        '''
+        if self.built and time.monotonic() - self.checked_at > settings.TYPEAHEAD_SYNC_INTERVAL:
+            self.checked_at = time.monotonic()
+            if not is_shared():
+                if time.time() - self.built_at > settings.TYPEAHEAD_LOCAL_MAX_AGE:
+                    self.built = False
+            elif self.shared_generation() != self.generation:
+                self.built = False
+        if not self.built:
+            self.build()
+
+    def result(self, user_id):
+        profile_id, full_name, identity_number = self.users[user_id]
+        return {'id': user_id, 'profile': profile_id, 'full_name': full_name, 'identity_number': identity_number}
+
+    def lookup(self, query, limit=10):
+        '''
+        Up to `limit` users with a name word suffix or identity number starting with the query.
+        '''
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        with self.lock:
+            self.ensure()
+            started = time.perf_counter()
+            results = []
+            seen = set()
+            index = bisect_left(self.keys, prefix)
+            while index < len(self.keys) and len(results) < limit:
+                if not self.keys[index].startswith(prefix):
+                    break
+                user_id = self.ids[index]
+                if user_id not in seen:
+                    seen.add(user_id)
+                    results.append(self.result(user_id))
+                index += 1
+            self.lookups += 1
+            self.lookup_seconds += time.perf_counter() - started
+        return results
+
+    def position(self, key, user_id):
+        '''
+        Index of (key, user id) in the sorted lists, or where it belongs.
+        '''
+        index = bisect_left(self.keys, key)
+        while index < len(self.keys) and self.keys[index] == key and self.ids[index] < user_id:
+            index += 1
+        return index
+
+    def remove(self, user_id):
+        with self.lock:
+            if not self.built or user_id not in self.users:
+                return
+            for key in self.record_keys(self.users.pop(user_id)):
+                index = self.position(key, user_id)
+                if index < len(self.keys) and self.keys[index] == key and self.ids[index] == user_id:
+                    del self.keys[index]
+                    del self.ids[index]
+
+    def update(self, profile):
+        with self.lock:
+            if not self.built:
+                return
+            self.remove(profile.user_id)
+            record = self.record(profile.pk, profile.name, profile.surname, profile.identity_number)
+            self.users[profile.user_id] = record
+            for key in self.record_keys(record):
+                index = self.position(key, profile.user_id)
+                self.keys.insert(index, key)
+                self.ids.insert(index, profile.user_id)
+
+    def changed(self):
+        '''
+        Tell the other processes their index is stale.
+        '''
+        try:
+            generation = cache.incr(GENERATION_KEY)
+        except ValueError:
+            generation = 1
+            cache.set(GENERATION_KEY, generation, None)
+        with self.lock:
+            if self.generation == generation - 1:
+                # this process already applied its own change
+                self.generation = generation
+
+    def invalidate(self):
+        '''
+        Rebuild at next use here and in the other processes (writes without signals).
+        '''
+        self.changed()
+        with self.lock:
+            self.built = False
+
+    def memory(self):
+        '''
+        Approximate bytes held by the index, shared strings counted once.
+        '''
+        size = sys.getsizeof(self.keys) + sys.getsizeof(self.ids) + sys.getsizeof(self.users)
+        counted = set()
+        for key in self.keys:
+            if id(key) not in counted:
+                counted.add(id(key))
+                size += sys.getsizeof(key)
+        for record in self.users.values():
+            size += sys.getsizeof(record) + sum(sys.getsizeof(value) for value in record)
+        return size
+
+    def stats(self):
+        with self.lock:
+            self.ensure()
+            size = self.memory()
+            users = len(self.users)
+            return {
+                'users': users,
+                'keys': len(self.keys),
+                'bytes': size,
+                'bytes_per_100k_users': round(size / users * 100000) if users else None,
+                'built_at': self.built_at,
+                'build_seconds': round(self.build_seconds, 3),
+                'lookups': self.lookups,
+                'average_lookup_microseconds': round(self.lookup_seconds / self.lookups * 1e6, 1) if self.lookups else None,
+            }
+
+
+prefix_index = PrefixIndex()
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_typeahead_cache(app_configs, **kwargs):
+    if is_shared():
+        return []
+    return [checks.Warning(
+        'The default cache is local memory: profile changes reach the typeahead index of other processes '
+        'only when it is rebuilt, after TYPEAHEAD_LOCAL_MAX_AGE seconds.',
+        hint='Use a shared CACHE_BACKEND (file based, Redis, Memcached) when running several workers.',
+        id='search.W001',
+    )]
+
+
+def apply_change(change):
+    change()
+    prefix_index.changed()
+
+
+@receiver(post_save, sender=Profile)
+def update_prefix_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: apply_change(lambda: prefix_index.update(instance)))
+
+
+@receiver(post_delete, sender=Profile)
+def remove_from_prefix_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: apply_change(lambda: prefix_index.remove(instance.user_id)))
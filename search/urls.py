@@ -0,0 +1,8 @@
+from django.urls import path
+from . import api
+
+urlpatterns = [
+    path('', api.SearchViewSet.as_view({"get": "list"})),
+    path('typeahead/', api.SearchViewSet.as_view({"get": "typeahead"})),
+    path('typeahead/stats/', api.SearchViewSet.as_view({"get": "typeahead_stats"})),
+]
@@ -1,5 +1,6 @@
 from rest_framework import serializers, viewsets, permissions, generics, renderers
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from django_filters import rest_framework as filters
 from django.contrib.auth.models import User
 from custom.constants import SearchConstants
@@ -10,6 +11,9 @@ from django.contrib.admin.views.decorators import staff_member_required
 from rest_framework import permissions
 import logging
 from accounts.models import Profile
+from accounts.provisioning import UserProvisioner
+from custom.summaries import user_summaries
+from custom.rows import CSV_TYPES, NDJSON_TYPES, ROWS_PARSERS
 
 class IsAdminUser(permissions.BasePermission):
     def has_permission(self, request, view):
@@ -40,6 +44,8 @@ class UserViewSet(viewsets.ModelViewSet):
     filterset_class = UserFilter
     permission_classes = [permissions.IsAuthenticated, IsAdminUser]
     authentication_classes = [OAuth2Authentication]
+    # provision reads CSV / JSON Lines bodies lazily
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + ROWS_PARSERS
 
     # return success with message
     def success(self, message):
@@ -49,6 +55,31 @@ class UserViewSet(viewsets.ModelViewSet):
     def fail(self, message):
         return Response({'success': False, 'message': message}, status=status.HTTP_200_OK)
 
+    def provision(self, request, *args, **kwargs):
+        '''
+        Bulk create users with their profiles, streamed as CSV (text/csv, with
+        a header row) or JSON Lines (application/x-ndjson). Columns: username,
+        email, password (or password_hash), first_name, last_name, is_staff,
+        is_active and the profile fields (name, surname, dateofbirth, ...).
+        '''
+        try:
+            if request.stream is None:
+                return self.fail('Request body is empty')
+            if request.content_type.split(';')[0].strip() not in CSV_TYPES + NDJSON_TYPES:
+                return self.fail('Unsupported content type, use text/csv or application/x-ndjson')
+            rows = request.data
+            report = UserProvisioner(request.user).run(rows)
+            return Response(report)
+        except Exception as e:
+            logging.getLogger('db').exception(e)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+    def summary_cache(self, request, *args, **kwargs):
+        '''
+        Hit/miss counters of the user summary cache of the worker serving the request.
+        '''
+        return Response(user_summaries.stats())
+
     def list(self, request, *args, **kwargs):
         '''
         Get list of all users.
@@ -1,3 +1,30 @@
+import json
+from django.contrib.auth.models import User
 from django.test import TestCase
+from custom.testing import api_client
 
-# Create your tests here.
+
+class ProvisionApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_staff=True)
+
+    def setUp(self):
+        self.client = api_client(self.admin)
+
+    def test_provision_csv(self):
+        body = 'username,email,password,name\nalice,alice@example.com,secret-1,Alice\nbob,bob@example.com,secret-2,Bob\nalice,,x,\n'
+        response = self.client.post('/api/users/provision/', body, content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 1))
+        alice = User.objects.get(username='alice')
+        self.assertTrue(alice.check_password('secret-1'))
+        self.assertEqual(alice.profile.name, 'Alice')
+
+    def test_provision_ndjson(self):
+        body = '\n'.join(json.dumps({'username': 'user%d' % i, 'password': 'secret'}) for i in range(3))
+        response = self.client.post('/api/users/provision/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(User.objects.filter(username__startswith='user').count(), 3)
@@ -5,6 +5,8 @@ from accounts import api as accounts_api
 
 urlpatterns = [
     path('', api.UserViewSet.as_view({"get": "list", "post": "create"})),
+    path('provision/', api.UserViewSet.as_view({"post": "provision"})),
+    path('summary-cache/', api.UserViewSet.as_view({"get": "summary_cache"})),
     path('<int:pk>/', api.UserViewSet.as_view({"get": "retrieve", "put": "update", "delete": "destroy", "patch": "partial_update"})),
     path('profile/', accounts_api.StudentViewSet.as_view({"get": "list", "post": "create"})),
     path('profile/<int:pk>/', accounts_api.StudentViewSet.as_view({"get": "retrieve", "put": "update", "delete": "destroy", "patch": "partial_update"})),